@@ -13,4 +13,27 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aistudycompanion.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after get_asgi_application() has set Django up
+from apps.aistudycompanion.llm_client import bind_async_client, close_async_client
+
+
+async def lifespan(receive, send):
+    """Share one AsyncOpenAI client on the server's loop while it runs and close its connections when it stops."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await bind_async_client()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserProfile, Conversation, ChatMessage, StudySession, CustomLearningMaterial, DocumentChunk, RAGQuery
+from .models import UserProfile, Conversation, ChatMessage, StudySession, CustomLearningMaterial, DocumentChunk, RAGQuery, EmbeddingCache, BackgroundJob, SubjectClassification, AnswerCache, CacheCounter
 
 # Register your models here.
 
@@ -52,7 +52,7 @@ class CustomLearningMaterialAdmin(admin.ModelAdmin):
 
 @admin.register(DocumentChunk)
 class DocumentChunkAdmin(admin.ModelAdmin):
-    list_display = ['material', 'chunk_index', 'page_number', 'content_preview', 'created_at']
+    list_display = ['material', 'chunk_index', 'page_number', 'content_preview', 'embedding_dim', 'embedding_model', 'created_at']
     list_filter = ['material__document_type', 'created_at']
     search_fields = ['material__title', 'content']
     readonly_fields = ['created_at']
@@ -63,11 +63,44 @@ class DocumentChunkAdmin(admin.ModelAdmin):
 
 @admin.register(RAGQuery)
 class RAGQueryAdmin(admin.ModelAdmin):
-    list_display = ['user', 'material', 'query_preview', 'confidence_score', 'created_at']
+    list_display = ['user', 'material', 'query_preview', 'confidence_score', 'context_tokens', 'created_at']
     list_filter = ['material__document_type', 'created_at']
     search_fields = ['user__username', 'material__title', 'query', 'response']
-    readonly_fields = ['created_at']
+    readonly_fields = ['context_tokens', 'packing', 'created_at']
     
     def query_preview(self, obj):
         return obj.query[:100] + '...' if len(obj.query) > 100 else obj.query
     query_preview.short_description = 'Query'
+
+@admin.register(EmbeddingCache)
+class EmbeddingCacheAdmin(admin.ModelAdmin):
+    list_display = ['content_hash', 'model', 'embedding_dim', 'hit_count', 'last_used_at', 'created_at']
+    list_filter = ['model', 'created_at']
+    search_fields = ['content_hash']
+    readonly_fields = ['content_hash', 'model', 'embedding_dim', 'hit_count', 'last_used_at', 'created_at']
+
+@admin.register(CacheCounter)
+class CacheCounterAdmin(admin.ModelAdmin):
+    list_display = ['cache', 'key', 'hits', 'misses', 'updated_at']
+    list_filter = ['cache']
+    readonly_fields = ['cache', 'key', 'hits', 'misses', 'updated_at']
+
+@admin.register(SubjectClassification)
+class SubjectClassificationAdmin(admin.ModelAdmin):
+    list_display = ['text_hash', 'subject', 'confidence', 'hit_count', 'last_used_at', 'created_at']
+    list_filter = ['subject', 'created_at']
+    search_fields = ['text_hash']
+
+@admin.register(AnswerCache)
+class AnswerCacheAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'question', 'tokens', 'hit_count', 'last_used_at', 'created_at']
+    list_filter = ['subject', 'created_at']
+    search_fields = ['question', 'answer']
+    readonly_fields = ['question_hash', 'tokens', 'hit_count', 'last_used_at', 'created_at']
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'material', 'status', 'progress', 'attempts', 'worker_id', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'created_at']
+    search_fields = ['material__title', 'worker_id', 'error']
+    readonly_fields = ['created_at', 'updated_at', 'finished_at', 'heartbeat_at']
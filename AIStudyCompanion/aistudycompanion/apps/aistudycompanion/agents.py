@@ -1,52 +1,27 @@
 import autogen
-from typing import Dict, List, Optional
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, List, Optional
 import json
 import logging
+import threading
+from asgiref.sync import sync_to_async
 from django.conf import settings
 
+from .llm_client import acreate_chat_completion, call_with_retries, create_chat_completion, get_http_client
+
 logger = logging.getLogger(__name__)
 
-class StudyCompanionAgents:
-    
-    def __init__(self, config_list=None):
-        # Get API key from Django settings
-        api_key = getattr(settings, 'OPENAI_API_KEY', None)
-        
-        if api_key and api_key != 'your-openai-api-key-here':
-            # Use real API key if available
-            self.config_list = config_list or [
-                {
-                    "model": "gpt-3.5-turbo",
-                    "api_key": api_key
-                }
-            ]
-            self.use_real_agents = True
-        else:
-            # Fall back to mock agents if no API key
-            self.config_list = None
-            self.use_real_agents = False
-        
-        # Initialize agents
-        if self.use_real_agents:
-            self.subject_agents = self._create_subject_agents()
-            self.coordinator_agent = self._create_coordinator_agent()
-            
-            # Create group chats
-            self.subject_group = self._create_subject_group()
-        else:
-            # Mock agents for testing
-            self.subject_agents = {}
-            self.coordinator_agent = None
-    
-    def _create_subject_agents(self) -> Dict[str, autogen.AssistantAgent]:
-        """Create specialized agents for different subjects."""
-        
-        agents = {}
-        
-        # Math Agent
-        agents['math'] = autogen.AssistantAgent(
-            name="MathTutor",
-            system_message="""You are an expert mathematics tutor specializing in:
+NO_RESPONSE = "I'm sorry, I couldn't generate a response. Please try again."
+
+# 'direct': one chat completion per question; 'agent': a full autogen conversation
+SUBJECT_HELP_MODES = ('direct', 'agent')
+
+# Subject agent names and system prompts; agents are built from these on first use
+SUBJECT_AGENT_SPECS = {
+    # Math Agent
+    'math': (
+        "MathTutor",
+        """You are an expert mathematics tutor specializing in:
             - Algebra (linear equations, quadratic equations, polynomials)
             - Calculus (derivatives, integrals, limits)
             - Geometry (triangles, circles, polygons, 3D shapes)
@@ -60,14 +35,13 @@ class StudyCompanionAgents:
             Always encourage students to understand the concepts, not just memorize formulas.
             Use real-world examples to make math relatable and interesting.
             
-            If asked about non-educational topics, respond: "I'm here to help with mathematics education only. Please ask me about math concepts, problems, or educational topics." """,
-            llm_config={"config_list": self.config_list}
-        )
-        
-        # Science Agent
-        agents['science'] = autogen.AssistantAgent(
-            name="ScienceGuide",
-            system_message="""You are an expert science tutor covering:
+            If asked about non-educational topics, respond: "I'm here to help with mathematics education only. Please ask me about math concepts, problems, or educational topics." """
+    ),
+
+    # Science Agent
+    'science': (
+        "ScienceGuide",
+        """You are an expert science tutor covering:
             - Physics (mechanics, thermodynamics, electricity, waves, motion, forces, energy)
             - Chemistry (atomic structure, chemical reactions, organic chemistry, materials)
             - Biology (cell biology, genetics, evolution, ecology, human body, plants, animals)
@@ -83,14 +57,13 @@ class StudyCompanionAgents:
             Connect scientific principles to everyday phenomena.
             For transport-related questions, explain the science behind how different vehicles work, their energy sources, and the physics involved.
             
-            If asked about non-educational topics, respond: "I'm here to help with science education only. Please ask me about scientific concepts, experiments, or educational topics." """,
-            llm_config={"config_list": self.config_list}
-        )
-        
-        # English Agent
-        agents['english'] = autogen.AssistantAgent(
-            name="EnglishMentor",
-            system_message="""You are an expert English language and literature tutor specializing in:
+            If asked about non-educational topics, respond: "I'm here to help with science education only. Please ask me about scientific concepts, experiments, or educational topics." """
+    ),
+
+    # English Agent
+    'english': (
+        "EnglishMentor",
+        """You are an expert English language and literature tutor specializing in:
             - Grammar and punctuation
             - Essay writing and composition
             - Literary analysis and interpretation
@@ -105,14 +78,13 @@ class StudyCompanionAgents:
             Provide constructive feedback and writing tips.
             Make literature engaging and accessible.
             
-            If asked about non-educational topics, respond: "I'm here to help with English language and literature education only. Please ask me about grammar, writing, literature, or educational topics." """,
-            llm_config={"config_list": self.config_list}
-        )
-        
-        # History Agent
-        agents['history'] = autogen.AssistantAgent(
-            name="HistoryScholar",
-            system_message="""You are an expert history tutor covering:
+            If asked about non-educational topics, respond: "I'm here to help with English language and literature education only. Please ask me about grammar, writing, literature, or educational topics." """
+    ),
+
+    # History Agent
+    'history': (
+        "HistoryScholar",
+        """You are an expert history tutor covering:
             - World History (ancient civilizations, medieval period, modern era)
             - American History (colonial period, revolution, civil war, modern times)
             - European History (Renaissance, Enlightenment, Industrial Revolution)
@@ -125,14 +97,13 @@ class StudyCompanionAgents:
             Help students understand cause and effect relationships.
             Encourage critical analysis of historical events and sources.
             
-            If asked about non-educational topics, respond: "I'm here to help with history education only. Please ask me about historical events, figures, or educational topics." """,
-            llm_config={"config_list": self.config_list}
-        )
-        
-        # Computer Science Agent
-        agents['computer_science'] = autogen.AssistantAgent(
-            name="CodeMentor",
-            system_message="""You are an expert computer science tutor specializing in:
+            If asked about non-educational topics, respond: "I'm here to help with history education only. Please ask me about historical events, figures, or educational topics." """
+    ),
+
+    # Computer Science Agent
+    'computer_science': (
+        "CodeMentor",
+        """You are an expert computer science tutor specializing in:
             - Programming fundamentals (variables, loops, functions)
             - Python programming language
             - Data structures and algorithms
@@ -147,14 +118,13 @@ class StudyCompanionAgents:
             Help students develop problem-solving skills.
             Explain complex concepts with simple analogies.
             
-            If asked about non-educational topics, respond: "I'm here to help with computer science education only. Please ask me about programming, algorithms, or educational topics." """,
-            llm_config={"config_list": self.config_list}
-        )
-        
-        # Geography Agent
-        agents['geography'] = autogen.AssistantAgent(
-            name="GeoExplorer",
-            system_message="""You are an expert geography tutor specializing in:
+            If asked about non-educational topics, respond: "I'm here to help with computer science education only. Please ask me about programming, algorithms, or educational topics." """
+    ),
+
+    # Geography Agent
+    'geography': (
+        "GeoExplorer",
+        """You are an expert geography tutor specializing in:
             - Physical geography (landforms, climate, ecosystems, natural resources)
             - Human geography (population, culture, economic activities, urban development)
             - World regions and countries
@@ -169,14 +139,13 @@ class StudyCompanionAgents:
             Connect geographical concepts to current events.
             Help students understand the relationship between people and their environment.
             
-            If asked about non-educational topics, respond: "I'm here to help with geography education only. Please ask me about geographical concepts, maps, or educational topics." """,
-            llm_config={"config_list": self.config_list}
-        )
-        
-        # Economics Agent
-        agents['economics'] = autogen.AssistantAgent(
-            name="EconAdvisor",
-            system_message="""You are an expert economics tutor specializing in:
+            If asked about non-educational topics, respond: "I'm here to help with geography education only. Please ask me about geographical concepts, maps, or educational topics." """
+    ),
+
+    # Economics Agent
+    'economics': (
+        "EconAdvisor",
+        """You are an expert economics tutor specializing in:
             - Microeconomics (supply and demand, market structures, consumer behavior)
             - Macroeconomics (GDP, inflation, unemployment, fiscal policy, monetary policy)
             - Economic systems (capitalism, socialism, mixed economies)
@@ -191,14 +160,13 @@ class StudyCompanionAgents:
             Help students understand how economics affects daily life.
             Explain complex economic theories in simple terms.
             
-            If asked about non-educational topics, respond: "I'm here to help with economics education only. Please ask me about economic concepts, markets, or educational topics." """,
-            llm_config={"config_list": self.config_list}
-        )
-        
-        # Psychology Agent
-        agents['psychology'] = autogen.AssistantAgent(
-            name="PsychGuide",
-            system_message="""You are an expert psychology tutor specializing in:
+            If asked about non-educational topics, respond: "I'm here to help with economics education only. Please ask me about economic concepts, markets, or educational topics." """
+    ),
+
+    # Psychology Agent
+    'psychology': (
+        "PsychGuide",
+        """You are an expert psychology tutor specializing in:
             - Cognitive psychology (memory, learning, thinking, problem-solving)
             - Developmental psychology (child development, adolescence, aging)
             - Social psychology (group behavior, attitudes, social influence)
@@ -213,14 +181,13 @@ class StudyCompanionAgents:
             Use relatable examples to explain psychological concepts.
             Encourage critical thinking about psychological research.
             
-            If asked about non-educational topics, respond: "I'm here to help with psychology education only. Please ask me about psychological concepts, behavior, or educational topics." """,
-            llm_config={"config_list": self.config_list}
-        )
-    
-        # Philosophy Agent
-        agents['philosophy'] = autogen.AssistantAgent(
-            name="Philosopher",
-            system_message="""You are an expert philosophy tutor specializing in:
+            If asked about non-educational topics, respond: "I'm here to help with psychology education only. Please ask me about psychological concepts, behavior, or educational topics." """
+    ),
+
+    # Philosophy Agent
+    'philosophy': (
+        "Philosopher",
+        """You are an expert philosophy tutor specializing in:
             - Ethics and moral philosophy
             - Logic and critical thinking
             - Metaphysics (nature of reality, existence, time)
@@ -235,14 +202,13 @@ class StudyCompanionAgents:
             Help students develop logical reasoning skills.
             Connect philosophical ideas to everyday life.
             
-            If asked about non-educational topics, respond: "I'm here to help with philosophy education only. Please ask me about philosophical concepts, ethics, or educational topics." """,
-            llm_config={"config_list": self.config_list}
-        )
-        
-        # Arts Agent
-        agents['arts'] = autogen.AssistantAgent(
-            name="ArtMentor",
-            system_message="""You are an expert arts tutor specializing in:
+            If asked about non-educational topics, respond: "I'm here to help with philosophy education only. Please ask me about philosophical concepts, ethics, or educational topics." """
+    ),
+
+    # Arts Agent
+    'arts': (
+        "ArtMentor",
+        """You are an expert arts tutor specializing in:
             - Visual arts (painting, sculpture, drawing, photography)
             - Music (theory, history, composition, performance)
             - Theater and drama (acting, directing, stagecraft)
@@ -257,11 +223,113 @@ class StudyCompanionAgents:
             Connect art to culture and history.
             Encourage creative thinking and self-expression.
             
-            If asked about non-educational topics, respond: "I'm here to help with arts education only. Please ask me about artistic concepts, techniques, or educational topics." """,
-            llm_config={"config_list": self.config_list}
-        )
+            If asked about non-educational topics, respond: "I'm here to help with arts education only. Please ask me about artistic concepts, techniques, or educational topics." """
+    ),
+}
+
+
+class StudyCompanionAgents:
+    """Subject tutors, built lazily and safe to share between requests and threads.
+
+    Agents are created on first use and cached on the instance; use
+    ``get_study_agents()`` for the process-wide registry. Per-conversation state
+    lives with a ``UserProxyAgent`` created for each call and is dropped from the
+    shared agent once the call finishes.
+    """
+    
+    def __init__(self, config_list=None):
+        # Get API key from Django settings
+        api_key = getattr(settings, 'OPENAI_API_KEY', None)
         
-        return agents
+        if config_list or (api_key and api_key != 'your-openai-api-key-here'):
+            # Use real API key if available
+            self.config_list = config_list or [
+                {
+                    "model": "gpt-3.5-turbo",
+                    "api_key": api_key
+                }
+            ]
+            self.use_real_agents = True
+        else:
+            # Fall back to mock agents if no API key
+            self.config_list = None
+            self.use_real_agents = False
+        
+        self.subject_agents: Dict[str, autogen.AssistantAgent] = {}
+        self._coordinator_agent = None
+        self._subject_group = None
+        self._lock = threading.Lock()
+    
+    def get_agent(self, subject: str) -> Optional[autogen.AssistantAgent]:
+        """Return the agent for a subject, building it on first use; None for unknown subjects."""
+        if not self.use_real_agents or subject not in SUBJECT_AGENT_SPECS:
+            return None
+        agent = self.subject_agents.get(subject)
+        if agent is None:
+            with self._lock:
+                agent = self.subject_agents.get(subject)
+                if agent is None:
+                    agent = self._create_subject_agent(subject)
+                    self.subject_agents[subject] = agent
+        return agent
+    
+    @property
+    def coordinator_agent(self) -> Optional[autogen.AssistantAgent]:
+        if not self.use_real_agents:
+            return None
+        if self._coordinator_agent is None:
+            with self._lock:
+                if self._coordinator_agent is None:
+                    self._coordinator_agent = self._create_coordinator_agent()
+        return self._coordinator_agent
+    
+    @property
+    def subject_group(self) -> Optional[autogen.GroupChat]:
+        """Group chat over the coordinator and every subject agent; builds all of them."""
+        if not self.use_real_agents:
+            return None
+        if self._subject_group is None:
+            self.build_all()
+        return self._subject_group
+    
+    def build_all(self):
+        """Eagerly build every agent and the group chat, as each request used to."""
+        for subject in SUBJECT_AGENT_SPECS:
+            self.get_agent(subject)
+        coordinator = self.coordinator_agent
+        with self._lock:
+            if self._subject_group is None and coordinator is not None:
+                self._subject_group = self._create_subject_group()
+    
+    def _create_subject_agent(self, subject: str) -> autogen.AssistantAgent:
+        """Create the specialized agent for one subject."""
+        name, system_message = SUBJECT_AGENT_SPECS[subject]
+        return autogen.AssistantAgent(
+            name=name,
+            system_message=system_message,
+            llm_config=self._llm_config()
+        )
+    
+    def _create_user_proxy(self, name: str) -> autogen.UserProxyAgent:
+        return autogen.UserProxyAgent(
+            name=name,
+            human_input_mode="NEVER",
+            max_consecutive_auto_reply=1,
+            llm_config=self._llm_config()
+        )
+    
+    @contextmanager
+    def _session(self, agent: autogen.AssistantAgent, name: str):
+        """Yield a fresh user proxy, then drop everything the shared agent stored about it."""
+        user_proxy = self._create_user_proxy(name)
+        try:
+            yield user_proxy
+        finally:
+            # Shared agents key history and reply counters by sender; without this they
+            # would grow by one entry per request
+            for state in (agent._oai_messages, agent._consecutive_auto_reply_counter,
+                          agent._max_consecutive_auto_reply_dict, agent.reply_at_receive):
+                state.pop(user_proxy, None)
     
     def _create_coordinator_agent(self) -> autogen.AssistantAgent:
         """Create a coordinator agent to manage interactions between agents."""
@@ -285,7 +353,7 @@ class StudyCompanionAgents:
             5. Maintain context across different study sessions
             
             If asked about non-educational topics, respond: "I'm here to help with education only. Please ask me about academic subjects, study techniques, or educational topics." """,
-            llm_config={"config_list": self.config_list}
+            llm_config=self._llm_config()
         )
     
     def _create_subject_group(self) -> autogen.GroupChat:
@@ -299,33 +367,52 @@ class StudyCompanionAgents:
             max_round=10
         )
     
-    def get_subject_help(self, subject: str, question: str) -> str:
-        """Get help from a specific subject agent."""
+    def subject_help_mode(self, subject: str) -> str:
+        """How a subject is answered: 'agent' (autogen conversation, the default) or 'direct' (one chat completion).
+
+        ``SUBJECT_HELP_MODES`` overrides ``SUBJECT_HELP_MODE`` per subject.
+        """
+        mode = getattr(settings, 'SUBJECT_HELP_MODES', {}).get(subject) or getattr(settings, 'SUBJECT_HELP_MODE', 'agent')
+        if mode not in SUBJECT_HELP_MODES:
+            raise ValueError(f"Unknown subject help mode {mode!r} for {subject}; expected one of {SUBJECT_HELP_MODES}")
+        return mode
+    
+    def get_subject_help(self, subject: str, question: str, mode: Optional[str] = None) -> str:
+        """Get help from a specific subject agent.
+
+        In 'direct' mode the agent's system message and the student prompt are sent as a
+        single chat completion. 'agent' mode runs an autogen conversation, which costs
+        extra model turns (the proxy replies once and the tutor answers again) and returns
+        the tutor's first reply. ``mode`` defaults to ``subject_help_mode(subject)``.
+        """
         
         if not self.use_real_agents:
             return "An OpenAI API key is required for subject help. Please set OPENAI_API_KEY in your Django settings."
-        
-        if subject not in self.subject_agents:
+        if subject not in SUBJECT_AGENT_SPECS:
             return f"Sorry, I don't have a specialized agent for {subject}. Please try asking about math, science, english, history, computer_science, geography, economics, psychology, philosophy, or arts."
         
-        agent = self.subject_agents[subject]
+        if (mode or self.subject_help_mode(subject)) == 'direct':
+            response = create_chat_completion(
+                model=self.config_list[0].get("model", "gpt-3.5-turbo"),
+                messages=self.direct_messages(subject, question)
+            )
+            content = response.choices[0].message.content
+            return content.strip() if content else NO_RESPONSE
         
+        agent = self.get_agent(subject)
         # Create a user proxy for the interaction
-        user_proxy = autogen.UserProxyAgent(
-            name="Student",
-            human_input_mode="NEVER",
-            max_consecutive_auto_reply=1,
-            llm_config={"config_list": self.config_list}
-        )
-        
-        # Start the conversation
-        user_proxy.initiate_chat(
-            agent,
-            message=f"Student question: {question}\n\nPlease provide a comprehensive, educational response suitable for a student."
-        )
-        
-        # Get the response
-        messages = user_proxy.chat_messages[agent]
+        with self._session(agent, "Student") as user_proxy:
+            # Start the conversation
+            # Through the circuit breaker, so agents fail fast while the API is down
+            call_with_retries(
+                user_proxy.initiate_chat,
+                agent,
+                message=self._student_message(question),
+                max_retries=0
+            )
+            
+            # Get the response
+            messages = user_proxy.chat_messages[agent]
         if messages:
             # Find the first message from the tutor agent (role 'user', name matches)
             agent_name = getattr(agent, 'name', '').lower()
@@ -339,7 +426,78 @@ class StudyCompanionAgents:
             # Fallback: first message
             return messages[0]['content']
         
-        return "I'm sorry, I couldn't generate a response. Please try again."
+        return NO_RESPONSE
+    
+    async def aget_subject_help(self, subject: str, question: str) -> str:
+        """Async subject help for ASGI views, as one AsyncOpenAI call with the agent's system message.
+
+        autogen 0.2 agents are synchronous, so subjects in 'agent' mode run
+        ``get_subject_help`` in a worker thread.
+        """
+        if not self.use_real_agents:
+            return "An OpenAI API key is required for subject help. Please set OPENAI_API_KEY in your Django settings."
+        if subject not in SUBJECT_AGENT_SPECS:
+            return f"Sorry, I don't have a specialized agent for {subject}. Please try asking about math, science, english, history, computer_science, geography, economics, psychology, philosophy, or arts."
+        if self.subject_help_mode(subject) == 'agent':
+            return await sync_to_async(self.get_subject_help, thread_sensitive=False)(subject, question, mode='agent')
+        
+        response = await acreate_chat_completion(
+            model=self.config_list[0].get("model", "gpt-3.5-turbo"),
+            messages=self.direct_messages(subject, question)
+        )
+        content = response.choices[0].message.content
+        return content.strip() if content else NO_RESPONSE
+    
+    async def astream_subject_help(self, subject: str, question: str) -> AsyncIterator[str]:
+        """Yield a subject agent's answer as text deltas while the model generates it.
+
+        autogen 0.2 cannot stream, so this sends the agent's system message and the
+        same student prompt straight to the chat completions API through AsyncOpenAI;
+        the result is the agent's first reply in ``get_subject_help``. Canned replies and
+        subjects in 'agent' mode yield the whole answer of ``aget_subject_help`` at once.
+        """
+        if not self.can_answer(subject) or self.subject_help_mode(subject) == 'agent':
+            yield await self.aget_subject_help(subject, question)
+            return
+        
+        stream = await acreate_chat_completion(
+            model=self.config_list[0].get("model", "gpt-3.5-turbo"),
+            messages=self.direct_messages(subject, question),
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    def _llm_config(self) -> Dict:
+        # autogen passes these through to its OpenAI client, so agent calls share the pooled
+        # connections and timeout; the SDK retries them since autogen does not use call_with_retries
+        return {
+            "config_list": self.config_list,
+            "http_client": get_http_client(),
+            "timeout": getattr(settings, 'LLM_TIMEOUT', 30.0),
+            "max_retries": getattr(settings, 'LLM_MAX_RETRIES', 2),
+        }
+    
+    @staticmethod
+    def _student_message(question: str) -> str:
+        return f"Student question: {question}\n\nPlease provide a comprehensive, educational response suitable for a student."
+    
+    def can_answer(self, subject: str) -> bool:
+        """Whether ``subject`` is answered by a model call rather than a canned message."""
+        return self.use_real_agents and subject in SUBJECT_AGENT_SPECS
+    
+    def direct_messages(self, subject: str, question: str) -> List[Dict]:
+        """Chat messages equivalent to the agent's first turn in ``get_subject_help``.
+
+        Direct mode sends these as the prompt; callers also use them to estimate what a
+        subject-help call costs in tokens.
+        """
+        _, system_message = SUBJECT_AGENT_SPECS[subject]
+        return [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": self._student_message(question)},
+        ]
     
     def get_study_recommendations(self, subjects: List[str], performance_data: Dict = None) -> Dict:
         """Get personalized study recommendations based on subjects and performance."""
@@ -374,19 +532,14 @@ class StudyCompanionAgents:
         }}
         """
         
-        user_proxy = autogen.UserProxyAgent(
-            name="RecommendationEngine",
-            human_input_mode="NEVER",
-            max_consecutive_auto_reply=1,
-            llm_config={"config_list": self.config_list}
-        )
-        
-        user_proxy.initiate_chat(
-            self.coordinator_agent,
-            message=recommendations_prompt
-        )
-        
-        messages = user_proxy.chat_messages[self.coordinator_agent]
+        coordinator = self.coordinator_agent
+        with self._session(coordinator, "RecommendationEngine") as user_proxy:
+            user_proxy.initiate_chat(
+                coordinator,
+                message=recommendations_prompt
+            )
+            
+            messages = user_proxy.chat_messages[coordinator]
         if messages:
             response = messages[-1]['content']
             try:
@@ -394,4 +547,18 @@ class StudyCompanionAgents:
             except json.JSONDecodeError:
                 return {"raw_recommendations": response}
         
-        return {"error": "Failed to generate recommendations"} 
\ No newline at end of file
+        return {"error": "Failed to generate recommendations"} 
+
+
+_study_agents = None
+_study_agents_lock = threading.Lock()
+
+
+def get_study_agents() -> StudyCompanionAgents:
+    """Return the process-wide agent registry so agents are built once, not per request."""
+    global _study_agents
+    if _study_agents is None:
+        with _study_agents_lock:
+            if _study_agents is None:
+                _study_agents = StudyCompanionAgents()
+    return _study_agents
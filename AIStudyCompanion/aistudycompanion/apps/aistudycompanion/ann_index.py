@@ -0,0 +1,377 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; index writes are then only serialized within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per batch when assigning vectors to centroids, bounds temporary memory
+ASSIGN_BATCH_SIZE = 8192
+
+# Chunks unpacked per step when adding a document to existing indexes
+ADD_BATCH_SIZE = 1000
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Return the index of the most similar centroid for every row."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BATCH_SIZE):
+        batch = vectors[start:start + ASSIGN_BATCH_SIZE]
+        assignments[start:start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
+
+
+def _top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    if not len(scores) or k <= 0:
+        return []
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    ordered = candidates[np.argsort(-scores[candidates], kind='stable')]
+    return [(int(ids[i]), float(scores[i])) for i in ordered]
+
+
+class IVFIndex:
+    """Inverted-file index over unit vectors, trained with spherical k-means.
+
+    Instances are treated as immutable: ``with_added`` and ``without`` return new
+    indexes, so a search running in another thread never sees half-applied changes.
+    """
+
+    def __init__(self, centroids: np.ndarray, ids: np.ndarray, material_ids: np.ndarray,
+                 vectors: np.ndarray, assignments: np.ndarray, trained_size: int):
+        self.centroids = centroids
+        self.ids = ids
+        self.material_ids = material_ids
+        self.vectors = vectors
+        self.assignments = assignments
+        self.trained_size = trained_size
+
+        # Rows grouped by list so a probe is a contiguous slice of ``_order``
+        self._order = np.argsort(assignments, kind='stable')
+        self._offsets = np.searchsorted(assignments[self._order], np.arange(len(centroids) + 1))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def signature(self) -> Tuple:
+        """(count, highest id), comparable with the chunk-table aggregate used by the search engine."""
+        return (len(self.ids), int(self.ids.max()) if len(self.ids) else None)
+
+    @classmethod
+    def train(cls, ids: np.ndarray, material_ids: np.ndarray, vectors: np.ndarray,
+              nlist: Optional[int] = None, iterations: int = 10, sample_size: int = 20000,
+              seed: int = 0) -> 'IVFIndex':
+        """Cluster unit vectors into ``nlist`` lists (default sqrt(n)) and assign every row."""
+        count = len(vectors)
+        nlist = max(1, min(nlist or int(np.sqrt(count)), count))
+        rng = np.random.default_rng(seed)
+
+        sample = vectors
+        if count > sample_size:
+            sample = vectors[rng.choice(count, sample_size, replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = _assign(sample, centroids)
+            order = np.argsort(labels, kind='stable')
+            sizes = np.bincount(labels, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+            empty = sizes == 0
+            sums = np.zeros_like(centroids)
+            # reduceat sums each list's contiguous run; empty lists would alias a neighbour, so skip them
+            sums[~empty] = np.add.reduceat(sample[order], starts[~empty], axis=0)
+            if empty.any():
+                # Reseed empty lists from random sample points
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        return cls(centroids, ids, material_ids, vectors, _assign(vectors, centroids), count)
+
+    def needs_retrain(self, corpus_size: int) -> bool:
+        """Lists drift as the corpus grows, retrain once it has doubled since the last training."""
+        return corpus_size > 2 * max(self.trained_size, 1)
+
+    def with_added(self, ids: np.ndarray, material_ids: np.ndarray, vectors: np.ndarray) -> 'IVFIndex':
+        """Return a copy with new rows appended to their nearest lists; existing ids are replaced."""
+        base = self.without(ids=ids) if np.isin(ids, self.ids).any() else self
+        return IVFIndex(
+            base.centroids,
+            np.concatenate([base.ids, ids]),
+            np.concatenate([base.material_ids, material_ids]),
+            np.concatenate([base.vectors, vectors]),
+            np.concatenate([base.assignments, _assign(vectors, base.centroids)]),
+            base.trained_size,
+        )
+
+    def without(self, ids: Optional[Iterable[int]] = None, material_id: Optional[int] = None) -> 'IVFIndex':
+        """Return a copy with the given chunk ids, or every row of a material, removed."""
+        keep = np.ones(len(self.ids), dtype=bool)
+        if ids is not None:
+            keep &= ~np.isin(self.ids, np.asarray(list(ids), dtype=np.int64))
+        if material_id is not None:
+            keep &= self.material_ids != material_id
+        if keep.all():
+            return self
+        return IVFIndex(self.centroids, self.ids[keep], self.material_ids[keep],
+                        self.vectors[keep], self.assignments[keep], self.trained_size)
+
+    def search(self, query_vector: np.ndarray, k: int, nprobe: int,
+               material_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Score only the rows in the ``nprobe`` lists closest to the query."""
+        if not len(self) or query_vector.shape[0] != self.vectors.shape[1]:
+            return []
+
+        nprobe = max(1, min(nprobe, self.nlist))
+        centroid_scores = self.centroids @ query_vector
+        if nprobe < self.nlist:
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(self.nlist)
+        rows = np.concatenate([self._order[self._offsets[p]:self._offsets[p + 1]] for p in probes])
+
+        if material_id is not None:
+            rows = rows[self.material_ids[rows] == material_id]
+        winners = _top_k(self.ids[rows], self.vectors[rows] @ query_vector, k)
+
+        if material_id is not None and len(winners) < k:
+            # A small material may barely appear in the probed lists; score it exhaustively
+            rows = np.flatnonzero(self.material_ids == material_id)
+            winners = _top_k(self.ids[rows], self.vectors[rows] @ query_vector, k)
+        return winners
+
+    def save(self, path: Path):
+        """Write the index atomically so readers never load a partial file."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp.npz")
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            ids=self.ids,
+            material_ids=self.material_ids,
+            vectors=self.vectors,
+            assignments=self.assignments,
+            trained_size=np.int64(self.trained_size),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'IVFIndex':
+        with np.load(path) as data:
+            return cls(data['centroids'], data['ids'], data['material_ids'], data['vectors'],
+                       data['assignments'], int(data['trained_size']))
+
+
+class ANNIndexManager:
+    """Loads, caches and persists IVF indexes under ``MEDIA_ROOT/ann_indexes``.
+
+    Indexes are scoped either per user or per learning material (``RAG_ANN_SCOPE``).
+    The file on disk is the source of truth; the in-process copy is reloaded whenever
+    the file's modification time changes.
+
+    Updates read an index, change it and write it back, so they run under ``locked``:
+    a per-index lock between threads plus an ``flock`` on a lock file next to the index
+    between processes (web workers and ``run_jobs``). Where ``fcntl`` is missing only
+    one writing process is supported.
+    """
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = Path(root or Path(settings.MEDIA_ROOT) / 'ann_indexes')
+        self._cache = {}
+        self._lock = threading.RLock()
+        self._writer_locks = {}
+        self._lock_files = {}
+
+    def index_path(self, scope: str, owner_id: int) -> Path:
+        return self.root / f"{scope}_{owner_id}.npz"
+
+    @contextmanager
+    def locked(self, scope: str, owner_id: int):
+        """Hold the writer lock of one index for a read-modify-write; re-entrant within a thread."""
+        path = self.index_path(scope, owner_id)
+        with self._lock:
+            writer_lock = self._writer_locks.setdefault(path, threading.RLock())
+        with writer_lock:
+            # Only the thread holding writer_lock touches this path's entry
+            held = self._lock_files.get(path)
+            if held is not None:
+                held[1] += 1
+                try:
+                    yield
+                finally:
+                    held[1] -= 1
+                return
+
+            handle = None
+            if fcntl is not None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                handle = open(path.with_suffix('.lock'), 'a')
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            self._lock_files[path] = [handle, 1]
+            try:
+                yield
+            finally:
+                del self._lock_files[path]
+                if handle is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+                    handle.close()
+
+    def get(self, scope: str, owner_id: int) -> Optional[IVFIndex]:
+        path = self.index_path(scope, owner_id)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            with self._lock:
+                self._cache.pop(path, None)
+            return None
+
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            try:
+                index = IVFIndex.load(path)
+            except Exception as e:
+                logger.error(f"Error loading ANN index {path}: {e}")
+                return None
+            self._cache[path] = (mtime, index)
+            return index
+
+    def put(self, scope: str, owner_id: int, index: IVFIndex):
+        path = self.index_path(scope, owner_id)
+        with self._lock:
+            index.save(path)
+            self._cache[path] = (path.stat().st_mtime_ns, index)
+
+    def build(self, scope: str, owner_id: int, ids: np.ndarray, material_ids: np.ndarray,
+              vectors: np.ndarray) -> IVFIndex:
+        index = IVFIndex.train(
+            ids, material_ids, vectors,
+            nlist=getattr(settings, 'RAG_ANN_NLIST', 0) or None,
+            iterations=getattr(settings, 'RAG_ANN_TRAIN_ITERATIONS', 10),
+        )
+        self.put(scope, owner_id, index)
+        logger.info(f"Built ANN index {scope}_{owner_id}: {len(index)} vectors in {index.nlist} lists")
+        return index
+
+    def delete(self, scope: str, owner_id: int):
+        path = self.index_path(scope, owner_id)
+        with self._lock:
+            self._cache.pop(path, None)
+            if path.exists():
+                path.unlink()
+
+    def add_chunks(self, user_id: int, material_id: int, chunks):
+        """Insert freshly embedded chunks into every existing index that covers them.
+
+        ``chunks`` may be a lazy queryset iterator: nothing is read while ANN search is
+        off or when no index covers the material, and rows are unpacked straight into
+        float32 arrays ``ADD_BATCH_SIZE`` at a time.
+        """
+        if not getattr(settings, 'RAG_ANN_ENABLED', False):
+            return
+        scopes = [(scope, owner_id) for scope, owner_id in (('user', user_id), ('material', material_id))
+                  if self.index_path(scope, owner_id).exists()]
+        if not scopes:
+            return
+
+        id_batches = []
+        vector_batches = []
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= ADD_BATCH_SIZE:
+                self._add_batch(batch, id_batches, vector_batches)
+                batch = []
+        self._add_batch(batch, id_batches, vector_batches)
+        if not id_batches:
+            return
+
+        ids = np.concatenate(id_batches)
+        vectors = np.concatenate(vector_batches)
+        material_ids = np.full(len(ids), material_id, dtype=np.int64)
+        for scope, owner_id in scopes:
+            with self.locked(scope, owner_id):
+                index = self.get(scope, owner_id)
+                if index is not None and index.vectors.shape[1] == vectors.shape[1]:
+                    self.put(scope, owner_id, index.with_added(ids, material_ids, vectors))
+
+    @staticmethod
+    def _add_batch(chunks, id_batches: List[np.ndarray], vector_batches: List[np.ndarray]):
+        """Append the ids and unit vectors of embedded chunks whose dimension matches the first batch."""
+        dimension = vector_batches[0].shape[1] if vector_batches else None
+        ids = []
+        vectors = []
+        for chunk in chunks:
+            vector = chunk.get_embedding() if chunk.id is not None else None
+            if vector is None or not len(vector):
+                continue
+            if dimension is None:
+                dimension = len(vector)
+            if len(vector) == dimension:
+                ids.append(chunk.id)
+                vectors.append(vector)
+        if not ids:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors /= norms
+        id_batches.append(np.asarray(ids, dtype=np.int64))
+        vector_batches.append(vectors)
+
+    def remove_chunks(self, user_id: int, material_id: int, chunk_ids: Iterable[int]):
+        """Drop specific chunk ids from the indexes that cover a material."""
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return
+        for scope, owner_id in (('user', user_id), ('material', material_id)):
+            with self.locked(scope, owner_id):
+                index = self.get(scope, owner_id)
+                if index is not None:
+                    updated = index.without(ids=chunk_ids)
+                    if updated is not index:
+                        self.put(scope, owner_id, updated)
+
+    def remove_material(self, user_id: int, material_id: int):
+        """Forget a deleted material: drop its rows from the user index and its own index file."""
+        with self.locked('user', user_id):
+            index = self.get('user', user_id)
+            if index is not None:
+                updated = index.without(material_id=material_id)
+                if updated is not index:
+                    self.put('user', user_id, updated)
+        with self.locked('material', material_id):
+            self.delete('material', material_id)
+
+
+_ann_manager = None
+_ann_manager_lock = threading.Lock()
+
+
+def get_ann_manager() -> ANNIndexManager:
+    """Return the process-wide ANN index manager."""
+    global _ann_manager
+    if _ann_manager is None:
+        with _ann_manager_lock:
+            if _ann_manager is None:
+                _ann_manager = ANNIndexManager()
+    return _ann_manager
@@ -0,0 +1,246 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .embedding_cache import lookup_totals, normalize_query, record_lookups
+from .models import AnswerCache, pack_embedding, unpack_embedding
+from .rag_service import RAGService
+
+logger = logging.getLogger(__name__)
+
+# Integers and decimals, e.g. 12, 3.5 or 1,000
+NUMBER_PATTERN = re.compile(r'\d+(?:[.,]\d+)*')
+
+
+def question_hash(question: str) -> str:
+    return hashlib.sha256(normalize_query(question).encode('utf-8')).hexdigest()
+
+
+def question_numbers(question: str) -> Tuple[str, ...]:
+    """The numbers in a question, in order; questions that differ in them need different answers."""
+    return tuple(NUMBER_PATTERN.findall(normalize_query(question)))
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough token count (about four characters per token for English)."""
+    return sum(len(text) for text in texts) // 4
+
+
+class CachedAnswer(NamedTuple):
+    id: int
+    answer: str
+    similarity: float
+    tokens: int
+
+    def metadata(self) -> Dict:
+        """Fields recorded in ChatMessage.metadata for a cache hit."""
+        return {
+            'cached': True,
+            'answer_cache_id': self.id,
+            'cache_similarity': round(self.similarity, 4),
+            'tokens_saved': self.tokens,
+        }
+
+
+class AnswerCacheStore:
+    """Semantic cache of subject-agent answers, keyed by subject and question embedding.
+
+    Each process keeps a normalized matrix of the cached question vectors per subject,
+    reloaded every ``ANSWER_CACHE_REFRESH`` seconds, so a lookup is one matrix-vector
+    product plus a primary-key fetch of the matching answer. Entries expire after
+    ``ANSWER_CACHE_TTL`` seconds, and each subject keeps at most
+    ``ANSWER_CACHE_MAX_PER_SUBJECT`` rows; the least recently used are evicted first.
+
+    Embeddings barely move when only a number changes ("What is 17 * 23?" vs
+    "What is 17 * 24?"), so a similar question is only a hit when its numbers match
+    the cached one's. Subjects in ``ANSWER_CACHE_EXACT_SUBJECTS`` (math by default)
+    skip similarity altogether and hit only on the same normalized question.
+    """
+
+    def __init__(self):
+        self.enabled = getattr(settings, 'ANSWER_CACHE_ENABLED', True)
+        self.threshold = getattr(settings, 'ANSWER_CACHE_THRESHOLD', 0.95)
+        self.ttl = getattr(settings, 'ANSWER_CACHE_TTL', 7 * 24 * 3600)
+        self.max_per_subject = getattr(settings, 'ANSWER_CACHE_MAX_PER_SUBJECT', 500)
+        self.refresh_interval = getattr(settings, 'ANSWER_CACHE_REFRESH', 60)
+        self.exact_subjects = set(getattr(settings, 'ANSWER_CACHE_EXACT_SUBJECTS', ['math']))
+        self._matrices: Dict[str, tuple] = {}  # subject -> (loaded_at, ids, normalized matrix)
+        self._lock = threading.Lock()
+
+    def _cutoff(self):
+        return timezone.now() - timedelta(seconds=self.ttl)
+
+    def _subject_matrix(self, subject: str):
+        entry = self._matrices.get(subject)
+        if entry is not None and time.monotonic() - entry[0] < self.refresh_interval:
+            return entry
+        rows = list(AnswerCache.objects
+                    .filter(subject=subject, created_at__gte=self._cutoff())
+                    .order_by('-last_used_at')
+                    .values_list('id', 'vector')[:self.max_per_subject])
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        if rows:
+            matrix = np.stack([unpack_embedding(bytes(row[1])) for row in rows]).astype(np.float32)
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        entry = (time.monotonic(), ids, matrix)
+        with self._lock:
+            self._matrices[subject] = entry
+        return entry
+
+    def _forget(self, subject: str):
+        with self._lock:
+            self._matrices.pop(subject, None)
+
+    def lookup_embedding(self, subject: str, embedding: List[float],
+                         question: Optional[str] = None) -> Optional[CachedAnswer]:
+        """Return the cached answer whose question is most similar, if above the threshold.
+
+        With ``question`` given, cached questions containing other numbers are skipped.
+        """
+        _, ids, matrix = self._subject_matrix(subject)
+        query = np.asarray(embedding, dtype=np.float32)
+        if not len(ids) or matrix.shape[1] != query.shape[0]:
+            return self._record_miss(subject)
+
+        similarities = matrix @ (query / max(np.linalg.norm(query), 1e-12))
+        above = np.flatnonzero(similarities >= self.threshold)
+        if not len(above):
+            return self._record_miss(subject)
+
+        rows = {row[0]: row[1:] for row in AnswerCache.objects
+                .filter(id__in=ids[above].tolist(), created_at__gte=self._cutoff())
+                .values_list('id', 'question', 'answer', 'tokens')}
+        if len(rows) < len(above):
+            # Expired or evicted by another process since the matrix was loaded
+            self._forget(subject)
+        numbers = question_numbers(question) if question is not None else None
+        for index in above[np.argsort(-similarities[above], kind='stable')]:
+            row = rows.get(int(ids[index]))
+            if row and (numbers is None or question_numbers(row[0]) == numbers):
+                hit = CachedAnswer(int(ids[index]), row[1], float(similarities[index]), row[2])
+                return self._record_hit(subject, hit)
+        return self._record_miss(subject)
+
+    def lookup_exact(self, subject: str, question: str) -> Optional[CachedAnswer]:
+        """Return the cached answer to the same normalized question, without an embedding."""
+        row = (AnswerCache.objects
+               .filter(subject=subject, question_hash=question_hash(question), created_at__gte=self._cutoff())
+               .values_list('id', 'answer', 'tokens').first())
+        if row is None:
+            return self._record_miss(subject)
+        return self._record_hit(subject, CachedAnswer(row[0], row[1], 1.0, row[2]))
+
+    @staticmethod
+    def _record_hit(subject: str, hit: CachedAnswer) -> CachedAnswer:
+        AnswerCache.objects.filter(id=hit.id).update(hit_count=F('hit_count') + 1, last_used_at=timezone.now())
+        record_lookups('answer', subject, hits=1)
+        return hit
+
+    @staticmethod
+    def _record_miss(subject: str):
+        record_lookups('answer', subject, misses=1)
+        return None
+
+    def store_embedding(self, subject: str, question: str, embedding: List[float], answer: str, tokens: int = 0):
+        """Cache an answer, then evict the subject's least recently used rows beyond the cap."""
+        try:
+            # Replaces an expired row for the same question that eviction has not removed yet
+            AnswerCache.objects.update_or_create(
+                subject=subject,
+                question_hash=question_hash(question),
+                defaults={
+                    'question': question,
+                    'vector': pack_embedding(embedding),
+                    'answer': answer,
+                    'tokens': tokens or estimate_tokens(question, answer),
+                    'hit_count': 0,
+                    'created_at': timezone.now(),
+                    'last_used_at': timezone.now(),
+                }
+            )
+        except IntegrityError:
+            # Another request cached the same question first
+            return
+        self._forget(subject)
+        self.evict(subject)
+
+    def evict(self, subject: Optional[str] = None) -> int:
+        """Delete expired rows and rows beyond the per-subject cap; returns the number removed."""
+        removed = AnswerCache.objects.filter(created_at__lt=self._cutoff()).delete()[0]
+        subjects = [subject] if subject else list(AnswerCache.objects.values_list('subject', flat=True).distinct())
+        for name in subjects:
+            stale = list(AnswerCache.objects.filter(subject=name).order_by('-last_used_at')
+                         .values_list('id', flat=True)[self.max_per_subject:])
+            if stale:
+                removed += AnswerCache.objects.filter(id__in=stale).delete()[0]
+        if removed:
+            logger.info(f"Evicted {removed} answer cache entries")
+        return removed
+
+    def lookup(self, subject: str, question: str) -> Optional[CachedAnswer]:
+        if subject in self.exact_subjects:
+            return self.lookup_exact(subject, question)
+        embedding = RAGService()._get_query_embedding(question)
+        return self.lookup_embedding(subject, embedding, question) if embedding else self._record_miss(subject)
+
+    def store(self, subject: str, question: str, answer: str, tokens: int = 0):
+        # Served from the query embedding memo filled by lookup()
+        embedding = RAGService()._get_query_embedding(question)
+        if embedding:
+            self.store_embedding(subject, question, embedding, answer, tokens)
+
+    async def alookup(self, subject: str, question: str) -> Optional[CachedAnswer]:
+        if subject in self.exact_subjects:
+            return await sync_to_async(self.lookup_exact)(subject, question)
+        embedding = await RAGService()._aget_query_embedding(question)
+        if not embedding:
+            return await sync_to_async(self._record_miss)(subject)
+        return await sync_to_async(self.lookup_embedding)(subject, embedding, question)
+
+    async def astore(self, subject: str, question: str, answer: str, tokens: int = 0):
+        embedding = await RAGService()._aget_query_embedding(question)
+        if embedding:
+            await sync_to_async(self.store_embedding)(subject, question, embedding, answer, tokens)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Per subject: cached rows, tokens saved by hits, and lookup totals over every process."""
+        tables = {row['subject']: row for row in (AnswerCache.objects.order_by().values('subject')
+                                                  .annotate(rows=Count('id'),
+                                                            tokens_saved=Sum(F('hit_count') * F('tokens'))))}
+        lookups = lookup_totals('answer')
+        stats = {}
+        for subject in sorted(set(tables) | set(lookups)):
+            table = tables.get(subject, {})
+            stats[subject] = {
+                'rows': table.get('rows', 0),
+                'tokens_saved': table.get('tokens_saved') or 0,
+                **lookups.get(subject, {'hits': 0, 'misses': 0, 'hit_rate': 0.0}),
+            }
+        return stats
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCacheStore:
+    """Return the process-wide answer cache."""
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = AnswerCacheStore()
+    return _answer_cache
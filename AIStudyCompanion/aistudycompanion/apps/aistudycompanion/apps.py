@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AistudycompanionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.aistudycompanion'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .database import configure_connection
+        connection_created.connect(configure_connection, dispatch_uid='aistudycompanion.configure_connection')
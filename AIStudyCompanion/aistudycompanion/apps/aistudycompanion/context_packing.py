@@ -0,0 +1,151 @@
+import logging
+import os
+import threading
+from typing import Dict, List, NamedTuple
+
+from django.conf import settings
+
+try:
+    import tiktoken
+except ImportError:  # Token counts are estimated from text length until tiktoken is installed
+    tiktoken = None
+
+from .models import DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+# Shortest suffix/prefix match treated as chunk overlap rather than coincidence
+MIN_OVERLAP_CHARS = 20
+
+# Separator between packed passages
+PASSAGE_SEPARATOR = "\n\n"
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def load_encoding():
+    """Load the RAG_TOKENIZER_ENCODING encoding, reading and filling RAG_TOKENIZER_CACHE_DIR.
+
+    tiktoken downloads an encoding file on first use; ``manage.py cache_tokenizer``
+    fills the cache at build time so serving hosts never need the network.
+    """
+    cache_dir = getattr(settings, 'RAG_TOKENIZER_CACHE_DIR', '')
+    if cache_dir:
+        os.environ.setdefault('TIKTOKEN_CACHE_DIR', cache_dir)
+    return tiktoken.get_encoding(getattr(settings, 'RAG_TOKENIZER_ENCODING', 'cl100k_base'))
+
+
+def get_encoding():
+    """The tiktoken encoding for RAG_TOKENIZER_ENCODING, or None when tiktoken cannot be used."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                if tiktoken is not None:
+                    try:
+                        _encoding = load_encoding()
+                    except Exception as e:
+                        # Encoding not cached and not downloadable: token counts become estimates
+                        logger.warning(f"Could not load tokenizer, estimating token counts: {e}")
+                _encoding_loaded = True
+    return _encoding
+
+
+def tokenizer_name() -> str:
+    encoding = get_encoding()
+    return encoding.name if encoding is not None else 'estimate'
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # About four characters per token for English
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ''
+    encoding = get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def merge_overlap(first: str, second: str) -> str:
+    """Join two consecutive chunks, dropping the text the second repeats from the end of the first."""
+    for size in range(min(len(first), len(second)), MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + " " + second
+
+
+class PackedContext(NamedTuple):
+    text: str
+    chunks: List[DocumentChunk]  # Chunks whose text made it into the context, in relevance order
+    tokens: int
+    raw_tokens: int  # Tokens of the retrieved chunks joined verbatim
+    retrieved: int
+    passages: int
+    budget: int
+
+    def log(self) -> Dict:
+        """Summary stored in RAGQuery.packing."""
+        return {
+            'tokenizer': tokenizer_name(),
+            'budget': self.budget,
+            'retrieved_chunks': self.retrieved,
+            'packed_chunks': len(self.chunks),
+            'passages': self.passages,
+            'raw_tokens': self.raw_tokens,
+            'packed_tokens': self.tokens,
+        }
+
+
+def pack_context(chunks: List[DocumentChunk], budget: int) -> PackedContext:
+    """Build the prompt context from retrieved chunks, most relevant first, within ``budget`` tokens.
+
+    Chunks that are adjacent in the same material are merged into one passage with
+    their overlap removed; the passage ranks with its most relevant chunk. Passages
+    are added in relevance order while they fit, and the top passage is truncated if
+    it alone exceeds the budget.
+    """
+    raw_tokens = count_tokens(PASSAGE_SEPARATOR.join(chunk.content for chunk in chunks))
+    rank = {id(chunk): position for position, chunk in enumerate(chunks)}
+
+    # Runs of consecutive chunk_index within a material
+    runs: List[List[DocumentChunk]] = []
+    for chunk in sorted(chunks, key=lambda c: (c.material_id, c.chunk_index)):
+        previous = runs[-1][-1] if runs else None
+        if previous is not None and previous.material_id == chunk.material_id \
+                and previous.chunk_index + 1 == chunk.chunk_index:
+            runs[-1].append(chunk)
+        else:
+            runs.append([chunk])
+    runs.sort(key=lambda run: min(rank[id(chunk)] for chunk in run))
+
+    passages = []
+    used = []
+    remaining = budget
+    separator_tokens = count_tokens(PASSAGE_SEPARATOR)
+    for run in runs:
+        text = run[0].content
+        for chunk in run[1:]:
+            text = merge_overlap(text, chunk.content)
+        cost = count_tokens(text) + (separator_tokens if passages else 0)
+        if cost > remaining:
+            if passages:
+                continue
+            text = truncate_to_tokens(text, remaining)
+            cost = count_tokens(text)
+        passages.append(text)
+        used.extend(run)
+        remaining -= cost
+
+    used.sort(key=lambda chunk: rank[id(chunk)])
+    text = PASSAGE_SEPARATOR.join(passages)
+    return PackedContext(text, used, count_tokens(text), raw_tokens, len(chunks), len(passages), budget)
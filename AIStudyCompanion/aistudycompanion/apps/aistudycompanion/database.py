@@ -0,0 +1,86 @@
+import asyncio
+import functools
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ALIAS = 'replica'
+
+# Set while a function decorated with read_from_replica runs. A context variable rather than a
+# thread-local, so it also follows async views and sync_to_async calls
+_replica_reads: ContextVar[bool] = ContextVar('replica_reads', default=False)
+
+
+def sqlite_pragmas() -> List[str]:
+    """PRAGMAs run on every new SQLite connection when SQLITE_TUNING is on.
+
+    WAL lets readers work while one writer commits, busy_timeout makes a writer wait for
+    the lock instead of failing with "database is locked", and synchronous=NORMAL only
+    syncs at checkpoints, which is safe in WAL mode.
+    """
+    return [
+        'PRAGMA journal_mode=WAL',
+        f"PRAGMA busy_timeout={getattr(settings, 'SQLITE_BUSY_TIMEOUT', 5000)}",
+        'PRAGMA synchronous=NORMAL',
+        f"PRAGMA mmap_size={getattr(settings, 'SQLITE_MMAP_SIZE', 256 * 2 ** 20)}",
+    ]
+
+
+def configure_connection(sender, connection, **kwargs):
+    """``connection_created`` handler that tunes SQLite connections."""
+    if connection.vendor != 'sqlite' or not getattr(settings, 'SQLITE_TUNING', True):
+        return
+    with connection.cursor() as cursor:
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+
+
+@contextmanager
+def replica_reads():
+    """Route ORM reads in this block to the replica database, if one is configured."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def read_from_replica(func):
+    """Decorator for read-heavy views and helpers whose queries may see slightly stale data."""
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with replica_reads():
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Send reads inside ``read_from_replica`` to the replica alias; everything else uses default."""
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and REPLICA_ALIAS in settings.DATABASES:
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is migrated through replication from the primary
+        return False if db == REPLICA_ALIAS else None
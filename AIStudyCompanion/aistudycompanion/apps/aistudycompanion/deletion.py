@@ -0,0 +1,76 @@
+import logging
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, QuerySet
+
+from .models import ChatMessage, ChunkTerm, Conversation, CustomLearningMaterial, DocumentChunk, RAGQuery
+
+logger = logging.getLogger(__name__)
+
+
+def delete_in_batches(queryset: QuerySet, batch_size: Optional[int] = None) -> int:
+    """Delete the rows of ``queryset`` by primary key, ``batch_size`` rows per transaction.
+
+    Each batch commits on its own, so the write lock is released between batches and
+    other requests are not stalled behind one large DELETE. Returns the rows deleted
+    from the queryset's own table.
+    """
+    batch_size = batch_size or getattr(settings, 'DELETE_BATCH_SIZE', 1000)
+    model = queryset.model
+    ids = queryset.order_by().values_list('pk', flat=True)
+    label = model._meta.label
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            batch = list(ids[:batch_size])
+            if not batch:
+                return deleted
+            _, per_model = model.objects.filter(pk__in=batch).delete()
+        deleted += per_model.get(label, 0)
+        if len(batch) < batch_size:
+            return deleted
+
+
+def delete_conversations(conversations: QuerySet) -> Tuple[int, int]:
+    """Delete conversations and their messages; returns (conversations, messages) deleted.
+
+    Counts come from one aggregate query up front. Messages go first in batches so the
+    conversation deletes find nothing left to cascade.
+    """
+    counts = conversations.aggregate(conversations=Count('id', distinct=True), messages=Count('messages'))
+    if not counts['conversations']:
+        return 0, 0
+    delete_in_batches(ChatMessage.objects.filter(conversation__in=conversations.values('id')))
+    delete_in_batches(Conversation.objects.filter(id__in=conversations.values('id')))
+    return counts['conversations'], counts['messages']
+
+
+def delete_learning_materials(materials: QuerySet) -> int:
+    """Delete learning materials with their chunks, terms and RAG queries; returns materials deleted.
+
+    Database rows only: files and ANN indexes are removed by a 'cleanup' job
+    (``queue_material_cleanup``), so the request never waits on storage.
+    """
+    material_ids = materials.values('id')
+    queries = RAGQuery.objects.filter(material__in=material_ids)
+    # The relevant_chunks links would otherwise be collected row by row through both sides
+    delete_in_batches(RAGQuery.relevant_chunks.through.objects.filter(ragquery__in=queries.values('id')))
+    delete_in_batches(queries)
+    delete_in_batches(ChunkTerm.objects.filter(material__in=material_ids))
+    delete_in_batches(DocumentChunk.objects.filter(material__in=material_ids))
+    return delete_in_batches(CustomLearningMaterial.objects.filter(id__in=material_ids))
+
+
+def queue_material_cleanup(materials):
+    """Queue removal of the files and ANN indexes of (already deleted) learning materials."""
+    from .jobs import enqueue_job
+
+    materials = list(materials)
+    if not materials:
+        return None
+    return enqueue_job('cleanup', payload={
+        'files': [material.file.name for material in materials if material.file],
+        'materials': [[material.user_id, material.id] for material in materials],
+    })
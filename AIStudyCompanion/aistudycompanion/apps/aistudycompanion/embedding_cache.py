@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .models import CacheCounter, EmbeddingCache, pack_embedding, unpack_embedding
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for cache keys: NFC unicode with whitespace runs collapsed."""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def normalize_query(text: str) -> str:
+    """Looser canonical form for questions: case-folded, trailing punctuation dropped."""
+    return normalize_text(text).casefold().rstrip(' ?!.')
+
+
+def query_cache_key(text: str, model: str) -> str:
+    return f"{model}:{hashlib.sha256(normalize_query(text).encode('utf-8')).hexdigest()}"
+
+
+class QueryEmbeddingMemo:
+    """Question embeddings memoized in the ``query_embeddings`` Django cache.
+
+    Keys are the normalized question (``normalize_query``), so repeats that differ only
+    in case, spacing or trailing punctuation skip the embeddings request.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.cache = caches['query_embeddings']
+
+    def get(self, query: str) -> Optional[List[float]]:
+        return self._unpack(self.cache.get(query_cache_key(query, self.model)))
+
+    def set(self, query: str, embedding: Sequence[float]):
+        self.cache.set(query_cache_key(query, self.model), pack_embedding(embedding))
+
+    async def aget(self, query: str) -> Optional[List[float]]:
+        return self._unpack(await self.cache.aget(query_cache_key(query, self.model)))
+
+    async def aset(self, query: str, embedding: Sequence[float]):
+        await self.cache.aset(query_cache_key(query, self.model), pack_embedding(embedding))
+
+    @staticmethod
+    def _unpack(packed: Optional[bytes]) -> Optional[List[float]]:
+        return unpack_embedding(packed).tolist() if packed is not None else None
+
+
+def record_lookups(cache: str, key: str, hits: int = 0, misses: int = 0):
+    """Add to the hit and miss totals shared by every process (``CacheCounter``)."""
+    if not hits and not misses:
+        return
+    counters = CacheCounter.objects.filter(cache=cache, key=key)
+    try:
+        if counters.update(hits=F('hits') + hits, misses=F('misses') + misses, updated_at=timezone.now()):
+            return
+        try:
+            with transaction.atomic():
+                CacheCounter.objects.create(cache=cache, key=key, hits=hits, misses=misses)
+        except IntegrityError:
+            # Another process created the row first
+            counters.update(hits=F('hits') + hits, misses=F('misses') + misses, updated_at=timezone.now())
+    except DatabaseError as e:
+        # Counters are for reporting only; a lookup never fails because of them
+        logger.warning(f"Error recording {cache} cache lookups: {e}")
+
+
+def lookup_totals(cache: str) -> Dict[str, Dict]:
+    """Hits, misses and hit rate per key recorded by ``record_lookups``."""
+    totals = {}
+    for key, hits, misses in CacheCounter.objects.filter(cache=cache).values_list('key', 'hits', 'misses'):
+        lookups = hits + misses
+        totals[key] = {'hits': hits, 'misses': misses, 'hit_rate': hits / lookups if lookups else 0.0}
+    return totals
+
+
+class EmbeddingCacheStore:
+    """Two-level embedding cache: an in-process LRU over the shared ``EmbeddingCache`` table.
+
+    Lookups and inserts are batched, so caching adds a few queries per document
+    rather than one per chunk. The table is capped at
+    ``EMBEDDING_CACHE_MAX_ROWS``; the least recently used rows are evicted first.
+    Hits and misses per model are added to ``CacheCounter`` once per lookup batch.
+    """
+
+    # Inserts between table-size checks, so eviction does not COUNT(*) on every write
+    EVICTION_CHECK_INTERVAL = 1000
+    # Hashes per IN (...) lookup, keeps queries under SQLite's bound-parameter limit
+    LOOKUP_BATCH_SIZE = 500
+
+    def __init__(self, memory_entries: Optional[int] = None, max_rows: Optional[int] = None):
+        self.memory_entries = memory_entries or getattr(settings, 'EMBEDDING_CACHE_MEMORY_ENTRIES', 2048)
+        self.max_rows = max_rows or getattr(settings, 'EMBEDDING_CACHE_MAX_ROWS', 100000)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts_since_check = 0
+
+    def _remember(self, key, packed: bytes):
+        with self._lock:
+            self._memory[key] = packed
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get_many(self, texts: Sequence[str], model: str) -> List[Optional[List[float]]]:
+        """Return cached embeddings aligned with ``texts``; misses are None."""
+        if not texts:
+            return []
+        hashes = [content_hash(text) for text in texts]
+        found: Dict[str, bytes] = {}
+
+        with self._lock:
+            for digest in set(hashes):
+                packed = self._memory.get((model, digest))
+                if packed is not None:
+                    self._memory.move_to_end((model, digest))
+                    found[digest] = packed
+
+        pending = list(set(hashes) - set(found))
+        for start in range(0, len(pending), self.LOOKUP_BATCH_SIZE):
+            rows = list(EmbeddingCache.objects
+                        .filter(model=model, content_hash__in=pending[start:start + self.LOOKUP_BATCH_SIZE])
+                        .values_list('id', 'content_hash', 'vector'))
+            if rows:
+                EmbeddingCache.objects.filter(id__in=[row[0] for row in rows]).update(
+                    hit_count=F('hit_count') + 1,
+                    last_used_at=timezone.now()
+                )
+            for _, digest, packed in rows:
+                packed = bytes(packed)
+                found[digest] = packed
+                self._remember((model, digest), packed)
+
+        record_lookups('embedding', model, hits=len(found), misses=len(set(hashes)) - len(found))
+        return [unpack_embedding(found[digest]).tolist() if digest in found else None for digest in hashes]
+
+    def put_many(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]], model: str):
+        """Store freshly generated embeddings; texts already cached by another worker are skipped."""
+        entries = {}
+        for text, embedding in zip(texts, embeddings):
+            if embedding is None or not len(embedding):
+                continue
+            digest = content_hash(text)
+            packed = pack_embedding(embedding)
+            entries[digest] = EmbeddingCache(
+                content_hash=digest,
+                model=model,
+                vector=packed,
+                embedding_dim=len(embedding)
+            )
+            self._remember((model, digest), packed)
+        if not entries:
+            return
+
+        try:
+            with transaction.atomic():
+                EmbeddingCache.objects.bulk_create(list(entries.values()), batch_size=500, ignore_conflicts=True)
+        except IntegrityError as e:
+            logger.warning(f"Error storing embedding cache entries: {e}")
+
+        with self._lock:
+            self._inserts_since_check += len(entries)
+            check = self._inserts_since_check >= self.EVICTION_CHECK_INTERVAL
+            if check:
+                self._inserts_since_check = 0
+        if check:
+            self.evict()
+
+    def evict(self) -> int:
+        """Delete least recently used rows beyond ``max_rows``; returns the number removed."""
+        excess = EmbeddingCache.objects.count() - self.max_rows
+        if excess <= 0:
+            return 0
+        removed = 0
+        while removed < excess:
+            ids = list(EmbeddingCache.objects.order_by('last_used_at')
+                       .values_list('id', flat=True)[:min(1000, excess - removed)])
+            if not ids:
+                break
+            removed += EmbeddingCache.objects.filter(id__in=ids).delete()[0]
+        logger.info(f"Evicted {removed} embedding cache entries")
+        return removed
+
+    def stats(self) -> Dict[str, Dict]:
+        """Rows, vector size and lookup totals (all processes) per embedding model."""
+        tables = {row['model']: row for row in (EmbeddingCache.objects.order_by().values('model')
+                                                .annotate(rows=Count('id'), dims=Sum('embedding_dim')))}
+        lookups = lookup_totals('embedding')
+        stats = {}
+        for model in sorted(set(tables) | set(lookups)):
+            table = tables.get(model, {})
+            stats[model] = {
+                'rows': table.get('rows', 0),
+                'vector_mb': (table.get('dims') or 0) * 4 / (1024 * 1024),
+                **lookups.get(model, {'hits': 0, 'misses': 0, 'hit_rate': 0.0}),
+            }
+        return stats
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCacheStore:
+    """Return the process-wide embedding cache."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCacheStore()
+    return _embedding_cache
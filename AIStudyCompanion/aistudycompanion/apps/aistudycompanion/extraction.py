@@ -0,0 +1,112 @@
+import codecs
+import logging
+import os
+import zipfile
+from typing import Iterator, NamedTuple, Optional
+from xml.etree import ElementTree
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF extraction is unavailable until pypdf is installed
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+# Bytes read per block from plain-text uploads
+TXT_BLOCK_SIZE = 64 * 1024
+
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+class TextSegment(NamedTuple):
+    """A piece of extracted text with its source page and the fraction of the file consumed so far."""
+    text: str
+    page_number: Optional[int]
+    progress: float
+
+
+class ExtractionError(Exception):
+    """Raised when a document cannot be read."""
+
+
+def iter_txt(file_path: str, block_size: int = TXT_BLOCK_SIZE) -> Iterator[TextSegment]:
+    """Yield a text file in fixed-size blocks, decoding UTF-8 incrementally across block edges."""
+    total = os.path.getsize(file_path) or 1
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    consumed = 0
+    with open(file_path, 'rb') as file:
+        while True:
+            block = file.read(block_size)
+            consumed += len(block)
+            text = decoder.decode(block, final=not block)
+            if text:
+                yield TextSegment(text, None, consumed / total)
+            if not block:
+                break
+
+
+def iter_docx(file_path: str) -> Iterator[TextSegment]:
+    """Yield DOCX paragraphs straight from word/document.xml without building the whole tree."""
+    try:
+        archive = zipfile.ZipFile(file_path)
+    except zipfile.BadZipFile as e:
+        raise ExtractionError(f"Not a valid DOCX file: {e}")
+
+    with archive:
+        try:
+            info = archive.getinfo('word/document.xml')
+        except KeyError:
+            raise ExtractionError("DOCX file has no word/document.xml")
+        total = info.file_size or 1
+
+        with archive.open(info) as document:
+            parts = []
+            for event, element in ElementTree.iterparse(document, events=('end',)):
+                if element.tag == f'{WORD_NAMESPACE}t':
+                    parts.append(element.text or '')
+                elif element.tag == f'{WORD_NAMESPACE}tab':
+                    parts.append('\t')
+                elif element.tag in (f'{WORD_NAMESPACE}br', f'{WORD_NAMESPACE}cr'):
+                    parts.append('\n')
+                elif element.tag == f'{WORD_NAMESPACE}p':
+                    paragraph = ''.join(parts).strip()
+                    parts = []
+                    # Free parsed paragraphs so memory stays flat for long documents
+                    element.clear()
+                    if paragraph:
+                        yield TextSegment(paragraph + '\n', None, document.tell() / total)
+
+
+def iter_pdf(file_path: str) -> Iterator[TextSegment]:
+    """Yield PDF text one page at a time."""
+    if PdfReader is None:
+        raise ExtractionError("PDF extraction requires the pypdf package")
+    try:
+        reader = PdfReader(file_path)
+        page_count = len(reader.pages)
+    except Exception as e:
+        raise ExtractionError(f"Could not read PDF: {e}")
+
+    for page_number, page in enumerate(reader.pages, start=1):
+        try:
+            text = page.extract_text() or ''
+        except Exception as e:
+            logger.warning(f"Skipping unreadable page {page_number} of {file_path}: {e}")
+            text = ''
+        if text.strip():
+            yield TextSegment(text + '\n', page_number, page_number / page_count)
+
+
+EXTRACTORS = {
+    'txt': iter_txt,
+    'docx': iter_docx,
+    'pdf': iter_pdf,
+}
+
+
+def iter_document_text(file_path: str, document_type: str) -> Iterator[TextSegment]:
+    """Stream the text of an uploaded document as TextSegments."""
+    extractor = EXTRACTORS.get(document_type)
+    if extractor is None:
+        raise ExtractionError(f"Text extraction for {document_type} files is not supported")
+    return extractor(file_path)
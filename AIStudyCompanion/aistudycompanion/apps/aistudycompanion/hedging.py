@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+
+async def first_success(calls: List[Callable[[], Awaitable[Any]]], budget: Optional[float] = None, fan_out: int = 1,
+                        abort_on: Tuple[Type[BaseException], ...] = ()) -> Tuple[int, Any]:
+    """Run fallback calls hedged and return ``(index, result)`` of the first that succeeds.
+
+    ``calls[0]`` starts at once. The next call starts when a running one fails, or
+    when ``budget`` seconds pass without any result, as long as fewer than ``fan_out``
+    calls are in flight. ``budget=None`` only moves on after failures; ``budget=0``
+    starts ``fan_out`` calls together. Calls still running when one succeeds are
+    cancelled (work already handed to a thread finishes and is ignored). An exception
+    in ``abort_on`` cancels everything and is raised; if every call fails, the last
+    exception is raised.
+    """
+    fan_out = max(1, fan_out)
+    index_of = {}
+    pending = set()
+    last_error: Optional[BaseException] = None
+
+    def launch():
+        index = len(index_of)
+        task = asyncio.ensure_future(calls[index]())
+        index_of[task] = index
+        pending.add(task)
+
+    def can_launch():
+        return len(index_of) < len(calls) and len(pending) < fan_out
+
+    launch()
+    try:
+        while pending:
+            timeout = budget if can_launch() else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.info(f"No answer after {budget}s; hedging with fallback {len(index_of)}")
+                launch()
+                continue
+
+            pending.difference_update(done)
+            winner = None
+            # Earlier calls are preferred when several finish together; every exception is retrieved
+            for task in sorted(done, key=index_of.get):
+                error = task.exception()
+                if error is None:
+                    winner = winner or task
+                elif isinstance(error, abort_on):
+                    raise error
+                else:
+                    last_error = error
+            if winner is not None:
+                return index_of[winner], winner.result()
+            while can_launch():
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+    raise last_error
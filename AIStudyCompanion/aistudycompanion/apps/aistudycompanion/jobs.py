@@ -0,0 +1,198 @@
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import BackgroundJob, CustomLearningMaterial
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS: Dict[str, Callable] = {}
+
+# Seconds before a failed attempt is retried, doubled on every further attempt
+RETRY_BACKOFF_SECONDS = 30
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job cannot succeed."""
+
+
+def job_handler(kind: str):
+    """Register a function as the handler for a job kind."""
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def enqueue_job(kind: str, material: Optional[CustomLearningMaterial] = None, payload: Optional[dict] = None,
+                max_attempts: int = 3) -> BackgroundJob:
+    """Queue a job; with BACKGROUND_JOBS_EAGER it runs immediately in the calling thread instead."""
+    job = BackgroundJob.objects.create(kind=kind, material=material, payload=payload or {}, max_attempts=max_attempts)
+    if getattr(settings, 'BACKGROUND_JOBS_EAGER', False):
+        worker_id = default_worker_id()
+        if claim_job(job.id, worker_id):
+            job.refresh_from_db()
+            run_job(job, worker_id)
+    return job
+
+
+def claim_job(job_id: int, worker_id: str) -> bool:
+    """Atomically move a queued job to running; returns False if another worker got there first."""
+    now = timezone.now()
+    return BackgroundJob.objects.filter(id=job_id, status='queued').update(
+        status='running',
+        worker_id=worker_id,
+        heartbeat_at=now,
+        attempts=F('attempts') + 1,
+        updated_at=now,
+    ) == 1
+
+
+def claim_next_job(worker_id: str, scan: int = 10) -> Optional[BackgroundJob]:
+    """Claim the oldest runnable job.
+
+    Claiming is a conditional UPDATE on the queued status, so it is atomic on every
+    database backend without SELECT ... FOR UPDATE SKIP LOCKED.
+    """
+    candidates = (BackgroundJob.objects
+                  .filter(status='queued', run_after__lte=timezone.now())
+                  .order_by('run_after', 'id')
+                  .values_list('id', flat=True)[:scan])
+    for job_id in candidates:
+        if claim_job(job_id, worker_id):
+            return BackgroundJob.objects.select_related('material').get(id=job_id)
+    return None
+
+
+def recover_stale_jobs(stale_after: int) -> int:
+    """Requeue running jobs whose worker has not sent a heartbeat for stale_after seconds."""
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stale = BackgroundJob.objects.filter(status='running', heartbeat_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed',
+        error='Worker stopped responding',
+        worker_id='',
+        finished_at=timezone.now(),
+    )
+    requeued = stale.filter(attempts__lt=F('max_attempts')).update(
+        status='queued',
+        worker_id='',
+        run_after=timezone.now(),
+    )
+    if failed or requeued:
+        logger.warning(f"Recovered stale jobs: {requeued} requeued, {failed} failed")
+    return failed + requeued
+
+
+def _send_heartbeats(owned, interval: float, stop: threading.Event):
+    """Refresh heartbeat_at every ``interval`` seconds until ``stop`` is set or the claim is lost."""
+    try:
+        while not stop.wait(interval):
+            try:
+                if not owned.update(heartbeat_at=timezone.now()):
+                    return
+            except Exception as e:
+                # A missed beat is retried on the next interval; recovery allows several
+                logger.warning(f"Error sending job heartbeat: {e}")
+    finally:
+        # The thread has its own connection; release it when the thread exits
+        connection.close()
+
+
+def run_job(job: BackgroundJob, worker_id: str):
+    """Run a claimed job and record its outcome.
+
+    Every status write is conditioned on worker_id, so a worker that lost its claim
+    to stale-job recovery cannot overwrite the new owner's state. A heartbeat thread
+    refreshes heartbeat_at every ``JOB_HEARTBEAT_INTERVAL`` seconds while the handler
+    runs, so one long embedding window or slow LLM retries never look like a dead worker.
+    """
+    owned = BackgroundJob.objects.filter(id=job.id, worker_id=worker_id, status='running')
+
+    def report_progress(percent: int):
+        owned.update(progress=max(0, min(100, int(percent))), heartbeat_at=timezone.now())
+
+    handler = JOB_HANDLERS.get(job.kind)
+    stop_heartbeats = threading.Event()
+    heartbeats = threading.Thread(
+        target=_send_heartbeats,
+        args=(owned, getattr(settings, 'JOB_HEARTBEAT_INTERVAL', 30), stop_heartbeats),
+        name=f'job-heartbeat-{job.id}',
+        daemon=True,
+    )
+    heartbeats.start()
+    try:
+        if handler is None:
+            raise PermanentJobError(f"No handler registered for job kind '{job.kind}'")
+        handler(job, report_progress)
+    except PermanentJobError as e:
+        logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+        owned.update(status='failed', error=str(e), finished_at=timezone.now())
+    except Exception as e:
+        logger.exception(f"Job {job.id} ({job.kind}) raised on attempt {job.attempts}")
+        if job.attempts < job.max_attempts:
+            delay = RETRY_BACKOFF_SECONDS * (2 ** (job.attempts - 1))
+            owned.update(status='queued', error=str(e), worker_id='',
+                         run_after=timezone.now() + timedelta(seconds=delay))
+        else:
+            owned.update(status='failed', error=str(e), finished_at=timezone.now())
+    else:
+        owned.update(status='completed', progress=100, error='', finished_at=timezone.now())
+    finally:
+        stop_heartbeats.set()
+        heartbeats.join()
+
+
+@job_handler('process_document')
+def process_document_job(job: BackgroundJob, report_progress: Callable[[int], None]):
+    from .rag_service import RAGService
+
+    material = job.material
+    if material is None:
+        raise PermanentJobError("Learning material no longer exists")
+    if material.is_processed:
+        # A previous attempt committed its chunks before the worker died
+        return
+    if not RAGService().process_document(material, progress_callback=report_progress):
+        raise PermanentJobError(f"Processing failed for '{material.title}'")
+
+
+@job_handler('reprocess_document')
+def reprocess_document_job(job: BackgroundJob, report_progress: Callable[[int], None]):
+    from .rag_service import RAGService
+
+    material = job.material
+    if material is None:
+        raise PermanentJobError("Learning material no longer exists")
+    if not RAGService().reprocess_document(material, progress_callback=report_progress):
+        raise PermanentJobError(f"Reprocessing failed for '{material.title}'")
+
+
+@job_handler('cleanup')
+def cleanup_job(job: BackgroundJob, report_progress: Callable[[int], None]):
+    """Remove the files and ANN indexes of deleted learning materials; safe to run twice."""
+    from .ann_index import get_ann_manager
+
+    files = job.payload.get('files', [])
+    materials = job.payload.get('materials', [])
+    steps = max(len(files) + len(materials), 1)
+    for done, name in enumerate(files, 1):
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        report_progress(100 * done // steps)
+    for done, (user_id, material_id) in enumerate(materials, len(files) + 1):
+        get_ann_manager().remove_material(user_id, material_id)
+        report_progress(100 * done // steps)
@@ -0,0 +1,148 @@
+import heapq
+import logging
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Avg, Count
+
+from .models import ChunkTerm, DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+# Words, numbers and joined forms such as 3.14, 1914-1918 or h2o
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[.\-][^\W_]+)*")
+MAX_TERM_LENGTH = 64
+
+STOP_WORDS = frozenset("""
+a about after all also an and any are as at be because been but by can could did do does
+for from had has have he her his how i if in into is it its just me more most my no not of
+on or our out over she so some such than that the their them then there these they this to
+up us was we were what when where which while who why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into case-folded index terms, dropping stop words."""
+    tokens = TOKEN_PATTERN.findall(unicodedata.normalize('NFKC', text).casefold())
+    return [token for token in tokens if token not in STOP_WORDS and len(token) <= MAX_TERM_LENGTH]
+
+
+def index_chunks(chunks: Iterable[DocumentChunk], batch_size: int = 1000):
+    """Write inverted-index postings and token counts for saved chunks.
+
+    Call inside the transaction that stores the chunks so the lexical and vector
+    indexes never disagree about which chunks exist. Chunks returned by a
+    ``bulk_create`` that could not set primary keys are looked up by
+    (material, chunk_index); a chunk that is not in the database raises ValueError.
+    """
+    chunks = list(chunks)
+    _resolve_chunk_ids([chunk for chunk in chunks if chunk.id is None])
+    postings = []
+    indexed = []
+    for chunk in chunks:
+        counts = Counter(tokenize(chunk.content))
+        chunk.token_count = sum(counts.values())
+        indexed.append(chunk)
+        postings.extend(
+            ChunkTerm(term=term, chunk_id=chunk.id, material_id=chunk.material_id, frequency=frequency)
+            for term, frequency in counts.items()
+        )
+    if indexed:
+        DocumentChunk.objects.bulk_update(indexed, ['token_count'], batch_size=500)
+        ChunkTerm.objects.bulk_create(postings, batch_size=batch_size)
+
+
+def _resolve_chunk_ids(chunks: List[DocumentChunk]):
+    """Set the ids of saved chunks whose ``bulk_create`` did not return them."""
+    by_material = defaultdict(dict)
+    for chunk in chunks:
+        by_material[chunk.material_id][chunk.chunk_index] = chunk
+    for material_id, by_index in by_material.items():
+        indexes = list(by_index)
+        for start in range(0, len(indexes), 500):
+            for chunk_id, chunk_index in (DocumentChunk.objects
+                                          .filter(material_id=material_id, chunk_index__in=indexes[start:start + 500])
+                                          .values_list('id', 'chunk_index')):
+                by_index[chunk_index].id = chunk_id
+    unsaved = [chunk for chunk in chunks if chunk.id is None]
+    if unsaved:
+        raise ValueError(f"Cannot index {len(unsaved)} chunks that are not saved "
+                         f"(material {unsaved[0].material_id}, chunk {unsaved[0].chunk_index})")
+
+
+class BM25Index:
+    """BM25 scoring over the ``ChunkTerm`` inverted index.
+
+    A query costs three database round trips: corpus size and average chunk length,
+    the document frequency of each query term, then the postings for the query terms.
+    Chunk text is never loaded. Postings read per query stay bounded: terms found in
+    more than ``RAG_BM25_MAX_DF_RATIO`` of the chunks are skipped (their IDF is near
+    zero), and a term with more than ``RAG_BM25_MAX_POSTINGS`` postings is read only
+    for the chunks where it occurs most often, one extra query per such term.
+    """
+
+    def __init__(self, k1: Optional[float] = None, b: Optional[float] = None):
+        self.k1 = k1 if k1 is not None else getattr(settings, 'RAG_BM25_K1', 1.2)
+        self.b = b if b is not None else getattr(settings, 'RAG_BM25_B', 0.75)
+        self.max_df_ratio = getattr(settings, 'RAG_BM25_MAX_DF_RATIO', 0.9)
+        self.max_postings = getattr(settings, 'RAG_BM25_MAX_POSTINGS', 5000)
+
+    def search(self, user, query: str, k: int, material_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Return up to k (chunk id, BM25 score) pairs, best first."""
+        terms = set(tokenize(query))
+        if not terms or k <= 0:
+            return []
+
+        corpus = DocumentChunk.objects.filter(
+            material__user=user,
+            material__is_processed=True,
+            token_count__isnull=False
+        )
+        postings = ChunkTerm.objects.filter(
+            term__in=terms,
+            material__user=user,
+            material__is_processed=True
+        )
+        if material_id:
+            corpus = corpus.filter(material_id=material_id)
+            postings = postings.filter(material_id=material_id)
+
+        stats = corpus.aggregate(total=Count('id'), average_length=Avg('token_count'))
+        total = stats['total']
+        average_length = stats['average_length'] or 1.0
+        if not total:
+            return []
+
+        document_frequencies = dict(postings.order_by().values_list('term').annotate(count=Count('id')))
+        searched = {term: count for term, count in document_frequencies.items()
+                    if count <= self.max_df_ratio * total}
+        if not searched and document_frequencies:
+            # Every term is common; the rarest one still orders the chunks
+            rarest = min(document_frequencies, key=lambda term: (document_frequencies[term], term))
+            searched = {rarest: document_frequencies[rarest]}
+
+        columns = ('chunk_id', 'term', 'frequency', 'chunk__token_count')
+        short = [term for term, count in searched.items() if count <= self.max_postings]
+        rows = list(postings.filter(term__in=short).values_list(*columns)) if short else []
+        for term in sorted(searched.keys() - set(short)):
+            rows.extend(postings.filter(term=term).order_by('-frequency', 'chunk_id')
+                        .values_list(*columns)[:self.max_postings])
+
+        by_term = defaultdict(list)
+        for chunk_id, term, frequency, length in rows:
+            by_term[term].append((chunk_id, frequency, length or 0))
+
+        scores = defaultdict(float)
+        for term, term_postings in by_term.items():
+            # IDF comes from the full count even when only the top postings were read
+            document_frequency = searched[term]
+            idf = math.log(1 + (total - document_frequency + 0.5) / (document_frequency + 0.5))
+            for chunk_id, frequency, length in term_postings:
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[chunk_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
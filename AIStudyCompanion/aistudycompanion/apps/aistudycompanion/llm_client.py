@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import AsyncIterator, Iterator, Optional
+
+import httpx
+import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Failures worth retrying: the request may succeed if sent again
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+# Failures raised while reading a streamed response: dropped connections, read timeouts and
+# error events sent by the API after the response started
+STREAM_ERRORS = (httpx.TransportError, openai.APIError)
+
+
+class CircuitOpenError(openai.OpenAIError):
+    """Raised without contacting the API while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fail fast while the LLM upstream is down.
+
+    After ``failure_threshold`` consecutive upstream failures (connection errors,
+    timeouts, 429 and 5xx responses, including those that break a stream) the circuit
+    opens and calls raise ``CircuitOpenError`` immediately. Once ``reset_timeout``
+    seconds have passed, one trial call is let through (half-open): success closes the
+    circuit, failure opens it again. Other errors say nothing about the upstream and
+    are not counted.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_in_flight:
+                raise CircuitOpenError("LLM circuit breaker is open; not calling the API")
+            self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"LLM circuit breaker opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """End a call that neither succeeded nor failed upstream; a pending trial is given to the next call."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(getattr(settings, 'LLM_TIMEOUT', 30.0), connect=getattr(settings, 'LLM_CONNECT_TIMEOUT', 5.0))
+
+
+def _limits() -> httpx.Limits:
+    max_connections = getattr(settings, 'LLM_MAX_CONNECTIONS', 50)
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+_client = None
+_http_client = None
+_breaker = None
+_client_lock = threading.Lock()
+_async_client = None
+_async_client_loop = None
+
+
+def get_http_client() -> httpx.Client:
+    """Process-wide pooled HTTP client, so keep-alive connections and TLS sessions are reused."""
+    global _http_client
+    if _http_client is None:
+        with _client_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(limits=_limits(), timeout=_timeout())
+    return _http_client
+
+
+def get_client() -> openai.OpenAI:
+    """Return the process-wide OpenAI client.
+
+    The SDK's own retries are disabled; ``call_with_retries`` retries with jitter and
+    feeds the circuit breaker instead.
+    """
+    global _client
+    if _client is None:
+        http_client = get_http_client()
+        with _client_lock:
+            if _client is None:
+                _client = openai.OpenAI(
+                    api_key=getattr(settings, 'OPENAI_API_KEY', None),
+                    http_client=http_client,
+                    timeout=_timeout(),
+                    max_retries=0
+                )
+    return _client
+
+
+def get_async_client() -> Optional[openai.AsyncOpenAI]:
+    """Return the shared AsyncOpenAI client if the running loop is the ASGI server's, else None.
+
+    httpx connection pools belong to the loop that opened them, so the client is only
+    used on the loop bound at lifespan startup and is closed at shutdown. Other loops
+    (async views served through WSGI, ``async_to_sync``) live for a single call and use
+    the process-wide sync client from a worker thread instead.
+    """
+    global _async_client
+    if _async_client_loop is None or asyncio.get_running_loop() is not _async_client_loop:
+        return None
+    if _async_client is None:
+        _async_client = openai.AsyncOpenAI(
+            api_key=getattr(settings, 'OPENAI_API_KEY', None),
+            http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout()),
+            timeout=_timeout(),
+            max_retries=0
+        )
+    return _async_client
+
+
+async def bind_async_client():
+    """Serve async calls from the running loop with one shared client; called at ASGI lifespan startup."""
+    global _async_client_loop
+    _async_client_loop = asyncio.get_running_loop()
+
+
+async def close_async_client():
+    """Close the shared AsyncOpenAI client and its connection pool; called at ASGI lifespan shutdown."""
+    global _async_client, _async_client_loop
+    client, _async_client, _async_client_loop = _async_client, None, None
+    if client is not None:
+        await client.close()
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    global _breaker
+    if _breaker is None:
+        with _client_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    failure_threshold=getattr(settings, 'LLM_BREAKER_FAILURES', 5),
+                    reset_timeout=getattr(settings, 'LLM_BREAKER_RESET', 30.0)
+                )
+    return _breaker
+
+
+def _retry_delay(attempt: int, backoff: float) -> float:
+    # Exponential backoff with jitter, so clients that failed together do not retry together
+    return backoff * (2 ** attempt) * (0.5 + random.random())
+
+
+def call_with_retries(func, *args, max_retries: Optional[int] = None, backoff: Optional[float] = None, **kwargs):
+    """Call an OpenAI SDK method through the circuit breaker, retrying transient failures.
+
+    Pass ``timeout=`` to override the default per-call timeout. Rejected requests
+    (bad request, authentication) are raised at once and do not count against the breaker.
+    Streamed responses are returned as an iterator of chunks and count as a success or
+    failure for the breaker only once they have been read to the end or broke off.
+    """
+    breaker = get_circuit_breaker()
+    max_retries = getattr(settings, 'LLM_MAX_RETRIES', 2) if max_retries is None else max_retries
+    backoff = getattr(settings, 'LLM_RETRY_BACKOFF', 0.5) if backoff is None else backoff
+    for attempt in range(max_retries + 1):
+        breaker.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            breaker.record_failure()
+            if attempt == max_retries:
+                raise
+            delay = _retry_delay(attempt, backoff)
+            logger.warning(f"LLM call failed (attempt {attempt + 1}): {e}; retrying in {delay:.1f}s")
+            time.sleep(delay)
+        except openai.APIStatusError:
+            # The API answered, so the upstream is up even though this request was rejected
+            breaker.record_success()
+            raise
+        except httpx.TransportError:
+            # Raised unwrapped by callers with their own client handling, such as autogen
+            breaker.record_failure()
+            raise
+        except BaseException:
+            # A bug or an error inside the caller (e.g. autogen), not a sign the upstream is down
+            breaker.release_trial()
+            raise
+        else:
+            if isinstance(result, openai.Stream):
+                # Judged once the stream has been read, so consecutive broken streams add up
+                breaker.release_trial()
+                return _guard_stream(result, breaker)
+            breaker.record_success()
+            return result
+
+
+def _guard_stream(stream: openai.Stream, breaker: CircuitBreaker) -> Iterator:
+    """Iterate a streamed response, then record its outcome: a failure mid-stream or success at the end."""
+    try:
+        yield from stream
+    except STREAM_ERRORS:
+        breaker.record_failure()
+        raise
+    else:
+        breaker.record_success()
+    finally:
+        # Returns the connection to the pool when the reader stops early
+        stream.response.close()
+
+
+async def acall_with_retries(func, *args, max_retries: Optional[int] = None, backoff: Optional[float] = None,
+                             **kwargs):
+    """Async ``call_with_retries`` for AsyncOpenAI methods; waits without blocking the loop."""
+    breaker = get_circuit_breaker()
+    max_retries = getattr(settings, 'LLM_MAX_RETRIES', 2) if max_retries is None else max_retries
+    backoff = getattr(settings, 'LLM_RETRY_BACKOFF', 0.5) if backoff is None else backoff
+    for attempt in range(max_retries + 1):
+        breaker.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            breaker.record_failure()
+            if attempt == max_retries:
+                raise
+            delay = _retry_delay(attempt, backoff)
+            logger.warning(f"LLM call failed (attempt {attempt + 1}): {e}; retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        except openai.APIStatusError:
+            # The API answered, so the upstream is up even though this request was rejected
+            breaker.record_success()
+            raise
+        except httpx.TransportError:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            # Includes cancellation, e.g. a hedged fallback that lost the race
+            breaker.release_trial()
+            raise
+        else:
+            if isinstance(result, openai.AsyncStream):
+                breaker.release_trial()
+                return _aguard_stream(result, breaker)
+            breaker.record_success()
+            return result
+
+
+async def _aguard_stream(stream: openai.AsyncStream, breaker: CircuitBreaker) -> AsyncIterator:
+    """Async ``_guard_stream``."""
+    try:
+        async for chunk in stream:
+            yield chunk
+    except STREAM_ERRORS:
+        breaker.record_failure()
+        raise
+    else:
+        breaker.record_success()
+    finally:
+        await stream.response.aclose()
+
+
+def create_chat_completion(**kwargs):
+    return call_with_retries(get_client().chat.completions.create, **kwargs)
+
+
+def create_embeddings(max_retries: Optional[int] = None, backoff: Optional[float] = None, **kwargs):
+    return call_with_retries(get_client().embeddings.create, max_retries=max_retries, backoff=backoff, **kwargs)
+
+
+async def _in_thread(func, **kwargs):
+    """Run a sync client call in a worker thread; a streamed response is read there chunk by chunk."""
+    result = await sync_to_async(func, thread_sensitive=False)(**kwargs)
+    if isinstance(result, Iterator):
+        return _aiterate(result)
+    return result
+
+
+async def _aiterate(iterator: Iterator) -> AsyncIterator:
+    next_chunk = sync_to_async(next, thread_sensitive=False)
+    end = object()
+    try:
+        while (chunk := await next_chunk(iterator, end)) is not end:
+            yield chunk
+    finally:
+        # Runs _guard_stream's cleanup, returning the connection to the pool
+        await sync_to_async(iterator.close, thread_sensitive=False)()
+
+
+async def acreate_chat_completion(**kwargs):
+    client = get_async_client()
+    if client is None:
+        return await _in_thread(create_chat_completion, **kwargs)
+    return await acall_with_retries(client.chat.completions.create, **kwargs)
+
+
+async def acreate_embeddings(**kwargs):
+    client = get_async_client()
+    if client is None:
+        return await _in_thread(create_embeddings, **kwargs)
+    return await acall_with_retries(client.embeddings.create, **kwargs)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from apps.aistudycompanion.answer_cache import get_answer_cache
+from apps.aistudycompanion.models import AnswerCache
+
+
+class Command(BaseCommand):
+    help = ("Report answer cache entries, hits, misses, hit rate and tokens saved per subject (summed over every "
+            "process), optionally evicting expired and excess rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true',
+                            help='Delete rows older than ANSWER_CACHE_TTL and beyond ANSWER_CACHE_MAX_PER_SUBJECT')
+        parser.add_argument('--clear', action='store_true', help='Delete every cached answer')
+
+    def handle(self, *args, **options):
+        cache = get_answer_cache()
+        if options['clear']:
+            self.stdout.write(f"Deleted {AnswerCache.objects.all().delete()[0]} rows")
+        elif options['evict']:
+            self.stdout.write(f"Evicted {cache.evict()} rows")
+
+        per_subject = cache.stats()
+        if not per_subject:
+            self.stdout.write("Answer cache is empty.")
+            return
+
+        totals = {'rows': 0, 'hits': 0, 'misses': 0, 'tokens_saved': 0}
+        self.stdout.write(f"{'subject':<20}{'rows':>8}{'hits':>10}{'misses':>10}{'hit rate':>10}{'tokens saved':>14}")
+        for subject, row in per_subject.items():
+            self.stdout.write(self._line(subject, row))
+            for name in totals:
+                totals[name] += row[name]
+        lookups = totals['hits'] + totals['misses']
+        self.stdout.write(self._line('total', {**totals, 'hit_rate': totals['hits'] / lookups if lookups else 0.0}))
+        self.stdout.write(f"Threshold {cache.threshold}, TTL {cache.ttl}s, "
+                          f"{cache.max_per_subject} entries per subject")
+
+    @staticmethod
+    def _line(label, row):
+        return (f"{label:<20}{row['rows']:>8}{row['hits']:>10}{row['misses']:>10}"
+                f"{row['hit_rate']:>10.1%}{row['tokens_saved']:>14}")
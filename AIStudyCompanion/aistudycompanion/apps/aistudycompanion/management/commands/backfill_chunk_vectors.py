@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from apps.aistudycompanion.models import CustomLearningMaterial, DocumentChunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert legacy JSON chunk embeddings into the packed float32 vector column. "
+        "Safe to interrupt: each batch commits on its own and converted rows are skipped on the next run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows converted per transaction')
+        parser.add_argument('--model', default='text-embedding-ada-002',
+                            help='Embedding model recorded for converted rows')
+        parser.add_argument('--keep-json', action='store_true',
+                            help='Leave the legacy JSON embedding in place instead of clearing it')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pending = DocumentChunk.objects.filter(vector__isnull=True, embedding__isnull=False).order_by('id')
+        total = pending.count()
+        if not total:
+            self.stdout.write("No chunks need converting.")
+            return
+
+        self.stdout.write(f"Converting {total} chunks in batches of {batch_size}...")
+        converted = skipped = 0
+        last_id = 0
+        update_fields = ['vector', 'embedding_dim', 'embedding_model']
+        if not options['keep_json']:
+            update_fields.append('embedding')
+
+        while True:
+            batch = list(pending.filter(id__gt=last_id).only('id', 'material_id', 'embedding')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            to_update = []
+            for chunk in batch:
+                if not isinstance(chunk.embedding, list) or not chunk.embedding:
+                    skipped += 1
+                    continue
+                chunk.set_embedding(chunk.embedding, options['model'])
+                if not options['keep_json']:
+                    chunk.embedding = None
+                to_update.append(chunk)
+
+            with transaction.atomic():
+                DocumentChunk.objects.bulk_update(to_update, update_fields)
+                # Cached search matrices are signed by material updated_at; rows keep their ids here
+                CustomLearningMaterial.objects.filter(
+                    id__in={chunk.material_id for chunk in to_update}
+                ).update(updated_at=timezone.now())
+            converted += len(to_update)
+            self.stdout.write(f"  {converted}/{total} converted (last id {last_id})")
+
+        self.stdout.write(self.style.SUCCESS(f"Converted {converted} chunks, skipped {skipped} with invalid embeddings."))
+        if not options['keep_json']:
+            self.stdout.write("Run VACUUM (SQLite) or VACUUM FULL (PostgreSQL) to reclaim the freed space.")
@@ -0,0 +1,68 @@
+import io
+import time
+from contextlib import redirect_stdout
+from unittest import mock
+
+import autogen
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from apps.aistudycompanion.agents import SUBJECT_AGENT_SPECS, StudyCompanionAgents
+
+
+def stub_reply(self, messages=None, sender=None, config=None):
+    return True, "Stub answer."
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare per-request agent overhead: building StudyCompanionAgents for every request "
+        "versus reusing the lazily built registry. Model calls are stubbed out, so no API key is needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--subject', default='math', choices=sorted(SUBJECT_AGENT_SPECS))
+
+    def _measure(self, func, iterations):
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return np.percentile(timings, 50), np.percentile(timings, 95)
+
+    def handle(self, *args, **options):
+        config_list = [{"model": "gpt-3.5-turbo", "api_key": "benchmark"}]
+        subject = options['subject']
+        iterations = options['iterations']
+
+        # Patch before any agent exists: agents bind their reply functions when constructed.
+        # autogen prints every message, so its output is discarded while timing.
+        with mock.patch.object(autogen.ConversableAgent, 'generate_oai_reply', stub_reply), \
+                redirect_stdout(io.StringIO()):
+            def per_request():
+                agents = StudyCompanionAgents(config_list)
+                agents.build_all()
+                return agents.get_subject_help(subject, "What is a prime number?", mode='agent')
+
+            registry = StudyCompanionAgents(config_list)
+            registry.get_subject_help(subject, "Warm up", mode='agent')
+
+            def shared():
+                return registry.get_subject_help(subject, "What is a prime number?", mode='agent')
+
+            results = [
+                ("per-request build", self._measure(per_request, iterations)),
+                ("shared registry", self._measure(shared, iterations)),
+            ]
+
+        agent = registry.get_agent(subject)
+        leaked = len(agent._oai_messages)
+
+        self.stdout.write(f"{'mode':<20}{'p50 ms':>10}{'p95 ms':>10}")
+        for name, (p50, p95) in results:
+            self.stdout.write(f"{name:<20}{p50:>10.2f}{p95:>10.2f}")
+        saved = results[0][1][0] - results[1][1][0]
+        self.stdout.write(f"Construction cost removed from p50: {saved:.2f} ms")
+        self.stdout.write(f"Conversations retained by the shared {subject} agent: {leaked}")
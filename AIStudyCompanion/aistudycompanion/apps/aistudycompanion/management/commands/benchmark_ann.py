@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.aistudycompanion.ann_index import IVFIndex
+from apps.aistudycompanion.retrieval import VectorSearchEngine, normalize_rows
+
+
+class Command(BaseCommand):
+    help = "Compare recall@k and latency of the IVF index against exact search."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Benchmark on this user\'s stored chunks instead of synthetic data')
+        parser.add_argument('--chunks', type=int, default=50000, help='Synthetic corpus size')
+        parser.add_argument('--dim', type=int, default=256, help='Synthetic embedding dimension')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--nlist', type=int, default=0, help='IVF lists; 0 means sqrt(corpus size)')
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def _synthetic_corpus(self, count, dim, rng):
+        # Clustered data resembles real embeddings far better than uniform noise
+        centers = rng.normal(size=(max(1, count // 200), dim)).astype(np.float32)
+        labels = rng.integers(0, len(centers), size=count)
+        vectors = centers[labels] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+        return np.arange(1, count + 1, dtype=np.int64), normalize_rows(vectors)
+
+    def _user_corpus(self, username):
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"User '{username}' not found")
+        matrix = VectorSearchEngine().get_matrix(user)
+        if not len(matrix):
+            raise CommandError(f"User '{username}' has no embedded chunks")
+        return matrix.chunk_ids, matrix.vectors
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        if options['user']:
+            ids, vectors = self._user_corpus(options['user'])
+        else:
+            ids, vectors = self._synthetic_corpus(options['chunks'], options['dim'], rng)
+        k = options['k']
+
+        # Queries are perturbed corpus rows, like a question phrased close to a passage
+        picks = rng.choice(len(vectors), min(options['queries'], len(vectors)), replace=False)
+        queries = normalize_rows(vectors[picks] + 0.3 * rng.normal(size=(len(picks), vectors.shape[1])).astype(np.float32))
+
+        self.stdout.write(f"Corpus: {len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, k={k}")
+
+        exact_results = []
+        exact_times = []
+        for query in queries:
+            start = time.perf_counter()
+            scores = vectors @ query
+            top = np.argpartition(-scores, k - 1)[:k]
+            exact_times.append(time.perf_counter() - start)
+            exact_results.append(set(ids[top].tolist()))
+
+        start = time.perf_counter()
+        index = IVFIndex.train(ids, np.zeros(len(ids), dtype=np.int64), vectors, nlist=options['nlist'] or None)
+        self.stdout.write(f"Trained {index.nlist} lists in {time.perf_counter() - start:.2f}s")
+
+        self.stdout.write(f"{'method':<16}{'recall@' + str(k):>10}{'p50 ms':>10}{'p95 ms':>10}")
+        self.stdout.write(f"{'exact':<16}{1.0:>10.3f}{np.percentile(exact_times, 50) * 1000:>10.3f}"
+                          f"{np.percentile(exact_times, 95) * 1000:>10.3f}")
+        for nprobe in options['nprobe']:
+            hits = 0
+            times = []
+            for query, expected in zip(queries, exact_results):
+                start = time.perf_counter()
+                found = index.search(query, k, nprobe)
+                times.append(time.perf_counter() - start)
+                hits += len(expected & {chunk_id for chunk_id, _ in found})
+            recall = hits / (len(queries) * k)
+            self.stdout.write(f"{'ivf nprobe=' + str(nprobe):<16}{recall:>10.3f}{np.percentile(times, 50) * 1000:>10.3f}"
+                              f"{np.percentile(times, 95) * 1000:>10.3f}")
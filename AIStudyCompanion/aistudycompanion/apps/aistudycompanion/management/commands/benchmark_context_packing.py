@@ -0,0 +1,54 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.aistudycompanion.context_packing import count_tokens, pack_context, tokenizer_name
+from apps.aistudycompanion.models import RAGQuery
+from apps.aistudycompanion.rag_service import RAGService
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare RAG context tokens with chunks joined verbatim and with context packing, by re-packing the "
+        "chunks recorded for past RAG queries. No API calls are made."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=200, help='Most recent RAG queries to re-pack')
+        parser.add_argument('--budget', type=int, help='Token budget (defaults to RAG_CONTEXT_TOKEN_BUDGET)')
+
+    def handle(self, *args, **options):
+        budget = options['budget'] or getattr(settings, 'RAG_CONTEXT_TOKEN_BUDGET', 1500)
+        queries = RAGQuery.objects.prefetch_related('relevant_chunks')[:options['queries']]
+
+        raw, packed, dropped = [], [], 0
+        for query in queries:
+            # Relevance order is not stored; document order stands in for it
+            chunks = sorted(query.relevant_chunks.all(), key=lambda c: (c.material_id, c.chunk_index))
+            if not chunks:
+                continue
+            result = pack_context(chunks, budget)
+            raw.append(result.raw_tokens)
+            packed.append(result.tokens)
+            dropped += len(chunks) - len(result.chunks)
+
+        if not raw:
+            self.stdout.write("No RAG queries with recorded chunks found.")
+            return
+
+        raw, packed = np.array(raw), np.array(packed)
+        self.stdout.write(f"{len(raw)} queries, budget {budget} tokens, tokenizer {tokenizer_name()}")
+        self.stdout.write(f"Context tokens per query, verbatim: mean {raw.mean():.0f}, p95 {np.percentile(raw, 95):.0f}")
+        self.stdout.write(f"Context tokens per query, packed:   mean {packed.mean():.0f}, "
+                          f"p95 {np.percentile(packed, 95):.0f}")
+        self.stdout.write(f"Saved: {1 - packed.sum() / raw.sum():.1%} of context tokens; "
+                          f"{dropped} chunks left out by the budget")
+
+        logged = [q.packing for q in queries if q.packing]
+        if logged:
+            saved = sum(p['raw_tokens'] - p['packed_tokens'] for p in logged)
+            self.stdout.write(f"Logged by live queries ({len(logged)}): {saved} context tokens saved, "
+                              f"{saved / len(logged):.0f} per query")
+        # The prompt template around the context is the same in both cases
+        self.stdout.write(f"Prompt overhead outside the context: about "
+                          f"{count_tokens(RAGService._build_rag_prompt('', ''))} tokens")
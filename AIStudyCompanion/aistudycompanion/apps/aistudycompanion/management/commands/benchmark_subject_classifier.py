@@ -0,0 +1,77 @@
+import asyncio
+import random
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.aistudycompanion.subject_classifier import SubjectClassifier, training_examples
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure local subject classifier accuracy and latency against LLM labels. Labels come from stored "
+        "conversation subjects (held-out split), or from live LLM calls with --live."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--test-fraction', type=float, default=0.2, help='Share of messages held out for testing')
+        parser.add_argument('--threshold', type=float, help='Confidence threshold (defaults to SUBJECT_CLASSIFIER_THRESHOLD)')
+        parser.add_argument('--live', type=int, default=0,
+                            help='Also label this many held-out messages with the LLM and time those calls')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        threshold = options['threshold'] or getattr(settings, 'SUBJECT_CLASSIFIER_THRESHOLD', 0.85)
+        examples = list(training_examples())
+        if not examples:
+            self.stdout.write("No labelled messages found; chat with a few subjects first.")
+            return
+
+        random.Random(options['seed']).shuffle(examples)
+        split = int(len(examples) * (1 - options['test_fraction']))
+        train, test = examples[:split], examples[split:] or examples
+        classifier = SubjectClassifier.train(train)
+
+        timings = []
+        predictions = []
+        for text, _ in test:
+            start = time.perf_counter()
+            predictions.append(classifier.predict(text))
+            timings.append((time.perf_counter() - start) * 1e6)
+
+        correct = [predicted == label for (predicted, _), (_, label) in zip(predictions, test)]
+        confident = [probability >= threshold for _, probability in predictions]
+        covered = sum(confident)
+        covered_correct = sum(c for c, keep in zip(correct, confident) if keep)
+
+        self.stdout.write(f"Trained on {len(train)} messages, tested on {len(test)}")
+        self.stdout.write(f"Accuracy (all predictions):         {np.mean(correct):.1%}")
+        self.stdout.write(f"Handled locally at >= {threshold:.2f}:       {covered / len(test):.1%}")
+        if covered:
+            self.stdout.write(f"Accuracy when handled locally:      {covered_correct / covered:.1%}")
+        self.stdout.write(f"Local latency p50 / p99:            {np.percentile(timings, 50):.0f} / "
+                          f"{np.percentile(timings, 99):.0f} us")
+
+        if options['live']:
+            sample = list(zip(test, predictions))[:options['live']]
+            labels, llm_timings = asyncio.run(self._classify_live([text for (text, _), _ in sample]))
+            agree = [predicted == label for (_, (predicted, _)), label in zip(sample, labels)]
+            self.stdout.write(f"Agreement with live LLM ({len(sample)}):  {np.mean(agree):.1%}")
+            self.stdout.write(f"LLM latency p50 / p99:              {np.percentile(llm_timings, 50):.0f} / "
+                              f"{np.percentile(llm_timings, 99):.0f} ms")
+
+    @staticmethod
+    async def _classify_live(texts):
+        """LLM labels and per-call latency (ms), one event loop so every call shares the client's connections."""
+        from apps.aistudycompanion.views import _allm_classify_subject
+
+        labels = []
+        timings = []
+        for text in texts:
+            start = time.perf_counter()
+            label, _ = await _allm_classify_subject(text)
+            timings.append((time.perf_counter() - start) * 1000)
+            labels.append(label)
+        return labels, timings
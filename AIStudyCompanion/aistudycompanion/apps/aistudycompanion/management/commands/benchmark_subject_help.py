@@ -0,0 +1,86 @@
+import io
+import json
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.aistudycompanion.agents import SUBJECT_AGENT_SPECS, SUBJECT_HELP_MODES, StudyCompanionAgents
+from apps.aistudycompanion.answer_cache import estimate_tokens
+from apps.aistudycompanion.llm_client import get_http_client
+
+DEFAULT_QUESTIONS = [
+    "What is a prime number?",
+    "How do I solve 2x + 3 = 11?",
+    "Why does the Pythagorean theorem work?",
+]
+
+
+class UncachedAgents(StudyCompanionAgents):
+    """Agents without autogen's on-disk response cache, so repeated runs pay for every call."""
+
+    def _llm_config(self):
+        return {**super()._llm_config(), "cache_seed": None}
+
+
+class Command(BaseCommand):
+    help = (
+        "Count the chat completion calls, tokens and latency one question costs in each subject help mode "
+        "(direct single call versus autogen conversation). Makes real API calls; point OPENAI_BASE_URL at "
+        "`manage.py llm_stub_server` to count calls without spending tokens (the stub reports no usage, so "
+        "tokens are then estimated from the text)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subject', default='math', choices=sorted(SUBJECT_AGENT_SPECS))
+        parser.add_argument('--modes', nargs='+', default=list(SUBJECT_HELP_MODES), choices=SUBJECT_HELP_MODES)
+        parser.add_argument('--question', action='append', dest='questions',
+                            help='Question to ask (repeatable); defaults to a few sample questions')
+
+    def handle(self, *args, **options):
+        agents = UncachedAgents()
+        if not agents.use_real_agents:
+            raise CommandError("OPENAI_API_KEY is not set")
+        questions = options['questions'] or DEFAULT_QUESTIONS
+
+        calls = []
+        http_client = get_http_client()
+        http_client.event_hooks['response'].append(lambda response: self._record(response, calls))
+        try:
+            results = []
+            for mode in options['modes']:
+                per_question = []
+                for question in questions:
+                    calls.clear()
+                    start = time.perf_counter()
+                    # autogen prints every message of the conversation
+                    with redirect_stdout(io.StringIO()):
+                        agents.get_subject_help(options['subject'], question, mode=mode)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    per_question.append((len(calls), sum(p for p, _ in calls), sum(c for _, c in calls), elapsed))
+                results.append((mode, np.array(per_question)))
+        finally:
+            http_client.event_hooks['response'].pop()
+
+        self.stdout.write(f"{len(questions)} {options['subject']} questions, averages per question")
+        self.stdout.write(f"{'mode':<10}{'calls':>8}{'prompt tok':>12}{'output tok':>12}{'total tok':>12}{'ms':>10}")
+        for mode, rows in results:
+            n_calls, prompt, completion, elapsed = rows.mean(axis=0)
+            self.stdout.write(f"{mode:<10}{n_calls:>8.1f}{prompt:>12.0f}{completion:>12.0f}"
+                              f"{prompt + completion:>12.0f}{elapsed:>10.0f}")
+
+    @staticmethod
+    def _record(response, calls):
+        """httpx response hook: note (prompt, completion) tokens of each chat completion."""
+        if not response.request.url.path.endswith('/chat/completions'):
+            return
+        response.read()
+        body = response.json()
+        usage = body.get('usage') or {}
+        prompt, completion = usage.get('prompt_tokens'), usage.get('completion_tokens')
+        if not prompt:
+            request = json.loads(response.request.content)
+            prompt = estimate_tokens(*(message.get('content') or '' for message in request.get('messages', [])))
+            completion = estimate_tokens(*(choice['message'].get('content') or '' for choice in body.get('choices', [])))
+        calls.append((prompt, completion))
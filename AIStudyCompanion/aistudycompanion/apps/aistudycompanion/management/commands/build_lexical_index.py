@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.aistudycompanion.lexical import index_chunks
+from apps.aistudycompanion.models import ChunkTerm, DocumentChunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Build BM25 inverted-index postings for chunks stored before hybrid search existed. "
+        "Safe to interrupt: each batch commits on its own and indexed chunks are skipped on the next run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Chunks indexed per transaction')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Drop every posting and re-index all chunks (after changing the tokenizer)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['rebuild']:
+            ChunkTerm.objects.all().delete()
+            DocumentChunk.objects.update(token_count=None)
+
+        pending = DocumentChunk.objects.filter(token_count__isnull=True).order_by('id')
+        total = pending.count()
+        if not total:
+            self.stdout.write("No chunks need indexing.")
+            return
+
+        self.stdout.write(f"Indexing {total} chunks in batches of {batch_size}...")
+        indexed = 0
+        last_id = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id).only('id', 'material_id', 'content')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            with transaction.atomic():
+                index_chunks(batch)
+            indexed += len(batch)
+            self.stdout.write(f"  {indexed}/{total} indexed (last id {last_id})")
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} chunks."))
@@ -0,0 +1,28 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.aistudycompanion.context_packing import load_encoding, tiktoken
+
+
+class Command(BaseCommand):
+    help = (
+        "Download the context-packing tokenizer encoding into RAG_TOKENIZER_CACHE_DIR. "
+        "Run at build time so serving hosts count tokens without network access."
+    )
+
+    def handle(self, *args, **options):
+        if tiktoken is None:
+            raise CommandError("tiktoken is not installed (pip install -r requirements.txt).")
+        if not settings.RAG_TOKENIZER_CACHE_DIR:
+            self.stdout.write(self.style.WARNING(
+                "RAG_TOKENIZER_CACHE_DIR is not set; tiktoken will use its default cache directory."
+            ))
+        try:
+            encoding = load_encoding()
+        except Exception as e:
+            raise CommandError(f"Could not load {settings.RAG_TOKENIZER_ENCODING}: {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Cached {encoding.name} in {os.environ.get('TIKTOKEN_CACHE_DIR') or 'the tiktoken default directory'}."
+        ))
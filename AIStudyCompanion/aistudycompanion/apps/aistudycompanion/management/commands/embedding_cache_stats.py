@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from apps.aistudycompanion.embedding_cache import get_embedding_cache
+
+
+class Command(BaseCommand):
+    help = ("Report embedding cache size, hits, misses and hit rate per model (summed over every process), "
+            "optionally evicting rows beyond the size cap.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help='Evict least recently used rows beyond EMBEDDING_CACHE_MAX_ROWS')
+
+    def handle(self, *args, **options):
+        cache = get_embedding_cache()
+        if options['evict']:
+            self.stdout.write(f"Evicted {cache.evict()} rows")
+
+        per_model = cache.stats()
+        if not per_model:
+            self.stdout.write("Embedding cache is empty.")
+            return
+
+        self.stdout.write(f"{'model':<32}{'rows':>10}{'hits':>12}{'misses':>12}{'hit rate':>10}{'vector MB':>12}")
+        for model, row in per_model.items():
+            self.stdout.write(f"{model:<32}{row['rows']:>10}{row['hits']:>12}{row['misses']:>12}"
+                              f"{row['hit_rate']:>10.1%}{row['vector_mb']:>12.1f}")
+        self.stdout.write(f"Row cap: {cache.max_rows}")
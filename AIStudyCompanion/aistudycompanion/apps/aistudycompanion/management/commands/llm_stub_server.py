@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a minimal OpenAI-compatible API (chat completions and embeddings) that answers after a fixed "
+        "delay, so load tests measure the web server instead of the model. Point the app at it with "
+        "OPENAI_BASE_URL=http://HOST:PORT/v1."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8100)
+        parser.add_argument('--delay', type=float, default=2.0, help='Seconds before each chat completion returns')
+        parser.add_argument('--embedding-delay', type=float, default=0.1)
+        parser.add_argument('--dimensions', type=int, default=1536)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.stdout.write(f"LLM stub listening on http://{options['host']}:{options['port']}/v1 "
+                          f"(completion delay {options['delay']}s)")
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_connection, self.options['host'], self.options['port'])
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                headers = dict(line.split(': ', 1) for line in header_lines if ': ' in line)
+                length = int(headers.get('Content-Length') or headers.get('content-length') or 0)
+                body = json.loads(await reader.readexactly(length)) if length else {}
+                path = request_line.split(' ')[1]
+
+                if path.endswith('/embeddings'):
+                    await asyncio.sleep(self.options['embedding_delay'])
+                    payload = self.embeddings(body)
+                elif path.endswith('/chat/completions'):
+                    await asyncio.sleep(self.options['delay'])
+                    payload = self.chat_completion(body)
+                else:
+                    payload = {'error': {'message': f'Unknown path {path}'}}
+
+                data = json.dumps(payload).encode()
+                status = '404 Not Found' if 'error' in payload else '200 OK'
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def chat_completion(self, body):
+        prompt = body.get('messages', [{}])[-1].get('content', '')
+        if 'subject classifier' in prompt:
+            content = "PRIMARY: science\nSECONDARY: none\nCONFIDENCE: 9\nREASONING: stub"
+        else:
+            content = "This is a stub answer from the load-test LLM server."
+        return {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        }
+
+    def embeddings(self, body):
+        texts = body.get('input', [])
+        if isinstance(texts, str):
+            texts = [texts]
+        data = []
+        for index, text in enumerate(texts):
+            seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+            vector = np.random.default_rng(seed).normal(size=self.options['dimensions'])
+            data.append({'object': 'embedding', 'index': index, 'embedding': (vector / np.linalg.norm(vector)).tolist()})
+        return {
+            'object': 'list',
+            'data': data,
+            'model': body.get('model', 'stub'),
+            'usage': {'prompt_tokens': 0, 'total_tokens': 0},
+        }
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+import numpy as np
+from django.core.management.base import BaseCommand
+
+
+def process_tree_rss(pid: int) -> int:
+    """Resident memory in bytes of a process and all its descendants (Linux /proc)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            for line in Path(f'/proc/{current}/status').read_text().splitlines():
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1]) * 1024
+                    break
+            for task in Path(f'/proc/{current}/task').iterdir():
+                children = (task / 'children').read_text().split()
+                pending.extend(int(child) for child in children)
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return total
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent chat requests at a running server and report requests/s, latency and server memory. "
+        "Run it once against the WSGI deployment and once against ASGI, with the same --pid of the server's "
+        "master process, to compare them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/chatbot/api/')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--message', default='How do plants make food?')
+        parser.add_argument('--subject', default='science', help='Sent as subject, so /subject-help/api/ works too')
+        parser.add_argument('--session', help='sessionid cookie, to exercise the authenticated path')
+        parser.add_argument('--pid', type=int, help='Server process to sample memory from (children included)')
+        parser.add_argument('--timeout', type=float, default=120.0)
+
+    def handle(self, *args, **options):
+        results, peak_rss, elapsed = asyncio.run(self.run(options))
+
+        statuses = Counter(status for status, _ in results)
+        latencies = [latency for status, latency in results if status == 200]
+        self.stdout.write(f"{options['requests']} requests, concurrency {options['concurrency']}, {elapsed:.1f}s")
+        self.stdout.write(f"Status codes: {dict(statuses)}")
+        self.stdout.write(f"Throughput: {len(latencies) / elapsed:.1f} successful requests/s")
+        if latencies:
+            self.stdout.write(f"Latency p50 / p95 / p99: {np.percentile(latencies, 50):.0f} / "
+                              f"{np.percentile(latencies, 95):.0f} / {np.percentile(latencies, 99):.0f} ms")
+        if options['pid']:
+            self.stdout.write(f"Server peak RSS: {peak_rss / 2 ** 20:.0f} MiB")
+
+    async def run(self, options):
+        cookies = {'sessionid': options['session']} if options['session'] else None
+        limits = httpx.Limits(max_connections=options['concurrency'])
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        results = []
+        peak_rss = 0
+        done = asyncio.Event()
+
+        async def sample_memory():
+            nonlocal peak_rss
+            while not done.is_set():
+                peak_rss = max(peak_rss, process_tree_rss(options['pid']))
+                await asyncio.sleep(0.2)
+
+        async with httpx.AsyncClient(limits=limits, timeout=options['timeout'], cookies=cookies) as client:
+            async def one(i):
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        message = f"{options['message']} ({i})"
+                        response = await client.post(options['url'], json={
+                            'message': message, 'question': message, 'subject': options['subject'],
+                        })
+                        status = response.status_code
+                    except httpx.HTTPError as e:
+                        status = type(e).__name__
+                    results.append((status, (time.perf_counter() - start) * 1000))
+
+            sampler = asyncio.create_task(sample_memory()) if options['pid'] and os.path.exists('/proc') else None
+            start = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(options['requests'])))
+            elapsed = time.perf_counter() - start
+            done.set()
+            if sampler:
+                await sampler
+        return results, peak_rss, elapsed
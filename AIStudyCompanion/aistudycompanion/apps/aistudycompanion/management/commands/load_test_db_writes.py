@@ -0,0 +1,115 @@
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from apps.aistudycompanion.database import sqlite_pragmas
+
+SCHEMA = [
+    "CREATE TABLE conversation (id INTEGER PRIMARY KEY, title TEXT, updated_at REAL)",
+    "CREATE TABLE message (id INTEGER PRIMARY KEY, conversation_id INTEGER, type TEXT, content TEXT, timestamp REAL)",
+    "CREATE INDEX message_conversation ON message (conversation_id, timestamp)",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure SQLite write throughput for chat turns (two message inserts and a conversation update per "
+        "transaction) from concurrent writers while readers page through history, with and without the "
+        "connection tuning applied by SQLITE_TUNING. Runs on throwaway database files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run')
+        parser.add_argument('--conversations', type=int, default=100)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{options['writers']} writers, {options['readers']} readers, {options['seconds']}s per run")
+        self.stdout.write(f"{'mode':<10}{'turns/s':>10}{'reads/s':>10}{'locked':>8}{'p50 ms':>9}{'p99 ms':>9}")
+        for name, pragmas in (('default', []), ('tuned', sqlite_pragmas())):
+            with tempfile.TemporaryDirectory() as directory:
+                turns, reads, locked, latencies = self.run(Path(directory) / 'load.sqlite3', pragmas, options)
+            seconds = options['seconds']
+            p50, p99 = (np.percentile(latencies, 50), np.percentile(latencies, 99)) if latencies else (0, 0)
+            self.stdout.write(f"{name:<10}{turns / seconds:>10.0f}{reads / seconds:>10.0f}{locked:>8}"
+                              f"{p50:>9.1f}{p99:>9.1f}")
+
+    def connect(self, path, pragmas):
+        # Same default lock timeout as Django's SQLite backend (Python's 5 seconds)
+        connection = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        for pragma in pragmas:
+            connection.execute(pragma)
+        return connection
+
+    def run(self, path, pragmas, options):
+        setup = self.connect(path, pragmas)
+        for statement in SCHEMA:
+            setup.execute(statement)
+        setup.executemany("INSERT INTO conversation (id, title, updated_at) VALUES (?, ?, ?)",
+                          [(i, f"Conversation {i}", time.time()) for i in range(options['conversations'])])
+        setup.close()
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        totals = {'turns': 0, 'reads': 0, 'locked': 0}
+        latencies = []
+
+        def writer(seed):
+            connection = self.connect(path, pragmas)
+            rng = np.random.default_rng(seed)
+            while not stop.is_set():
+                conversation = int(rng.integers(options['conversations']))
+                start = time.perf_counter()
+                try:
+                    connection.execute("BEGIN IMMEDIATE")
+                    now = time.time()
+                    connection.executemany(
+                        "INSERT INTO message (conversation_id, type, content, timestamp) VALUES (?, ?, ?, ?)",
+                        [(conversation, 'user', 'How do plants make food?', now),
+                         (conversation, 'bot', 'Plants use photosynthesis. ' * 40, now)])
+                    connection.execute("UPDATE conversation SET updated_at = ? WHERE id = ?", (now, conversation))
+                    connection.execute("COMMIT")
+                except sqlite3.OperationalError:
+                    if connection.in_transaction:
+                        connection.execute("ROLLBACK")
+                    with lock:
+                        totals['locked'] += 1
+                    continue
+                with lock:
+                    totals['turns'] += 1
+                    latencies.append((time.perf_counter() - start) * 1000)
+            connection.close()
+
+        def reader(seed):
+            connection = self.connect(path, pragmas)
+            rng = np.random.default_rng(seed)
+            while not stop.is_set():
+                try:
+                    connection.execute(
+                        "SELECT c.id, c.title, COUNT(m.id) FROM conversation c LEFT JOIN message m "
+                        "ON m.conversation_id = c.id GROUP BY c.id ORDER BY c.updated_at DESC LIMIT 10").fetchall()
+                    connection.execute("SELECT content FROM message WHERE conversation_id = ? ORDER BY timestamp",
+                                       (int(rng.integers(options['conversations'])),)).fetchall()
+                except sqlite3.OperationalError:
+                    with lock:
+                        totals['locked'] += 1
+                    continue
+                with lock:
+                    totals['reads'] += 1
+            connection.close()
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(options['writers'])]
+        threads += [threading.Thread(target=reader, args=(1000 + i,)) for i in range(options['readers'])]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return totals['turns'], totals['reads'], totals['locked'], latencies
@@ -0,0 +1,70 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.aistudycompanion.jobs import claim_next_job, default_worker_id, recover_stale_jobs, run_job
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Run background jobs (document ingestion) from the database queue. Start as many processes as needed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Worker threads in this process')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help='Seconds without a heartbeat before a running job is requeued')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is drained')
+
+    def _work(self, stop, poll_interval, once):
+        worker_id = default_worker_id()
+        try:
+            while not stop.is_set():
+                job = claim_next_job(worker_id)
+                if job is None:
+                    if once:
+                        break
+                    stop.wait(poll_interval)
+                    continue
+                self.stdout.write(f"[{worker_id}] running {job}")
+                run_job(job, worker_id)
+        except Exception:
+            logger.exception(f"Worker {worker_id} crashed")
+        finally:
+            # Each thread has its own connection; release it when the thread exits
+            connection.close()
+
+    def handle(self, *args, **options):
+        if options['stale_after'] < 3 * settings.JOB_HEARTBEAT_INTERVAL:
+            raise CommandError(f"--stale-after must be at least three heartbeats "
+                               f"({3 * settings.JOB_HEARTBEAT_INTERVAL:g}s with JOB_HEARTBEAT_INTERVAL), "
+                               f"or running jobs would be requeued")
+        stop = threading.Event()
+        recover_stale_jobs(options['stale_after'])
+
+        threads = [
+            threading.Thread(target=self._work, args=(stop, options['poll_interval'], options['once']), daemon=True)
+            for _ in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Started {len(threads)} workers")
+
+        last_recovery = time.monotonic()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1.0)
+                if not options['once'] and time.monotonic() - last_recovery >= options['stale_after'] / 2:
+                    recover_stale_jobs(options['stale_after'])
+                    last_recovery = time.monotonic()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers after their current job...")
+            stop.set()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from apps.aistudycompanion.subject_classifier import SubjectClassifier, classifier_path, training_examples
+
+
+class Command(BaseCommand):
+    help = (
+        "Retrain the local subject classifier from user messages in conversations with a known subject. "
+        "Running web workers pick up the new model on their next message."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alpha', type=float, default=1.0, help='Laplace smoothing')
+        parser.add_argument('--output', help='Model path (defaults to SUBJECT_CLASSIFIER_PATH)')
+
+    def handle(self, *args, **options):
+        classifier = SubjectClassifier.train(training_examples(), alpha=options['alpha'])
+        path = options['output'] or classifier_path()
+        classifier.save(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Trained on {classifier.example_count} messages ({len(classifier.term_log_probs)} terms); saved to {path}"
+        ))
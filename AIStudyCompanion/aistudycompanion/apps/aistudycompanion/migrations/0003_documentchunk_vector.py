@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0002_customlearningmaterial_documentchunk_ragquery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_dim',
+            field=models.PositiveIntegerField(blank=True, help_text='Number of dimensions in vector', null=True),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_model',
+            field=models.CharField(blank=True, help_text='Model that produced the embedding', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='vector',
+            field=models.BinaryField(blank=True, help_text='Embedding packed as little-endian float32', null=True),
+        ),
+        migrations.AlterField(
+            model_name='documentchunk',
+            name='embedding',
+            field=models.JSONField(blank=True, help_text='Legacy JSON embedding; superseded by vector', null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:32
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0003_documentchunk_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbeddingCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(help_text='SHA-256 of the normalized text', max_length=64)),
+                ('model', models.CharField(help_text='Embedding model name', max_length=100)),
+                ('vector', models.BinaryField(help_text='Embedding packed as little-endian float32')),
+                ('embedding_dim', models.PositiveIntegerField()),
+                ('hit_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('content_hash', 'model')},
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0004_embeddingcache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('process_document', 'Process Document')], max_length=50)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('progress', models.IntegerField(default=0, help_text='Percent complete (0-100)')),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=3)),
+                ('worker_id', models.CharField(blank=True, help_text='Worker currently holding the job', max_length=100)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, help_text='Earliest time the job may be claimed')),
+                ('heartbeat_at', models.DateTimeField(blank=True, help_text='Last sign of life from the running worker', null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('material', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='aistudycompanion.customlearningmaterial')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='job_claim_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0005_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 of the normalized content', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('process_document', 'Process Document'), ('reprocess_document', 'Reprocess Document')], max_length=50),
+        ),
+    ]
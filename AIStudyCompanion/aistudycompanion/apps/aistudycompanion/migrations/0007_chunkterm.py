@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0006_documentchunk_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='token_count',
+            field=models.PositiveIntegerField(blank=True, help_text='Indexed terms in the chunk (BM25 length)', null=True),
+        ),
+        migrations.CreateModel(
+            name='ChunkTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('frequency', models.PositiveIntegerField(help_text='Occurrences of the term in the chunk')),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='aistudycompanion.documentchunk')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='aistudycompanion.customlearningmaterial')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'material'], name='chunkterm_term_material_idx')],
+                'unique_together': {('chunk', 'term')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:46
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0007_chunkterm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubjectClassification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text_hash', models.CharField(help_text='SHA-256 of the normalized message', max_length=64, unique=True)),
+                ('subject', models.CharField(max_length=50)),
+                ('confidence', models.PositiveSmallIntegerField(blank=True, help_text='Classifier confidence (1-10)', null=True)),
+                ('hit_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:56
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0008_subjectclassification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=50)),
+                ('question', models.TextField()),
+                ('question_hash', models.CharField(help_text='SHA-256 of the normalized question', max_length=64)),
+                ('vector', models.BinaryField(help_text='Question embedding packed as little-endian float32')),
+                ('answer', models.TextField()),
+                ('tokens', models.PositiveIntegerField(default=0, help_text='Estimated tokens of the original model call')),
+                ('hit_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['subject', 'last_used_at'], name='answercache_subject_lru_idx')],
+                'unique_together': {('subject', 'question_hash')},
+            },
+        ),
+    ]
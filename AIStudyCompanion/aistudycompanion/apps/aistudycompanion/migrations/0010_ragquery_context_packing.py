@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0009_answercache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ragquery',
+            name='context_tokens',
+            field=models.PositiveIntegerField(blank=True, help_text='Prompt context tokens after packing', null=True),
+        ),
+        migrations.AddField(
+            model_name='ragquery',
+            name='packing',
+            field=models.JSONField(blank=True, default=dict, help_text='Context packing summary: budget, chunks and tokens before and after'),
+        ),
+    ]
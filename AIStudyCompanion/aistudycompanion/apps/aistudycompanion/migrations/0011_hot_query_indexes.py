@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0010_ragquery_context_packing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['conversation', 'timestamp'], name='chatmessage_conversation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user', '-updated_at'], name='conversation_user_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customlearningmaterial',
+            index=models.Index(condition=models.Q(('is_processed', True)), fields=['user'], name='material_user_processed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documentchunk',
+            index=models.Index(condition=models.Q(('vector__isnull', False), ('embedding__isnull', False), _connector='OR'), fields=['material'], name='documentchunk_embedded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studysession',
+            index=models.Index(condition=models.Q(('end_time__isnull', True)), fields=['user'], name='studysession_open_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0011_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', '-updated_at', '-id'], name='conversation_user_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0012_conversation_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('process_document', 'Process Document'), ('reprocess_document', 'Reprocess Document'), ('cleanup', 'Cleanup')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:19
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def close_duplicate_open_sessions(apps, schema_editor):
+    # Earlier get_or_create races left some users with several open sessions; keep the newest
+    StudySession = apps.get_model('aistudycompanion', 'StudySession')
+    kept = set()
+    for session in StudySession.objects.filter(end_time__isnull=True).order_by('user_id', '-start_time', '-id'):
+        if session.user_id in kept:
+            session.end_time = timezone.now()
+            session.save(update_fields=['end_time'])
+        kept.add(session.user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0013_backgroundjob_cleanup_kind'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='chatmessage',
+            options={'ordering': ['timestamp', 'id']},
+        ),
+        migrations.RunPython(close_duplicate_open_sessions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separate from the cleanup in 0014: PostgreSQL refuses DDL on a table with pending
+    # trigger events from rows updated in the same transaction
+
+    dependencies = [
+        ('aistudycompanion', '0014_close_duplicate_open_sessions'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='studysession',
+            name='studysession_open_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='studysession',
+            constraint=models.UniqueConstraint(condition=models.Q(('end_time__isnull', True)), fields=('user',), name='studysession_one_open_per_user'),
+        ),
+    ]
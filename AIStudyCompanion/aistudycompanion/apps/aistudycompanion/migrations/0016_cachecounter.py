@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aistudycompanion', '0015_one_open_study_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cache', models.CharField(choices=[('embedding', 'Embedding'), ('answer', 'Answer')], max_length=20)),
+                ('key', models.CharField(help_text='Embedding model or subject', max_length=100)),
+                ('hits', models.PositiveBigIntegerField(default=0)),
+                ('misses', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('cache', 'key')},
+            },
+        ),
+    ]
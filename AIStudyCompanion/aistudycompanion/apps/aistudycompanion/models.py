@@ -2,8 +2,22 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.validators import FileExtensionValidator, MaxValueValidator
+import numpy as np
 import os
 
+# Embeddings are stored as packed little-endian float32 so they load with a single np.frombuffer
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+
+def pack_embedding(values) -> bytes:
+    """Pack an embedding vector into little-endian float32 bytes."""
+    return np.asarray(values, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def unpack_embedding(data) -> np.ndarray:
+    """Return a read-only float32 view over packed embedding bytes."""
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE)
+
 # Create your models here.
 
 class UserProfile(models.Model):
@@ -29,6 +43,14 @@ class Conversation(models.Model):
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Sidebar: a user's active conversations, most recent first. Partial, because Django
+            # filters booleans as a bare "is_active" term, which a composite key cannot seek on
+            models.Index(fields=['user', '-updated_at'], condition=models.Q(is_active=True),
+                         name='conversation_user_active_idx'),
+            # History pages: keyset order (updated_at, id), so a page seeks from its cursor
+            models.Index(fields=['user', '-updated_at', '-id'], name='conversation_user_recent_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.title or 'Untitled'} ({self.created_at.strftime('%Y-%m-%d')})"
@@ -51,7 +73,11 @@ class ChatMessage(models.Model):
     metadata = models.JSONField(default=dict, blank=True, help_text="Additional data like confidence scores, etc.")
 
     class Meta:
-        ordering = ['timestamp']
+        # Both messages of a turn are inserted together and can share a timestamp; id keeps the user's first
+        ordering = ['timestamp', 'id']
+        indexes = [
+            models.Index(fields=['conversation', 'timestamp'], name='chatmessage_conversation_idx'),
+        ]
 
     def __str__(self):
         return f"{self.conversation.user.username} - {self.message_type} ({self.timestamp.strftime('%H:%M')})"
@@ -70,6 +96,12 @@ class StudySession(models.Model):
 
     class Meta:
         ordering = ['-start_time']
+        constraints = [
+            # At most one open session per user, so chat turns can upsert it without a duplicate race;
+            # the unique index also serves the open-session lookup
+            models.UniqueConstraint(fields=['user'], condition=models.Q(end_time__isnull=True),
+                                    name='studysession_one_open_per_user'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.subject} ({self.start_time.strftime('%Y-%m-%d %H:%M')})"
@@ -118,6 +150,10 @@ class CustomLearningMaterial(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Retrieval joins only a user's processed materials
+            models.Index(fields=['user'], condition=models.Q(is_processed=True), name='material_user_processed_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.title} ({self.document_type.upper()})"
@@ -131,23 +167,87 @@ class CustomLearningMaterial(models.Model):
             self.file_size = self.file.size
         super().save(*args, **kwargs)
 
+    def reprocess(self, new_file=None):
+        """Queue incremental re-ingestion, optionally replacing the stored file first.
+
+        Chunks whose text is unchanged keep their rows and embeddings; only new or
+        edited chunks are embedded again. Returns the queued BackgroundJob.
+        """
+        from django.core.files.storage import default_storage
+        from .jobs import enqueue_job
+
+        if new_file is not None:
+            old_name = self.file.name if self.file else None
+            self.file = new_file
+            self.file_size = new_file.size
+            self.document_type = os.path.splitext(new_file.name)[1].lstrip('.').lower()
+        self.processing_status = 'pending'
+        self.save()
+        if new_file is not None and old_name and old_name != self.file.name and default_storage.exists(old_name):
+            default_storage.delete(old_name)
+        return enqueue_job('reprocess_document', material=self)
+
 class DocumentChunk(models.Model):
     """Chunks of processed documents for RAG functionality."""
     material = models.ForeignKey(CustomLearningMaterial, on_delete=models.CASCADE, related_name='chunks')
     chunk_index = models.IntegerField(help_text="Order of chunk in document")
     content = models.TextField(help_text="Text content of the chunk")
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, help_text="SHA-256 of the normalized content")
     page_number = models.IntegerField(null=True, blank=True, help_text="Page number (for PDFs)")
-    embedding = models.JSONField(null=True, blank=True, help_text="Vector embedding of the chunk")
+    embedding = models.JSONField(null=True, blank=True, help_text="Legacy JSON embedding; superseded by vector")
+    vector = models.BinaryField(null=True, blank=True, help_text="Embedding packed as little-endian float32")
+    embedding_dim = models.PositiveIntegerField(null=True, blank=True, help_text="Number of dimensions in vector")
+    embedding_model = models.CharField(max_length=100, blank=True, help_text="Model that produced the embedding")
+    token_count = models.PositiveIntegerField(null=True, blank=True, help_text="Indexed terms in the chunk (BM25 length)")
     metadata = models.JSONField(default=dict, blank=True, help_text="Additional metadata like section headers, etc.")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['material', 'chunk_index']
         unique_together = ['material', 'chunk_index']
+        indexes = [
+            # Retrieval corpus: chunks that have an embedding in either column
+            models.Index(fields=['material'], name='documentchunk_embedded_idx',
+                         condition=models.Q(vector__isnull=False) | models.Q(embedding__isnull=False)),
+        ]
 
     def __str__(self):
         return f"{self.material.title} - Chunk {self.chunk_index}"
 
+    def set_embedding(self, values, model_name: str = ''):
+        """Store an embedding in the binary vector column."""
+        if values is None or not len(values):
+            self.vector = None
+            self.embedding_dim = None
+        else:
+            self.vector = pack_embedding(values)
+            self.embedding_dim = len(values)
+        self.embedding_model = model_name
+
+    def get_embedding(self):
+        """Return the embedding as a float32 array, falling back to the legacy JSON column."""
+        if self.vector is not None:
+            return unpack_embedding(self.vector)
+        if self.embedding:
+            return np.asarray(self.embedding, dtype=np.float32)
+        return None
+
+class ChunkTerm(models.Model):
+    """Inverted index posting: how often a term occurs in a chunk, for BM25 retrieval."""
+    term = models.CharField(max_length=64)
+    chunk = models.ForeignKey(DocumentChunk, on_delete=models.CASCADE, related_name='terms')
+    material = models.ForeignKey(CustomLearningMaterial, on_delete=models.CASCADE, related_name='terms')
+    frequency = models.PositiveIntegerField(help_text="Occurrences of the term in the chunk")
+
+    class Meta:
+        unique_together = ['chunk', 'term']
+        indexes = [
+            models.Index(fields=['term', 'material'], name='chunkterm_term_material_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} ({self.frequency}) in chunk {self.chunk_id}"
+
 class RAGQuery(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rag_queries')
     material = models.ForeignKey(CustomLearningMaterial, on_delete=models.CASCADE, related_name='queries')
@@ -160,6 +260,9 @@ class RAGQuery(models.Model):
         validators=[MaxValueValidator(1.0)],
         help_text="Confidence score of the response (0-1)"
     )
+    context_tokens = models.PositiveIntegerField(null=True, blank=True, help_text="Prompt context tokens after packing")
+    packing = models.JSONField(default=dict, blank=True,
+                               help_text="Context packing summary: budget, chunks and tokens before and after")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -168,3 +271,109 @@ class RAGQuery(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.material.title} ({self.created_at.strftime('%Y-%m-%d %H:%M')})"
+
+class EmbeddingCache(models.Model):
+    """Embeddings keyed by a hash of normalized text, shared across users and re-uploads."""
+    content_hash = models.CharField(max_length=64, help_text="SHA-256 of the normalized text")
+    model = models.CharField(max_length=100, help_text="Embedding model name")
+    vector = models.BinaryField(help_text="Embedding packed as little-endian float32")
+    embedding_dim = models.PositiveIntegerField()
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = ['content_hash', 'model']
+
+    def __str__(self):
+        return f"{self.model} - {self.content_hash[:12]} ({self.hit_count} hits)"
+
+class CacheCounter(models.Model):
+    """Hit and miss totals of a cache, summed over every process, for the cache stats commands."""
+    CACHES = [
+        ('embedding', 'Embedding'),
+        ('answer', 'Answer'),
+    ]
+
+    cache = models.CharField(max_length=20, choices=CACHES)
+    key = models.CharField(max_length=100, help_text="Embedding model or subject")
+    hits = models.PositiveBigIntegerField(default=0)
+    misses = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['cache', 'key']
+
+    def __str__(self):
+        return f"{self.cache} {self.key}: {self.hits} hits, {self.misses} misses"
+
+class SubjectClassification(models.Model):
+    """Cached subject for a chat message, keyed by a hash of its normalized text."""
+    text_hash = models.CharField(max_length=64, unique=True, help_text="SHA-256 of the normalized message")
+    subject = models.CharField(max_length=50)
+    confidence = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Classifier confidence (1-10)")
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.subject} - {self.text_hash[:12]} ({self.hit_count} hits)"
+
+class AnswerCache(models.Model):
+    """Subject-agent answer reused for semantically similar questions in the same subject."""
+    subject = models.CharField(max_length=50)
+    question = models.TextField()
+    question_hash = models.CharField(max_length=64, help_text="SHA-256 of the normalized question")
+    vector = models.BinaryField(help_text="Question embedding packed as little-endian float32")
+    answer = models.TextField()
+    tokens = models.PositiveIntegerField(default=0, help_text="Estimated tokens of the original model call")
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ['subject', 'question_hash']
+        indexes = [
+            models.Index(fields=['subject', 'last_used_at'], name='answercache_subject_lru_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} - {self.question[:50]} ({self.hit_count} hits)"
+
+class BackgroundJob(models.Model):
+    """Database-backed job queue entry, claimed and run by the run_jobs worker command."""
+    JOB_KINDS = [
+        ('process_document', 'Process Document'),
+        ('reprocess_document', 'Reprocess Document'),
+        ('cleanup', 'Cleanup'),
+    ]
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50, choices=JOB_KINDS)
+    material = models.ForeignKey(CustomLearningMaterial, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default='queued')
+    progress = models.IntegerField(default=0, help_text="Percent complete (0-100)")
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    worker_id = models.CharField(max_length=100, blank=True, help_text="Worker currently holding the job")
+    run_after = models.DateTimeField(default=timezone.now, help_text="Earliest time the job may be claimed")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, help_text="Last sign of life from the running worker")
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.id} ({self.status})"
@@ -1,207 +1,533 @@
-import os
 import logging
-import numpy as np
-from typing import List, Dict, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional, Tuple
 from django.conf import settings
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
-import openai
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from asgiref.sync import async_to_sync, sync_to_async
 from .models import CustomLearningMaterial, DocumentChunk, RAGQuery
+from .ann_index import get_ann_manager
+from .context_packing import PackedContext, pack_context
+from .database import read_from_replica
+from .embedding_cache import QueryEmbeddingMemo, content_hash, get_embedding_cache
+from .extraction import TextSegment, iter_document_text
+from .lexical import BM25Index, index_chunks, tokenize
+from .llm_client import acreate_chat_completion, acreate_embeddings, create_embeddings, get_client
+from .retrieval import get_search_engine, reciprocal_rank_fusion
 
 logger = logging.getLogger(__name__)
 
+NO_CONTEXT_RESPONSE = "I couldn't find any relevant information in your uploaded documents to answer this question. Please try rephrasing your question or upload relevant study materials."
+
 class RAGService:
         
     def __init__(self):
-        self.client = openai.OpenAI(api_key=getattr(settings, 'OPENAI_API_KEY', None))
+        self.client = get_client()  # Shared, pooled client
         self.chunk_size = 1000  # Characters per chunk
         self.chunk_overlap = 200  # Overlap between chunks
         self.max_chunks = 5  # Maximum chunks to retrieve for context
+        self.embedding_model = getattr(settings, 'RAG_EMBEDDING_MODEL', 'text-embedding-ada-002')
+        self.embedding_batch_size = getattr(settings, 'RAG_EMBEDDING_BATCH_SIZE', 100)  # Inputs per embeddings request
+        self.embedding_concurrency = getattr(settings, 'RAG_EMBEDDING_CONCURRENCY', 4)  # Batches in flight
+        self.embedding_max_retries = getattr(settings, 'RAG_EMBEDDING_MAX_RETRIES', 3)
+        self.embedding_retry_backoff = getattr(settings, 'RAG_EMBEDDING_RETRY_BACKOFF', 1.0)  # Seconds, doubled per retry
+        self.ingest_window = getattr(settings, 'RAG_INGEST_WINDOW', 500)  # Chunks embedded and stored per step
+        self.hybrid_search = getattr(settings, 'RAG_HYBRID_SEARCH', True)  # Fuse BM25 and vector rankings
+        self.hybrid_fast_path = getattr(settings, 'RAG_HYBRID_FAST_PATH', False)  # Score vectors of lexical hits only
+        self.lexical_candidates = getattr(settings, 'RAG_LEXICAL_CANDIDATES', 50)  # Candidates per ranking before fusion
+        self.rrf_k = getattr(settings, 'RAG_RRF_K', 60)
+        self.context_token_budget = getattr(settings, 'RAG_CONTEXT_TOKEN_BUDGET', 1500)  # Prompt context tokens
         
-    def process_document(self, material: CustomLearningMaterial) -> bool:
+    def process_document(self, material: CustomLearningMaterial,
+                         progress_callback: Optional[Callable[[int], None]] = None) -> bool:
+        """Extract, chunk and embed a material; progress_callback receives percent complete.
+
+        Text is streamed from the file and chunks are embedded and stored a window at a
+        time, so memory use does not grow with the size of the upload. Chunks stay
+        invisible to search until the material is marked processed.
+        """
+        report_progress = progress_callback or (lambda percent: None)
         try:
-            material.processing_status = 'processing'
-            material.save()
-            
-            # For now, we'll create a simple text extraction
-            # In a full implementation, you would extract text from PDF/DOC files
-            text_content = self._extract_text_from_file(material.file.path, material.document_type)
-            if not text_content:
-                material.processing_status = 'failed'
-                material.save()
+            if not self._set_status(material, processing_status='processing'):
+                logger.info(f"Material {material.pk} was deleted before processing")
                 return False
+            # Drop chunks left behind by an interrupted earlier attempt
+            material.chunks.all().delete()
             
-            # Split text into chunks
-            chunks = self._create_chunks(text_content)
-            
-            # Create document chunks
-            for i, chunk_text in enumerate(chunks):
-                # Generate embedding for chunk
-                embedding = self._generate_embedding(chunk_text)
-                
-                # Create DocumentChunk
-                DocumentChunk.objects.create(
+            segments = iter_document_text(material.file.path, material.document_type)
+            chunk_count = 0
+            last_page = None
+            window = []
+            for chunk_text, page_number, progress in self._iter_chunks(segments):
+                window.append(DocumentChunk(
                     material=material,
-                    chunk_index=i,
+                    chunk_index=chunk_count,
                     content=chunk_text,
-                    embedding=embedding,
+                    content_hash=content_hash(chunk_text),
+                    page_number=page_number,
                     metadata={'chunk_size': len(chunk_text)}
-                )
+                ))
+                chunk_count += 1
+                last_page = page_number or last_page
+                if len(window) >= self.ingest_window:
+                    self._store_chunks(window)
+                    window = []
+                    # Extraction, embedding and storage together cover 5-95%
+                    report_progress(5 + int(90 * progress))
+            if window:
+                self._store_chunks(window)
+            report_progress(95)
             
-            material.is_processed = True
-            material.processing_status = 'completed'
-            material.save()
+            if not chunk_count:
+                logger.warning(f"No text could be extracted from {material.title}")
+                self._set_status(material, processing_status='failed')
+                return False
+            
+            fields = {'is_processed': True, 'processing_status': 'completed'}
+            if last_page:
+                fields['pages'] = last_page
+            if not self._set_status(material, **fields):
+                # Deleted while processing: drop anything stored after its chunks were removed
+                DocumentChunk.objects.filter(material_id=material.pk).delete()
+                logger.info(f"Material {material.pk} was deleted while processing")
+                return False
+            get_search_engine().invalidate(material.user_id)
+            get_ann_manager().add_chunks(material.user_id, material.id,
+                                         material.chunks.only('id', 'vector', 'embedding').iterator())
             
-            logger.info(f"Successfully processed document: {material.title}")
+            logger.info(f"Successfully processed document: {material.title} ({chunk_count} chunks)")
             return True
             
         except Exception as e:
             logger.error(f"Error processing document {material.title}: {e}")
-            material.processing_status = 'failed'
-            material.save()
+            DocumentChunk.objects.filter(material_id=material.pk).delete()
+            self._set_status(material, processing_status='failed')
             return False
     
-    def _extract_text_from_file(self, file_path: str, document_type: str) -> Optional[str]:
+    def reprocess_document(self, material: CustomLearningMaterial,
+                           progress_callback: Optional[Callable[[int], None]] = None) -> bool:
+        """Re-chunk a processed material, embedding only chunks whose text changed.
+
+        New chunks are matched to existing rows by content hash. Matched rows keep their
+        embeddings and are renumbered and rewritten in place (the hash ignores whitespace,
+        so their stored text may still differ), unmatched text is embedded and inserted,
+        and rows left without a match are deleted. The swap happens in one transaction,
+        so searches never see a half-updated document. Stored chunk text is never read
+        back; only embeddings of new or edited chunks are requested.
+        """
+        if not material.is_processed:
+            return self.process_document(material, progress_callback)
+        
+        report_progress = progress_callback or (lambda percent: None)
         try:
-            if document_type == 'txt':
-                return self._extract_text_from_txt(file_path)
-            else:
-                # For now, return a placeholder for PDF/DOC files
-                # In production, you would implement proper text extraction
-                logger.warning(f"Text extraction for {document_type} not yet implemented")
-                return f"Document content for {document_type} file. This is a placeholder for the actual content extraction."
+            if not self._set_status(material, processing_status='processing'):
+                logger.info(f"Material {material.pk} was deleted before reprocessing")
+                return False
+            self._backfill_chunk_hashes(material)
+            
+            existing = {}
+            for chunk_id, digest, model_name in (material.chunks.order_by('chunk_index')
+                                                 .values_list('id', 'content_hash', 'embedding_model')):
+                # Embeddings from another model cannot be mixed with fresh ones
+                if model_name and model_name != self.embedding_model:
+                    continue
+                existing.setdefault(digest, deque()).append(chunk_id)
+            
+            kept = []
+            added = []
+            last_page = None
+            segments = iter_document_text(material.file.path, material.document_type)
+            for chunk_index, (chunk_text, page_number, progress) in enumerate(self._iter_chunks(segments)):
+                last_page = page_number or last_page
+                digest = content_hash(chunk_text)
+                matches = existing.get(digest)
+                if matches:
+                    kept.append(DocumentChunk(
+                        id=matches.popleft(),
+                        chunk_index=chunk_index,
+                        content=chunk_text,
+                        page_number=page_number,
+                        metadata={'chunk_size': len(chunk_text)},
+                        token_count=len(tokenize(chunk_text))
+                    ))
+                else:
+                    added.append(DocumentChunk(
+                        material=material,
+                        chunk_index=chunk_index,
+                        content=chunk_text,
+                        content_hash=digest,
+                        page_number=page_number,
+                        metadata={'chunk_size': len(chunk_text)}
+                    ))
+                if chunk_index % 100 == 0:
+                    report_progress(5 + int(45 * progress))
+            
+            if not kept and not added:
+                logger.warning(f"No text could be extracted from {material.title}")
+                self._set_status(material, processing_status='failed')
+                return False
+            
+            embeddings = self._generate_embeddings(
+                [chunk.content for chunk in added],
+                progress_callback=lambda fraction: report_progress(50 + int(40 * fraction))
+            )
+            for chunk, embedding in zip(added, embeddings):
+                chunk.set_embedding(embedding, self.embedding_model)
+            orphan_ids = [chunk_id for chunk_ids in existing.values() for chunk_id in chunk_ids]
+            
+            with transaction.atomic():
+                # Park every row at a negative index so renumbering never collides with new rows
+                material.chunks.update(chunk_index=-1 - F('chunk_index'))
+                for start in range(0, len(orphan_ids), 500):
+                    DocumentChunk.objects.filter(id__in=orphan_ids[start:start + 500]).delete()
+                DocumentChunk.objects.bulk_update(kept, ['chunk_index', 'content', 'page_number', 'metadata', 'token_count'],
+                                                  batch_size=500)
+                added = DocumentChunk.objects.bulk_create(added, batch_size=500)
+                index_chunks(added)
+                fields = {'is_processed': True, 'processing_status': 'completed'}
+                if last_page:
+                    fields['pages'] = last_page
+                if not self._set_status(material, **fields):
+                    transaction.set_rollback(True)
+                    logger.info(f"Material {material.pk} was deleted while reprocessing")
+                    return False
+            get_search_engine().invalidate(material.user_id)
+            get_ann_manager().remove_chunks(material.user_id, material.id, orphan_ids)
+            get_ann_manager().add_chunks(material.user_id, material.id, added)
+            
+            logger.info(f"Reprocessed document {material.title}: {len(kept)} chunks kept, "
+                        f"{len(added)} embedded, {len(orphan_ids)} removed")
+            return True
+            
         except Exception as e:
-            logger.error(f"Error extracting text from {file_path}: {e}")
-            return None
+            logger.error(f"Error reprocessing document {material.title}: {e}")
+            self._set_status(material, processing_status='failed')
+            return False
     
-    def _extract_text_from_txt(self, file_path: str) -> str:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        except Exception as e:
-            logger.error(f"Error reading TXT {file_path}: {e}")
-            return ""
+    @staticmethod
+    def _set_status(material: CustomLearningMaterial, **fields) -> bool:
+        """Write processing fields with an UPDATE; returns False if the material no longer exists.
+
+        ``save()`` would re-insert a material deleted while its job was running.
+        """
+        for name, value in fields.items():
+            setattr(material, name, value)
+        return CustomLearningMaterial.objects.filter(pk=material.pk).update(updated_at=timezone.now(), **fields) > 0
     
-    def _create_chunks(self, text: str) -> List[str]:
-        chunks = []
+    def _backfill_chunk_hashes(self, material: CustomLearningMaterial):
+        """Fill content_hash on chunks stored before it existed."""
+        pending = []
+        for chunk in material.chunks.filter(content_hash='').only('id', 'content').iterator():
+            chunk.content_hash = content_hash(chunk.content)
+            pending.append(chunk)
+            if len(pending) >= 500:
+                DocumentChunk.objects.bulk_update(pending, ['content_hash'])
+                pending = []
+        if pending:
+            DocumentChunk.objects.bulk_update(pending, ['content_hash'])
+    
+    def _store_chunks(self, chunks: List[DocumentChunk]):
+        """Embed a window of chunks in batched requests and insert them, with their postings, in one transaction."""
+        embeddings = self._generate_embeddings([chunk.content for chunk in chunks])
+        for chunk, embedding in zip(chunks, embeddings):
+            chunk.set_embedding(embedding, self.embedding_model)
+        with transaction.atomic():
+            chunks = DocumentChunk.objects.bulk_create(chunks, batch_size=500)
+            index_chunks(chunks)
+    
+    def _iter_chunks(self, segments: Iterable[TextSegment]) -> Iterator[Tuple[str, Optional[int], float]]:
+        """Split a stream of text segments into overlapping chunks.
+
+        Yields (chunk text, page number of the chunk's first character, fraction of the
+        input consumed). Only the text needed for the next chunk is buffered.
+        """
+        segments = iter(segments)
+        buffer = ''
+        offset = 0  # Position of buffer[0] in the whole text
+        pages = []  # (position, page_number) where each buffered segment starts
+        progress = 0.0
+        exhausted = False
         start = 0
         
-        while start < len(text):
+        while True:
+            # One character past the chunk is needed to look for a sentence boundary
+            while not exhausted and offset + len(buffer) <= start + self.chunk_size:
+                segment = next(segments, None)
+                if segment is None:
+                    exhausted = True
+                    break
+                pages.append((offset + len(buffer), segment.page_number))
+                buffer += segment.text
+                progress = segment.progress
+            
+            text_end = offset + len(buffer)
+            if start >= text_end:
+                break
+            
             end = start + self.chunk_size
             
             # If this isn't the last chunk, try to break at a sentence boundary
-            if end < len(text):
+            if end < text_end:
                 # Look for sentence endings
                 for i in range(end, max(start + self.chunk_size - 100, start), -1):
-                    if text[i] in '.!?':
+                    if buffer[i - offset] in '.!?':
                         end = i + 1
                         break
             
-            chunk = text[start:end].strip()
+            chunk = buffer[start - offset:end - offset].strip()
             if chunk:
-                chunks.append(chunk)
+                page_number = None
+                for position, page in pages:
+                    if position > start:
+                        break
+                    page_number = page
+                yield chunk, page_number, progress
             
             # Move start position with overlap
             start = end - self.chunk_overlap
-            if start >= len(text):
+            if start >= text_end:
                 break
-        
-        return chunks
+            
+            # Release text and page markers that no later chunk can reach
+            buffer = buffer[start - offset:]
+            offset = start
+            while len(pages) > 1 and pages[1][0] <= start:
+                pages.pop(0)
+    
+    def _create_chunks(self, text: str) -> List[str]:
+        return [chunk for chunk, _, _ in self._iter_chunks([TextSegment(text, None, 1.0)])]
     
     def _generate_embedding(self, text: str) -> List[float]:
         try:
+            cache = get_embedding_cache()
+            cached = cache.get_many([text], self.embedding_model)[0]
+            if cached is not None:
+                return cached
+            
             if not self.client:
                 logger.error("OpenAI client not initialized")
                 return []
             
-            response = self.client.embeddings.create(
-                model="text-embedding-ada-002",
+            response = create_embeddings(
+                model=self.embedding_model,
                 input=text
             )
-            return response.data[0].embedding
+            embedding = response.data[0].embedding
+            cache.put_many([text], [embedding], self.embedding_model)
+            return embedding
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             return []
     
-    def search_documents(self, user, query: str, material_id: Optional[int] = None) -> List[DocumentChunk]:
+    def _generate_embeddings(self, texts: List[str],
+                             progress_callback: Optional[Callable[[float], None]] = None) -> List[List[float]]:
+        """Embed many texts, serving repeats from the embedding cache and requesting only the misses."""
+        if not texts:
+            return []
+        
+        cache = get_embedding_cache()
+        embeddings = cache.get_many(texts, self.embedding_model)
+        
+        # Identical chunks within one document are requested once
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if missing:
+            fresh = dict(zip(missing, self._request_embeddings(missing, progress_callback)))
+            cache.put_many(missing, [fresh[text] for text in missing], self.embedding_model)
+            embeddings = [fresh[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+        
+        logger.info(f"Embedded {len(texts)} texts: {len(texts) - len(missing)} from cache, {len(missing)} requested")
+        return embeddings
+    
+    def _request_embeddings(self, texts: List[str],
+                            progress_callback: Optional[Callable[[float], None]] = None) -> List[List[float]]:
+        """Embed texts with batched requests, keeping at most embedding_concurrency batches in flight."""
+        if not self.client:
+            raise RuntimeError("OpenAI client not initialized")
+        
+        batches = [texts[i:i + self.embedding_batch_size] for i in range(0, len(texts), self.embedding_batch_size)]
+        results = [None] * len(batches)
+        workers = max(1, min(self.embedding_concurrency, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self._embed_batch, batch): i for i, batch in enumerate(batches)}
+            try:
+                # as_completed yields in this thread, so progress callbacks never run on pool threads
+                for done, future in enumerate(as_completed(futures), start=1):
+                    results[futures[future]] = future.result()
+                    if progress_callback:
+                        progress_callback(done / len(batches))
+            except BaseException:
+                # The document fails as a whole; batches not yet sent are not requested
+                for future in futures:
+                    future.cancel()
+                raise
+        return [embedding for batch in results for embedding in batch]
+    
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """Embed one batch, retrying transient failures with jittered exponential backoff."""
+        response = create_embeddings(
+            model=self.embedding_model,
+            input=batch,
+            max_retries=self.embedding_max_retries,
+            backoff=self.embedding_retry_backoff
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    
+    def _get_query_embedding(self, query: str) -> List[float]:
+        """Embed a question, memoized on its normalized text so repeats skip the network call."""
+        memo = QueryEmbeddingMemo(self.embedding_model)
+        embedding = memo.get(query)
+        if embedding is not None:
+            return embedding
+        
+        embedding = self._generate_embedding(query)
+        if embedding:
+            memo.set(query, embedding)
+        return embedding
+    
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        """Async _get_query_embedding; the embeddings request does not hold a thread."""
         try:
-            # Generate embedding for query
-            query_embedding = self._generate_embedding(query)
-            if not query_embedding:
-                return []
+            memo = QueryEmbeddingMemo(self.embedding_model)
+            embedding = await memo.aget(query)
+            if embedding is not None:
+                return embedding
             
-            # Get user's materials
-            if material_id:
-                materials = CustomLearningMaterial.objects.filter(
-                    user=user, 
-                    id=material_id,
-                    is_processed=True
+            store = get_embedding_cache()
+            embedding = (await sync_to_async(store.get_many)([query], self.embedding_model))[0]
+            if embedding is None:
+                response = await acreate_embeddings(
+                    model=self.embedding_model,
+                    input=query
                 )
-            else:
-                materials = CustomLearningMaterial.objects.filter(
-                    user=user, 
-                    is_processed=True
-                )
-            
-            if not materials.exists():
-                return []
-            
-            # Get all chunks from user's materials
-            chunks = DocumentChunk.objects.filter(
-                material__in=materials,
-                embedding__isnull=False
-            )
-            
-            # Calculate similarity scores
-            chunk_scores = []
-            for chunk in chunks:
-                if chunk.embedding:
-                    similarity = self._calculate_cosine_similarity(query_embedding, chunk.embedding)
-                    chunk_scores.append((chunk, similarity))
-            
-            # Sort by similarity and return top chunks
-            chunk_scores.sort(key=lambda x: x[1], reverse=True)
-            top_chunks = [chunk for chunk, score in chunk_scores[:self.max_chunks]]
-            
-            return top_chunks
-            
+                embedding = response.data[0].embedding
+                await sync_to_async(store.put_many)([query], [embedding], self.embedding_model)
+            await memo.aset(query, embedding)
+            return embedding
         except Exception as e:
-            logger.error(f"Error searching documents: {e}")
+            logger.error(f"Error generating embedding: {e}")
             return []
     
-    def _calculate_cosine_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
+    def search_documents(self, user, query: str, material_id: Optional[int] = None) -> List[DocumentChunk]:
+        # Generate embedding for query
+        query_embedding = self._get_query_embedding(query)
+        if not query_embedding:
+            return []
+        return self._search_with_embedding(user, query, query_embedding, material_id)
+    
+    async def asearch_documents(self, user, query: str, material_id: Optional[int] = None) -> List[DocumentChunk]:
+        query_embedding = await self._aget_query_embedding(query)
+        if not query_embedding:
+            return []
+        # Ranking is CPU and ORM work, so it runs in Django's sync thread
+        return await sync_to_async(self._search_with_embedding)(user, query, query_embedding, material_id)
+    
+    @read_from_replica
+    def _search_with_embedding(self, user, query: str, query_embedding: List[float],
+                               material_id: Optional[int] = None) -> List[DocumentChunk]:
         try:
-            vec1 = np.array(embedding1)
-            vec2 = np.array(embedding2)
+            engine = get_search_engine()
+            if not self.hybrid_search:
+                # Score the whole corpus with one matrix-vector product and
+                # load chunk text only for the top matches
+                return engine.search(user, query_embedding, self.max_chunks, material_id)
             
-            dot_product = np.dot(vec1, vec2)
-            norm1 = np.linalg.norm(vec1)
-            norm2 = np.linalg.norm(vec2)
+            lexical = BM25Index().search(user, query, self.lexical_candidates, material_id)
+            if self.hybrid_fast_path and len(lexical) >= self.max_chunks:
+                # Enough keyword hits: rerank those candidates instead of scoring every vector
+                dense = engine.score_candidates(query_embedding, [chunk_id for chunk_id, _ in lexical])
+            else:
+                dense = engine.rank(user, query_embedding, self.lexical_candidates, material_id)
             
-            if norm1 == 0 or norm2 == 0:
-                return 0.0
+            fused = reciprocal_rank_fusion([lexical, dense], self.rrf_k)[:self.max_chunks]
+            chunks = engine.load_chunks(fused)
+            similarities = dict(dense)
+            bm25_scores = dict(lexical)
+            for chunk in chunks:
+                chunk.fusion_score = chunk.similarity
+                chunk.similarity = similarities.get(chunk.id, 0.0)
+                chunk.bm25_score = bm25_scores.get(chunk.id, 0.0)
+            return chunks
             
-            return dot_product / (norm1 * norm2)
         except Exception as e:
-            logger.error(f"Error calculating cosine similarity: {e}")
-            return 0.0
+            logger.error(f"Error searching documents: {e}")
+            return []
     
-    def generate_rag_response(self, user, query: str, material_id: Optional[int] = None) -> Tuple[str, float, List[DocumentChunk]]:
+    def generate_rag_response(self, user, query: str, material_id: Optional[int] = None
+                              ) -> Tuple[str, float, List[DocumentChunk], Optional[PackedContext]]:
+        """Sync agenerate_rag_response, for callers outside the event loop."""
+        return async_to_sync(self.agenerate_rag_response)(user, query, material_id)
+    
+    async def agenerate_rag_response(self, user, query: str, material_id: Optional[int] = None
+                                     ) -> Tuple[str, float, List[DocumentChunk], Optional[PackedContext]]:
+        """Answer a question from the user's documents; returns (answer, confidence, chunks used, packing).
+
+        ``packing`` is the context sent to the model (None when there was none), to pass
+        on to save_rag_query. The event loop stays free while the query is embedded and
+        the model answers.
+        """
         try:
-            # Search for relevant chunks
-            relevant_chunks = self.search_documents(user, query, material_id)
+            relevant_chunks = await self.asearch_documents(user, query, material_id)
             
             if not relevant_chunks:
-                return "I couldn't find any relevant information in your uploaded documents to answer this question. Please try rephrasing your question or upload relevant study materials.", 0.0, []
-            
-            # Prepare context from chunks
-            context = "\n\n".join([chunk.content for chunk in relevant_chunks])
+                return NO_CONTEXT_RESPONSE, 0.0, [], None
             
-            # Generate response using OpenAI
-            if not self.client:
-                return "Sorry, I'm unable to generate responses at the moment. Please try again later.", 0.0, relevant_chunks
-            
-            prompt = f"""You are an educational assistant helping a student with their uploaded study materials. 
+            packed = self._pack_context(relevant_chunks)
+            response = await acreate_chat_completion(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": self._build_rag_prompt(query, packed.text)}],
+                max_tokens=500,
+                temperature=0.3
+            )
+            ai_response = response.choices[0].message.content.strip()
+            confidence = min(0.9, len(relevant_chunks) / self.max_chunks)
+            return ai_response, confidence, packed.chunks, packed
+        except Exception as e:
+            logger.error(f"Error generating RAG response: {e}")
+            return "Sorry, I encountered an error while processing your question. Please try again.", 0.0, [], None
+    
+    async def astream_rag_response(self, user, query: str, material_id: Optional[int] = None
+                                   ) -> Tuple[AsyncIterator[str], float, List[DocumentChunk], Optional[PackedContext]]:
+        """Like agenerate_rag_response, but the answer is an async iterator of text deltas.
+
+        Retrieval runs immediately; the completion is requested when iteration starts,
+        and tokens are yielded as the API sends them.
+        """
+        relevant_chunks = await self.asearch_documents(user, query, material_id)
+        if not relevant_chunks:
+            return self._astream_text(NO_CONTEXT_RESPONSE), 0.0, [], None
+        
+        confidence = min(0.9, len(relevant_chunks) / self.max_chunks)
+        packed = self._pack_context(relevant_chunks)
+        return self._astream_completion(self._build_rag_prompt(query, packed.text)), confidence, packed.chunks, packed
+    
+    @staticmethod
+    async def _astream_text(text: str) -> AsyncIterator[str]:
+        yield text
+    
+    async def _astream_completion(self, prompt: str) -> AsyncIterator[str]:
+        stream = await acreate_chat_completion(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=500,
+            temperature=0.3,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    def _pack_context(self, relevant_chunks: List[DocumentChunk]) -> PackedContext:
+        """Merge overlapping neighbours and fit the chunks to the context token budget."""
+        packed = pack_context(relevant_chunks, self.context_token_budget)
+        logger.info(f"Packed {packed.retrieved} chunks into {packed.passages} passages: "
+                    f"{packed.raw_tokens} -> {packed.tokens} context tokens")
+        return packed
+    
+    @staticmethod
+    def _build_rag_prompt(query: str, context: str) -> str:
+        return f"""You are an educational assistant helping a student with their uploaded study materials. 
                         Context from the student's documents:
                         {context}
                         Student's question: {query}
@@ -212,31 +538,32 @@ class RAGService:
                         3. Clear and well-structured
                         4. Helpful for learning and understanding
                         Response:"""
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=500,
-                temperature=0.3
-            ) 
-            ai_response = response.choices[0].message.content.strip()
-            confidence = min(0.9, len(relevant_chunks) / self.max_chunks) if relevant_chunks else 0.0
-            return ai_response, confidence, relevant_chunks
-        except Exception as e:
-            logger.error(f"Error generating RAG response: {e}")
-            return "Sorry, I encountered an error while processing your question. Please try again.", 0.0, []
     
-    def save_rag_query(self, user, material: CustomLearningMaterial, query: str, response: str, relevant_chunks: List[DocumentChunk], confidence: float) -> RAGQuery:
-        """Save RAG query for analytics and improvement."""
+    def save_rag_query(self, user, material: CustomLearningMaterial, query: str, response: str, relevant_chunks: List[DocumentChunk], confidence: float,
+                       packing: Optional[PackedContext] = None) -> RAGQuery:
+        """Save RAG query for analytics and improvement.
+
+        ``packing`` is the context returned with the answer; without it no context size is recorded.
+        """
         try:
             rag_query = RAGQuery.objects.create(
                 user=user,
                 material=material,
                 query=query,
                 response=response,
-                confidence_score=confidence
+                confidence_score=confidence,
+                context_tokens=packing.tokens if packing else None,
+                packing=packing.log() if packing else {}
             )
             rag_query.relevant_chunks.set(relevant_chunks)
             return rag_query
         except Exception as e:
             logger.error(f"Error saving RAG query: {e}")
-            return None 
\ No newline at end of file
+            return None 
+    
+    async def asave_rag_query(self, user, material: CustomLearningMaterial, query: str, response: str,
+                              relevant_chunks: List[DocumentChunk], confidence: float,
+                              packing: Optional[PackedContext] = None) -> Optional[RAGQuery]:
+        """Async save_rag_query; the query and its chunk links are written in Django's sync thread."""
+        return await sync_to_async(self.save_rag_query)(user, material, query, response, relevant_chunks, confidence,
+                                                        packing)
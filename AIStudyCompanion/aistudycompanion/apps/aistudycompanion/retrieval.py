@@ -0,0 +1,277 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max, Q
+
+from .ann_index import get_ann_manager
+from .models import DocumentChunk, EMBEDDING_DTYPE, pack_embedding
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkMatrix:
+    """Pre-normalized float32 embedding matrix for one retrieval corpus."""
+
+    def __init__(self, chunk_ids: np.ndarray, material_ids: np.ndarray, vectors: np.ndarray, signature: Tuple):
+        self.chunk_ids = chunk_ids
+        self.material_ids = material_ids
+        self.vectors = vectors
+        self.signature = signature
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    @property
+    def dimension(self) -> int:
+        return self.vectors.shape[1] if self.vectors.ndim == 2 else 0
+
+    def top_k(self, query_vector: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """Score every row with one matrix-vector product and return the best k (id, score) pairs."""
+        if not len(self) or k <= 0 or query_vector.shape[0] != self.dimension:
+            return []
+
+        scores = self.vectors @ query_vector
+        if k < len(scores):
+            # Partial selection: O(n) to find the winners, then sort only those k
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        ordered = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(int(self.chunk_ids[i]), float(scores[i])) for i in ordered]
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize each row in place; all-zero rows are left as zeros."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+def normalize_vector(vector) -> Optional[np.ndarray]:
+    """Return a float32 unit vector, or None if the vector is empty or all zeros."""
+    vec = np.asarray(vector, dtype=np.float32)
+    if vec.ndim != 1 or not vec.size:
+        return None
+    norm = np.linalg.norm(vec)
+    if norm == 0:
+        return None
+    return vec / norm
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[int, float]]], k: int = 60) -> List[Tuple[int, float]]:
+    """Merge ranked (id, score) lists by summing 1 / (k + rank); raw scores are ignored."""
+    fused = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))
+
+
+class VectorSearchEngine:
+    """Caches per-user chunk matrices in process and answers top-k queries against them.
+
+    Each cached matrix carries a signature (chunk count, highest chunk id and latest
+    material update) that is re-checked with a single aggregate query on every search,
+    so matrices rebuilt in another process, after an upload/delete or after embeddings
+    were rewritten in place are picked up without explicit signalling. Writers that
+    change stored vectors without adding or deleting chunks must bump the material's
+    ``updated_at``.
+
+    When ``RAG_ANN_ENABLED`` is set, corpora with at least ``RAG_ANN_MIN_CHUNKS`` chunks
+    are searched through a persisted IVF index instead of the exact matrix.
+    """
+
+    def __init__(self, max_corpora: Optional[int] = None):
+        self.max_corpora = max_corpora or getattr(settings, 'RAG_MATRIX_CACHE_SIZE', 32)
+        self._matrices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _corpus_queryset(self, user, material_id: Optional[int] = None):
+        chunks = DocumentChunk.objects.filter(
+            material__user=user,
+            material__is_processed=True
+        ).filter(Q(vector__isnull=False) | Q(embedding__isnull=False))
+        if material_id:
+            chunks = chunks.filter(material_id=material_id)
+        return chunks
+
+    def _build_matrix(self, chunks, signature: Tuple) -> ChunkMatrix:
+        ids = []
+        material_ids = []
+        packed = []
+        dimension = None
+        rows = chunks.values_list('id', 'material_id', 'vector', 'embedding_dim', 'embedding').iterator()
+        for chunk_id, material_id, vector, embedding_dim, embedding in rows:
+            if vector is None:
+                # Rows not yet converted by backfill_chunk_vectors still carry JSON
+                if not embedding:
+                    continue
+                vector, embedding_dim = pack_embedding(embedding), len(embedding)
+            embedding_dim = embedding_dim or len(vector) // EMBEDDING_DTYPE.itemsize
+            if dimension is None:
+                dimension = embedding_dim
+            elif embedding_dim != dimension:
+                logger.warning(f"Skipping chunk {chunk_id}: embedding has {embedding_dim} dimensions, expected {dimension}")
+                continue
+            ids.append(chunk_id)
+            material_ids.append(material_id)
+            packed.append(bytes(vector))
+
+        if not packed:
+            empty_ids = np.empty(0, dtype=np.int64)
+            return ChunkMatrix(empty_ids, empty_ids, np.empty((0, 0), dtype=np.float32), signature)
+
+        # One frombuffer over the concatenated rows; astype copies so rows can be normalized in place
+        vectors = np.frombuffer(b''.join(packed), dtype=EMBEDDING_DTYPE).reshape(len(packed), dimension)
+        vectors = normalize_rows(vectors.astype(np.float32))
+        return ChunkMatrix(np.asarray(ids, dtype=np.int64), np.asarray(material_ids, dtype=np.int64), vectors, signature)
+
+    @staticmethod
+    def _signature(chunks) -> Tuple:
+        stats = chunks.aggregate(count=Count('id'), last_id=Max('id'), updated=Max('material__updated_at'))
+        return (stats['count'], stats['last_id'], stats['updated'])
+
+    def get_matrix(self, user, material_id: Optional[int] = None) -> ChunkMatrix:
+        """Return the cached matrix for a corpus, rebuilding it if its chunks have changed."""
+        chunks = self._corpus_queryset(user, material_id)
+        return self._get_matrix((user.pk, material_id), chunks, self._signature(chunks))
+
+    def _get_matrix(self, key: Tuple, chunks, signature: Tuple) -> ChunkMatrix:
+        with self._lock:
+            matrix = self._matrices.get(key)
+            if matrix is not None and matrix.signature == signature:
+                self._matrices.move_to_end(key)
+                return matrix
+
+        matrix = self._build_matrix(chunks, signature)
+
+        with self._lock:
+            self._matrices[key] = matrix
+            self._matrices.move_to_end(key)
+            while len(self._matrices) > self.max_corpora:
+                self._matrices.popitem(last=False)
+        return matrix
+
+    def _ensure_index(self, scope: str, owner_id: int, chunks, signature: Tuple):
+        """Load the ANN index for a corpus, building or re-syncing it when it is missing or stale."""
+        manager = get_ann_manager()
+        index = manager.get(scope, owner_id)
+        # ANN indexes are signed by their ids only; in-place rewrites update them through the manager
+        if index is not None and not index.needs_retrain(signature[0]) and index.signature == signature[:2]:
+            return index
+
+        with manager.locked(scope, owner_id):
+            # Another process may have updated the index while this one waited for the lock
+            return self._sync_index(manager, scope, owner_id, chunks, signature)
+
+    def _sync_index(self, manager, scope: str, owner_id: int, chunks, signature: Tuple):
+        index = manager.get(scope, owner_id)
+
+        if index is None or index.needs_retrain(signature[0]):
+            matrix = self._build_matrix(chunks, signature)
+            return manager.build(scope, owner_id, matrix.chunk_ids, matrix.material_ids, matrix.vectors)
+
+        if index.signature != signature[:2]:
+            # Another process changed the corpus without updating this index; apply the difference
+            db_ids = np.fromiter(chunks.values_list('id', flat=True).iterator(), dtype=np.int64)
+            stale = np.setdiff1d(index.ids, db_ids)
+            missing = np.setdiff1d(db_ids, index.ids)
+            if len(stale):
+                index = index.without(ids=stale.tolist())
+            if len(missing):
+                added = self._build_matrix(chunks.filter(id__in=missing.tolist()), signature)
+                if len(added):
+                    index = index.with_added(added.chunk_ids, added.material_ids, added.vectors)
+            manager.put(scope, owner_id, index)
+        return index
+
+    def _ann_top_k(self, user, query_vector: np.ndarray, k: int,
+                   material_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        nprobe = getattr(settings, 'RAG_ANN_NPROBE', 16)
+
+        if getattr(settings, 'RAG_ANN_SCOPE', 'user') == 'material':
+            min_chunks = getattr(settings, 'RAG_ANN_MIN_CHUNKS', 5000)
+            groups = (self._corpus_queryset(user, material_id)
+                      .order_by().values('material_id')
+                      .annotate(count=Count('id'), last_id=Max('id'), updated=Max('material__updated_at')))
+            winners = []
+            for group in groups:
+                chunks = self._corpus_queryset(user, group['material_id'])
+                signature = (group['count'], group['last_id'], group['updated'])
+                if group['count'] >= min_chunks:
+                    index = self._ensure_index('material', group['material_id'], chunks, signature)
+                    winners.extend(index.search(query_vector, k, nprobe))
+                else:
+                    matrix = self._get_matrix((user.pk, group['material_id']), chunks, signature)
+                    winners.extend(matrix.top_k(query_vector, k))
+            winners.sort(key=lambda winner: winner[1], reverse=True)
+            return winners[:k]
+
+        chunks = self._corpus_queryset(user)
+        index = self._ensure_index('user', user.pk, chunks, self._signature(chunks))
+        return index.search(query_vector, k, nprobe, material_id=material_id)
+
+    def rank(self, user, query_embedding, k: int, material_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Return the k most similar (chunk id, cosine similarity) pairs, best first."""
+        query_vector = normalize_vector(query_embedding)
+        if query_vector is None:
+            return []
+
+        chunks = self._corpus_queryset(user, material_id)
+        signature = self._signature(chunks)
+        if (getattr(settings, 'RAG_ANN_ENABLED', False)
+                and signature[0] >= getattr(settings, 'RAG_ANN_MIN_CHUNKS', 5000)):
+            return self._ann_top_k(user, query_vector, k, material_id)
+        return self._get_matrix((user.pk, material_id), chunks, signature).top_k(query_vector, k)
+
+    def score_candidates(self, query_embedding, chunk_ids: List[int]) -> List[Tuple[int, float]]:
+        """Score only the given chunks, best first, without touching the corpus matrix."""
+        query_vector = normalize_vector(query_embedding)
+        if query_vector is None or not chunk_ids:
+            return []
+        matrix = self._build_matrix(DocumentChunk.objects.filter(id__in=chunk_ids), None)
+        return matrix.top_k(query_vector, len(matrix))
+
+    @staticmethod
+    def load_chunks(scored: List[Tuple[int, float]]) -> List[DocumentChunk]:
+        """Fetch chunks for (id, score) pairs in the given order, setting ``similarity`` on each."""
+        chunks_by_id = DocumentChunk.objects.select_related('material').in_bulk([chunk_id for chunk_id, _ in scored])
+        results = []
+        for chunk_id, score in scored:
+            chunk = chunks_by_id.get(chunk_id)
+            if chunk is not None:
+                chunk.similarity = score
+                results.append(chunk)
+        return results
+
+    def search(self, user, query_embedding, k: int, material_id: Optional[int] = None) -> List[DocumentChunk]:
+        """Return the k most similar chunks, loading chunk text only for the winners."""
+        winners = self.rank(user, query_embedding, k, material_id)
+        if not winners:
+            return []
+        return self.load_chunks(winners)
+
+    def invalidate(self, user_id: int):
+        """Drop every cached matrix belonging to a user."""
+        with self._lock:
+            for key in [key for key in self._matrices if key[0] == user_id]:
+                del self._matrices[key]
+
+
+_search_engine = None
+_search_engine_lock = threading.Lock()
+
+
+def get_search_engine() -> VectorSearchEngine:
+    """Return the process-wide search engine so matrices survive across requests."""
+    global _search_engine
+    if _search_engine is None:
+        with _search_engine_lock:
+            if _search_engine is None:
+                _search_engine = VectorSearchEngine()
+    return _search_engine
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .lexical import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Subject scopes from the LLM classification prompt, used as seed training text so
+# the classifier is useful before any conversation history exists
+SUBJECT_KEYWORDS = {
+    'math': "Mathematics, calculations, equations, formulas, numbers, algebra, geometry, trigonometry, calculus, statistics, arithmetic, probability, logic, patterns, sequences",
+    'science': "Physics, chemistry, biology, natural phenomena, experiments, technology, engineering, transport, vehicles, machines, nature, environment, space, astronomy, weather, climate, human body, animals, plants, materials, energy, forces, motion, atoms, molecules, cells, ecosystems",
+    'english': "Language, grammar, literature, writing, reading, vocabulary, communication, stories, poetry, essays, linguistics, rhetoric, composition, literary analysis, language arts",
+    'history': "Past events, historical figures, civilizations, wars, politics, social studies, cultural studies, ancient times, medieval period, modern era, revolutions, discoveries, historical analysis",
+    'computer_science': "Programming, coding, software, computers, technology, algorithms, data structures, databases, networks, artificial intelligence, machine learning, web development, cybersecurity, digital systems",
+    'geography': "Earth, countries, cities, maps, landforms, climate zones, population, natural resources, environmental issues, physical geography, human geography, cartography",
+    'economics': "Money, finance, business, trade, markets, supply and demand, inflation, GDP, economic systems, banking, investment, economic theory, microeconomics, macroeconomics",
+    'psychology': "Human behavior, mental processes, emotions, cognition, learning, memory, personality, social psychology, developmental psychology, mental health, brain function",
+    'philosophy': "Ethics, logic, metaphysics, epistemology, moral philosophy, critical thinking, reasoning, philosophical theories, wisdom, knowledge, existence, values",
+    'arts': "Visual arts, music, theater, dance, creative expression, artistic techniques, art history, cultural arts, design, aesthetics, creativity",
+}
+
+SUBJECTS = list(SUBJECT_KEYWORDS)
+
+# Each seed keyword counts as this many observed occurrences
+SEED_WEIGHT = 3
+
+
+def message_features(text: str) -> List[str]:
+    """Index terms with a crude plural strip, so 'plants' and 'plant' share a feature."""
+    features = []
+    for token in tokenize(text):
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        features.append(token)
+    return features
+
+
+class SubjectClassifier:
+    """Multinomial naive Bayes over message terms.
+
+    Terms the model has never seen are ignored; a message with no known terms is
+    returned as 'general' with zero confidence so callers fall back to the LLM.
+    """
+
+    def __init__(self, subjects: List[str], log_priors: np.ndarray, term_log_probs: Dict[str, np.ndarray],
+                 example_count: int = 0):
+        self.subjects = subjects
+        self.log_priors = log_priors
+        self.term_log_probs = term_log_probs
+        self.example_count = example_count
+
+    @classmethod
+    def train(cls, examples: Iterable[Tuple[str, str]], alpha: float = 1.0) -> 'SubjectClassifier':
+        """Fit on (message, subject) pairs plus the built-in subject keywords."""
+        index = {subject: i for i, subject in enumerate(SUBJECTS)}
+        term_counts = [Counter() for _ in SUBJECTS]
+        class_counts = np.ones(len(SUBJECTS))
+        example_count = 0
+
+        for subject, keywords in SUBJECT_KEYWORDS.items():
+            for feature in message_features(keywords):
+                term_counts[index[subject]][feature] += SEED_WEIGHT
+
+        for text, subject in examples:
+            if subject not in index:
+                continue
+            term_counts[index[subject]].update(message_features(text))
+            class_counts[index[subject]] += 1
+            example_count += 1
+
+        vocabulary = sorted(set().union(*term_counts))
+        totals = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float64)
+        denominators = np.log(totals + alpha * len(vocabulary))
+        term_log_probs = {
+            term: np.log(np.array([counts[term] for counts in term_counts]) + alpha) - denominators
+            for term in vocabulary
+        }
+        log_priors = np.log(class_counts / class_counts.sum())
+        return cls(list(SUBJECTS), log_priors, term_log_probs, example_count)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Return (subject, posterior probability of that subject)."""
+        rows = [self.term_log_probs[feature] for feature in message_features(text) if feature in self.term_log_probs]
+        if not rows:
+            return 'general', 0.0
+        scores = self.log_priors + np.sum(rows, axis=0)
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        best = int(probabilities.argmax())
+        return self.subjects[best], float(probabilities[best])
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            'subjects': self.subjects,
+            'log_priors': self.log_priors.tolist(),
+            'terms': {term: values.tolist() for term, values in self.term_log_probs.items()},
+            'example_count': self.example_count,
+        }
+        # Write then rename so running workers never read a half-written model
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'SubjectClassifier':
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+        return cls(
+            data['subjects'],
+            np.asarray(data['log_priors']),
+            {term: np.asarray(values) for term, values in data['terms'].items()},
+            data.get('example_count', 0),
+        )
+
+
+def training_examples():
+    """Yield (message, subject) pairs from user messages in conversations with a known subject."""
+    from .models import ChatMessage
+
+    return (ChatMessage.objects
+            .filter(message_type='user', conversation__subject__in=SUBJECTS)
+            .values_list('content', 'conversation__subject')
+            .iterator())
+
+
+def classifier_path() -> Path:
+    return Path(getattr(settings, 'SUBJECT_CLASSIFIER_PATH', None)
+                or Path(settings.MEDIA_ROOT) / 'models' / 'subject_classifier.json')
+
+
+_classifier = None
+_classifier_mtime = None
+_classifier_lock = threading.Lock()
+
+
+def get_subject_classifier() -> SubjectClassifier:
+    """Return the trained classifier, reloading it when the model file changes.
+
+    Without a trained model file the classifier uses the built-in subject keywords only.
+    """
+    global _classifier, _classifier_mtime
+    path = classifier_path()
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+
+    if _classifier is None or mtime != _classifier_mtime:
+        with _classifier_lock:
+            if _classifier is None or mtime != _classifier_mtime:
+                classifier = None
+                if mtime is not None:
+                    try:
+                        classifier = SubjectClassifier.load(path)
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.error(f"Error loading subject classifier from {path}: {e}")
+                _classifier = classifier or SubjectClassifier.train([])
+                _classifier_mtime = mtime
+    return _classifier
@@ -1,23 +1,37 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import login, authenticate, logout
+from django.contrib.auth import login, authenticate, logout, get_user
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib import messages
 from django.utils import timezone
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.conf import settings
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Substr
+from django.template.loader import render_to_string
+from asgiref.sync import async_to_sync, sync_to_async
+from datetime import datetime, timedelta, timezone as dt_timezone
+import hashlib
 import json
 import logging
 import re
-import os
-from .models import UserProfile, Conversation, ChatMessage, StudySession, CustomLearningMaterial, DocumentChunk, RAGQuery
-from .agents import StudyCompanionAgents
+from .models import (UserProfile, Conversation, ChatMessage, StudySession, CustomLearningMaterial, BackgroundJob,
+                     SubjectClassification)
+from .agents import NO_RESPONSE, get_study_agents
+from .answer_cache import estimate_tokens, get_answer_cache
 from .rag_service import RAGService
-import openai
+from .database import read_from_replica
+from .deletion import delete_conversations, delete_learning_materials, queue_material_cleanup
+from .embedding_cache import normalize_query
+from .hedging import first_success
+from .llm_client import CircuitOpenError, acreate_chat_completion
+from .jobs import enqueue_job
+from .retrieval import get_search_engine
+from .subject_classifier import get_subject_classifier
 
 logger = logging.getLogger(__name__)
 
@@ -41,7 +55,6 @@ def chatbot_view(request):
         welcome_message = None
         if selected_subject:
             # Generate welcome message from agent
-            agents = StudyCompanionAgents()
             agent_label = f"[{selected_subject.replace('_', ' ').title()} Agent]: "
             # You can customize welcome messages per subject if desired
             welcome_text = f"Welcome to {selected_subject.replace('_', ' ').title()}! How can I help you today?"
@@ -141,31 +154,68 @@ def logout_view(request):
     messages.success(request, 'You have been successfully logged out.')
     return redirect('chatbot')
 
+# Conversations per history page, and characters of each message preview
+CONVERSATIONS_PER_PAGE = 10
+MESSAGE_PREVIEW_CHARS = 120
+
+# Origin of the timestamps in conversation cursors
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+def encode_conversation_cursor(conversation):
+    """Opaque keyset cursor: microseconds since the epoch of updated_at, and the id as tie-breaker."""
+    delta = conversation.updated_at - EPOCH
+    return f"{delta // timedelta(microseconds=1)}.{conversation.id}"
+
+def decode_conversation_cursor(cursor):
+    """(updated_at, id) from a cursor; raises ValueError if it is malformed."""
+    micros, conversation_id = cursor.split('.')
+    return EPOCH + timedelta(microseconds=int(micros)), int(conversation_id)
+
+def conversation_page(user, cursor=None, limit=CONVERSATIONS_PER_PAGE):
+    """Return (conversations, next cursor) for one page of a user's history, newest first.
+
+    Keyset pagination on (updated_at, id): each page seeks from the previous page's last
+    row, so no COUNT(*) or OFFSET grows with the history. Message count and previews are
+    correlated subqueries, evaluated only for the rows on the page.
+    """
+    messages = ChatMessage.objects.filter(conversation=OuterRef('pk'))
+    latest = messages.order_by('-timestamp', '-id')
+    conversations = Conversation.objects.filter(user=user).annotate(
+        message_count=Coalesce(Subquery(
+            messages.order_by().values('conversation').annotate(count=Count('id')).values('count')
+        ), 0),
+        first_message=Subquery(
+            messages.filter(message_type='user').order_by('timestamp', 'id')
+            .values(preview=Substr('content', 1, MESSAGE_PREVIEW_CHARS))[:1]
+        ),
+        last_message=Subquery(latest.values(preview=Substr('content', 1, MESSAGE_PREVIEW_CHARS))[:1]),
+        last_message_type=Subquery(latest.values('message_type')[:1]),
+    ).order_by('-updated_at', '-id')
+    
+    if cursor:
+        updated_at, conversation_id = decode_conversation_cursor(cursor)
+        # Written as a range on updated_at plus a tie-break, so the index can seek to the cursor
+        conversations = conversations.filter(updated_at__lte=updated_at).filter(
+            Q(updated_at__lt=updated_at) | Q(id__lt=conversation_id)
+        )
+    
+    page = list(conversations[:limit + 1])
+    next_cursor = encode_conversation_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
 @login_required
+@read_from_replica
 def conversation_history(request):
-    """Display conversation history with pagination."""
+    """Display conversation history; older pages load by cursor (infinite scroll, or the link without JavaScript)."""
     try:
-        conversations_list = Conversation.objects.filter(
-            user=request.user
-        ).order_by('-updated_at').prefetch_related('messages')
-        
-        paginator = Paginator(conversations_list, 10)
-        page = request.GET.get('page')
-        
         try:
-            conversations = paginator.page(page)
-        except PageNotAnInteger:
-            conversations = paginator.page(1)
-        except EmptyPage:
-            conversations = paginator.page(paginator.num_pages)
-        
-        # Fetch learning materials for sidebar
-        learning_materials = CustomLearningMaterial.objects.filter(user=request.user).order_by('-created_at')
+            conversations, next_cursor = conversation_page(request.user, request.GET.get('cursor'))
+        except ValueError:
+            conversations, next_cursor = conversation_page(request.user)
         
         return render(request, 'aistudycompanion/conversation_history.html', {
             'conversations': conversations,
-            'paginator': paginator,
-            'learning_materials': learning_materials,
+            'next_cursor': next_cursor,
         })
     except Exception as e:
         logger.error(f"Error in conversation_history view: {e}")
@@ -174,11 +224,35 @@ def conversation_history(request):
             'error_message': 'Sorry, there was a problem loading your conversation history.'
         })
 
+@login_required
+@read_from_replica
+def conversation_history_api(request):
+    """JSON page of conversation history for infinite scroll: data, rendered cards and the next cursor."""
+    try:
+        conversations, next_cursor = conversation_page(request.user, request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+    
+    return JsonResponse({
+        'conversations': [{
+            'id': conversation.id,
+            'title': conversation.title,
+            'subject': conversation.subject,
+            'updated_at': conversation.updated_at.isoformat(),
+            'message_count': conversation.message_count,
+            'first_message': conversation.first_message,
+            'last_message': conversation.last_message,
+            'last_message_type': conversation.last_message_type,
+        } for conversation in conversations],
+        'html': render_to_string('aistudycompanion/conversation_cards.html', {'conversations': conversations}, request=request),
+        'next_cursor': next_cursor,
+    })
+
 @login_required
 def conversation_detail(request, conversation_id):
     """Display detailed view of a specific conversation."""
     conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
-    messages_list = conversation.messages.all().order_by('timestamp')
+    messages_list = conversation.messages.all().order_by('timestamp', 'id')
     
     return render(request, 'aistudycompanion/conversation_detail.html', {
         'conversation': conversation,
@@ -191,13 +265,9 @@ def delete_conversation(request, conversation_id):
     """Delete a conversation and all its messages."""
     if request.method == 'POST':
         try:
-            conversation = get_object_or_404(Conversation, id=conversation_id, user=request.user)
-            
-            # Delete all messages in the conversation first
-            conversation.messages.all().delete()
-            
-            # Delete the conversation
-            conversation.delete()
+            deleted, _ = delete_conversations(Conversation.objects.filter(id=conversation_id, user=request.user))
+            if not deleted:
+                raise Http404("Conversation not found")
             
             return JsonResponse({
                 'success': True,
@@ -222,8 +292,9 @@ def delete_all_conversations(request):
     """Delete all conversations and messages for the current user."""
     if request.method == 'POST':
         try:
-            conversations = Conversation.objects.filter(user=request.user)
-            conversation_count = conversations.count()
+            conversation_count, total_messages = delete_conversations(
+                Conversation.objects.filter(user=request.user)
+            )
             
             if conversation_count == 0:
                 return JsonResponse({
@@ -232,16 +303,6 @@ def delete_all_conversations(request):
                     'deleted_count': 0
                 })
             
-            # Delete all messages first (cascade delete)
-            total_messages = 0
-            for conversation in conversations:
-                message_count = conversation.messages.count()
-                total_messages += message_count
-                conversation.messages.all().delete()
-            
-            # Delete all conversations
-            conversations.delete()
-            
             logger.info(f"Deleted {conversation_count} conversations and {total_messages} messages for user {request.user.username}")
             
             return JsonResponse({
@@ -264,6 +325,7 @@ def delete_all_conversations(request):
     }, status=405)
 
 @login_required
+@read_from_replica
 def learning_materials_view(request):
     """Display user's learning materials."""
     try:
@@ -320,7 +382,7 @@ def upload_learning_material(request):
             file_extension = file_name.split('.')[-1].lower()
             
             # Validate file type
-            allowed_extensions = ['pdf', 'doc', 'docx', 'txt']
+            allowed_extensions = ['pdf', 'docx', 'txt']
             if file_extension not in allowed_extensions:
                 return JsonResponse({
                     'success': False,
@@ -343,20 +405,15 @@ def upload_learning_material(request):
                 file_size=uploaded_file.size
             )
             
-            # Process document for RAG (async)
-            try:
-                rag_service = RAGService()
-                # Process in background (you might want to use Celery for this)
-                success = rag_service.process_document(material)
-                if not success:
-                    logger.warning(f"Failed to process document: {material.title}")
-            except Exception as e:
-                logger.error(f"Error processing document: {e}")
+            # Queue the document for RAG processing by the run_jobs worker
+            job = enqueue_job('process_document', material=material)
             
             return JsonResponse({
                 'success': True,
                 'message': 'File uploaded successfully',
                 'material_id': material.id,
+                'job_id': job.id,
+                'status_url': reverse('learning_material_status', args=[material.id]),
                 'material_title': material.title
             })
             
@@ -372,24 +429,88 @@ def upload_learning_material(request):
         'message': 'Invalid request method'
     }, status=405)
 
+@login_required
+def learning_material_status(request, material_id):
+    """Report processing status and progress for a learning material."""
+    material = get_object_or_404(CustomLearningMaterial, id=material_id, user=request.user)
+    job = (BackgroundJob.objects
+           .filter(material=material, kind__in=['process_document', 'reprocess_document'])
+           .order_by('-created_at').first())
+    
+    if job and job.status in ('queued', 'running'):
+        progress = job.progress
+    else:
+        progress = 100 if material.is_processed else 0
+    return JsonResponse({
+        'material_id': material.id,
+        'processing_status': material.processing_status,
+        'is_processed': material.is_processed,
+        'progress': progress,
+        'job_status': job.status if job else None,
+        'error': job.error if job and job.status == 'failed' else '',
+    })
+
 @login_required
 @csrf_exempt
-def delete_learning_material(request, material_id):
-    """Delete a learning material and all its chunks."""
+def reprocess_learning_material(request, material_id):
+    """Re-ingest a learning material, optionally replacing its file; only changed chunks are re-embedded."""
     if request.method == 'POST':
         try:
             material = get_object_or_404(CustomLearningMaterial, id=material_id, user=request.user)
+            uploaded_file = request.FILES.get('file')
             
-            # Delete file from storage
-            if material.file:
-                if default_storage.exists(material.file.name):
-                    default_storage.delete(material.file.name)
+            if uploaded_file is not None:
+                # Validate file size (15MB limit)
+                max_size = 15 * 1024 * 1024  # 15MB
+                if uploaded_file.size > max_size:
+                    return JsonResponse({
+                        'success': False,
+                        'message': 'File size exceeds 15MB limit'
+                    }, status=400)
+                
+                file_extension = uploaded_file.name.split('.')[-1].lower()
+                allowed_extensions = ['pdf', 'docx', 'txt']
+                if file_extension not in allowed_extensions:
+                    return JsonResponse({
+                        'success': False,
+                        'message': f'File type not supported. Allowed types: {", ".join(allowed_extensions)}'
+                    }, status=400)
             
-            # Delete all chunks
-            material.chunks.all().delete()
+            job = material.reprocess(new_file=uploaded_file)
             
-            # Delete the material
-            material.delete()
+            return JsonResponse({
+                'success': True,
+                'message': 'Material queued for reprocessing',
+                'material_id': material.id,
+                'job_id': job.id,
+                'status_url': reverse('learning_material_status', args=[material.id])
+            })
+            
+        except Exception as e:
+            logger.error(f"Error reprocessing learning material: {e}")
+            return JsonResponse({
+                'success': False,
+                'message': 'Error reprocessing learning material'
+            }, status=500)
+    
+    return JsonResponse({
+        'success': False,
+        'message': 'Invalid request method'
+    }, status=405)
+
+@login_required
+@csrf_exempt
+def delete_learning_material(request, material_id):
+    """Delete a learning material and all its chunks."""
+    if request.method == 'POST':
+        try:
+            material = get_object_or_404(CustomLearningMaterial.objects.only('id', 'user_id', 'file'),
+                                         id=material_id, user=request.user)
+            
+            # Rows go now in batches; the file and ANN indexes are removed by a cleanup job
+            delete_learning_materials(CustomLearningMaterial.objects.filter(id=material.id))
+            get_search_engine().invalidate(request.user.id)
+            queue_material_cleanup([material])
             
             return JsonResponse({
                 'success': True,
@@ -408,9 +529,14 @@ def delete_learning_material(request, material_id):
         'message': 'Invalid request method'
     }, status=405)
 
-@csrf_exempt
-def chatbot_api(request):
-    """API endpoint for chatbot responses."""
+def async_csrf_exempt(view_func):
+    """csrf_exempt for coroutine views; Django 4.2's decorator wraps them in a sync function."""
+    view_func.csrf_exempt = True
+    return view_func
+
+@async_csrf_exempt
+async def chatbot_api(request):
+    """API endpoint for chatbot responses; async so LLM calls do not hold a worker under ASGI."""
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
@@ -423,11 +549,13 @@ def chatbot_api(request):
             if not user_message:
                 return JsonResponse({'response': 'Please enter a message.'})
             
+            # request.user loads lazily with a blocking query, so resolve it in a thread
+            user = await sync_to_async(get_user)(request)
             # Handle authenticated and anonymous users
-            if request.user.is_authenticated:
-                response_data = handle_authenticated_chat(request.user, user_message, conversation_id, material_id, subject)
+            if user.is_authenticated:
+                response_data = await handle_authenticated_chat(user, user_message, conversation_id, material_id, subject)
             else:
-                response_data = handle_anonymous_chat(user_message)
+                response_data = await handle_anonymous_chat(user_message)
             
             return JsonResponse(response_data)
             
@@ -436,8 +564,43 @@ def chatbot_api(request):
     
     return JsonResponse({'response': 'Only POST requests are allowed.'}, status=405)
 
-@csrf_exempt
-def subject_help_api(request):
+@async_csrf_exempt
+async def chatbot_stream_api(request):
+    """Streaming variant of chatbot_api: answer tokens are sent as Server-Sent Events as they arrive.
+
+    The events come from an async generator, so under ASGI each token is sent as soon as
+    the model produces it; WSGI servers receive the stream only once it has finished.
+    """
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'response': 'Invalid request format.'}, status=400)
+        user_message = data.get('message', '').strip()
+        conversation_id = data.get('conversation_id')
+        material_id = data.get('material_id')  # For RAG queries
+        subject = data.get('subject', '').strip() or None
+
+        if not user_message:
+            return JsonResponse({'response': 'Please enter a message.'})
+
+        # request.user loads lazily with a blocking query, so resolve it in a thread
+        user = await sync_to_async(get_user)(request)
+        if user.is_authenticated:
+            events = await stream_authenticated_chat(user, user_message, conversation_id, material_id, subject)
+        else:
+            events = stream_anonymous_chat(user_message)
+
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    return JsonResponse({'response': 'Only POST requests are allowed.'}, status=405)
+
+@async_csrf_exempt
+async def subject_help_api(request):
     """API endpoint for subject-specific help."""
     if request.method == 'POST':
         try:
@@ -448,15 +611,16 @@ def subject_help_api(request):
             if not subject or not question:
                 return JsonResponse({'error': 'Subject and question are required.'}, status=400)
             
-            # Initialize agents
-            agents = StudyCompanionAgents()
+            # Shared agents, built on first use
+            agents = get_study_agents()
             
-            # Get subject-specific help
-            response = agents.get_subject_help(subject, question)
+            # Get subject-specific help, reusing cached answers to similar questions
+            response, metadata = await cached_subject_help(agents, subject, question)
             
             return JsonResponse({
                 'response': response,
                 'subject': subject,
+                'cached': metadata.get('cached', False),
                 'status': 'success'
             })
             
@@ -465,17 +629,19 @@ def subject_help_api(request):
     
     return JsonResponse({'error': 'Only POST requests are allowed.'}, status=405)
 
-def handle_authenticated_chat(user, user_message, conversation_id=None, material_id=None, subject=None):
+async def handle_authenticated_chat(user, user_message, conversation_id=None, material_id=None, subject=None):
     """Handle chat for authenticated users by passing directly to the agent."""
     # Check if this is a RAG query (material_id provided)
     if material_id:
         try:
-            material = CustomLearningMaterial.objects.get(id=material_id, user=user)
+            material = await CustomLearningMaterial.objects.aget(id=material_id, user=user)
             if material.is_processed:
                 rag_service = RAGService()
-                response, confidence, relevant_chunks = rag_service.generate_rag_response(user, user_message, material_id)
+                response, confidence, relevant_chunks, packing = await rag_service.agenerate_rag_response(
+                    user, user_message, material_id)
                 # Save RAG query
-                rag_service.save_rag_query(user, material, user_message, response, relevant_chunks, confidence)
+                await rag_service.asave_rag_query(user, material, user_message, response, relevant_chunks, confidence,
+                                                  packing)
                 return {
                     'response': f"[RAG Response - {material.title}]: {response}",
                     'status': 'success',
@@ -493,118 +659,315 @@ def handle_authenticated_chat(user, user_message, conversation_id=None, material
                 'status': 'error'
             }
     # Regular chat handling
-    if conversation_id:
-        conversation = get_object_or_404(Conversation, id=conversation_id, user=user)
-    else:
-        # Create new conversation with smart title
-        title = generate_conversation_title(user_message)
-        conversation = Conversation.objects.create(
-            user=user,
-            title=title,
-            subject=subject or detect_subject(user_message)
-        )
-    # Always use LLM subject detection for routing
-    subject_for_agent = subject if subject and subject != 'general' else detect_subject(user_message)
-    if subject_for_agent and subject_for_agent != 'general':
-        conversation.subject = subject_for_agent
-        conversation.save()
-    # Save user message
-    ChatMessage.objects.create(
-        conversation=conversation,
-        message_type='user',
-        content=user_message
-    )
-    # Initialize agents only once per request
-    agents = StudyCompanionAgents()
+    conversation, subject_for_agent, detected_subject = await astart_chat_turn(user, user_message, conversation_id, subject)
+    # Shared agents, built on first use
+    agents = get_study_agents()
     # Get bot response, passing the detected subject and agents
-    bot_response = get_enhanced_chatbot_response(user, user_message, conversation, subject_for_agent, agents)
-    # Save bot response
-    ChatMessage.objects.create(
-        conversation=conversation,
-        message_type='bot',
-        content=bot_response
-    )
-    # Update conversation
-    conversation.updated_at = timezone.now()
-    conversation.save()
-    # Update study session
-    update_study_session(user, user_message)
+    bot_response, metadata = await get_enhanced_chatbot_response(user, user_message, conversation, subject_for_agent,
+                                                                 agents, detected_subject=detected_subject)
+    await afinish_chat_turn(user, conversation, user_message, bot_response, detected_subject, metadata)
     return {
         'response': bot_response,
         'status': 'success',
+        'cached': metadata.get('cached', False),
         'conversation_id': conversation.id,
         'conversation_title': conversation.title
     }
 
-def handle_anonymous_chat(user_message):
+def finish_chat_turn(user, conversation, user_message, bot_response, detected_subject, metadata=None):
+    """Persist a chat turn in one short transaction, after the answer is known.
+
+    Saves or touches the conversation, inserts both messages with one bulk_create and
+    upserts the study session.
+    """
+    with transaction.atomic():
+        if conversation.pk is None:
+            conversation.save()
+        else:
+            conversation.updated_at = timezone.now()
+            Conversation.objects.filter(pk=conversation.pk).update(subject=conversation.subject,
+                                                                   updated_at=conversation.updated_at)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(conversation=conversation, message_type='user', content=user_message),
+            ChatMessage(conversation=conversation, message_type='bot', content=bot_response, metadata=metadata or {}),
+        ])
+        update_study_session(user, user_message, detected_subject)
+
+async def astart_chat_turn(user, user_message, conversation_id=None, subject=None):
+    """Classify the message and resolve its conversation, without writing anything.
+
+    A new conversation is returned unsaved; finish_chat_turn stores it with the rest of
+    the turn. Returns (conversation, subject_for_agent, detected_subject).
+    """
+    # Classify the message once; the result is reused for the conversation, routing and the study session
+    detected_subject = await adetect_subject(user_message)
+    if conversation_id:
+        try:
+            conversation = await Conversation.objects.aget(id=conversation_id, user=user)
+        except Conversation.DoesNotExist:
+            raise Http404("No Conversation matches the given query.")
+    else:
+        conversation = Conversation(
+            user=user,
+            title=generate_conversation_title(user_message),
+            subject=subject or detected_subject
+        )
+    subject_for_agent = subject if subject and subject != 'general' else detected_subject
+    if subject_for_agent and subject_for_agent != 'general':
+        conversation.subject = subject_for_agent
+    return conversation, subject_for_agent, detected_subject
+
+async def afinish_chat_turn(user, conversation, user_message, bot_response, detected_subject, metadata=None):
+    """Async finish_chat_turn; the async ORM cannot open transactions, so the turn is written in a thread."""
+    await sync_to_async(finish_chat_turn)(user, conversation, user_message, bot_response, detected_subject, metadata)
+
+async def handle_anonymous_chat(user_message):
     """Handle chat for anonymous users by passing directly to the agent."""
-    agents = StudyCompanionAgents()
-    bot_response = agents.get_subject_help('general', user_message)
+    agents = get_study_agents()
+    bot_response = await agents.aget_subject_help('general', user_message)
     return {
         'response': bot_response,
         'status': 'success',
         'conversation_id': None
     }
 
-def get_enhanced_chatbot_response(user, user_message, conversation, subject_for_agent=None, agents=None):
-    detected_subject = None
-    # If a subject is provided (from conversation) and not 'general', use it
-    if subject_for_agent and subject_for_agent != 'general':
-        detected_subject = subject_for_agent
-    else:
-        # Otherwise, use the detected subject from the message
-        detected_subject = detect_subject(user_message)
+def sse_event(payload):
+    """Format one Server-Sent Events message."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+async def aiter_texts(*texts):
+    """Async iterator over fixed text, for answers that are known before streaming starts."""
+    for text in texts:
+        yield text
 
-    if detected_subject and detected_subject != 'general':
+async def stream_chat_events(tokens, on_finish, label='', start=None, done=None):
+    """Yield SSE messages for a streamed answer.
+
+    Sends a 'start' event, one 'token' event per text delta of the async iterator
+    ``tokens`` (the label first) and a final 'done' event carrying the full response.
+    The coroutine ``on_finish(text, complete)`` runs once the stream ends; if the
+    client disconnects first, it receives what was generated so far with ``complete=False``.
+    """
+    parts = [label] if label else []
+    finished = False
+    status = 'success'
+    try:
+        yield sse_event({'type': 'start', **(start or {})})
+        if label:
+            yield sse_event({'type': 'token', 'content': label})
+        generated = False
         try:
-            if agents is None:
-                agents = StudyCompanionAgents()
-            agent_response = agents.get_subject_help(detected_subject, user_message)
-            # Always prepend agent name for clarity
-            agent_label = f"[{detected_subject.title().replace('_', ' ')} Agent]: "
-            if not agent_response.strip().lower().startswith(agent_label.lower()):
-                return agent_label + agent_response
-            return agent_response
+            async for token in tokens:
+                generated = True
+                parts.append(token)
+                yield sse_event({'type': 'token', 'content': token})
         except Exception as e:
-            logger.error(f"Error with {detected_subject} agent: {e}")
-            # Fallback to science agent for general questions
-            try:
-                agent_response = agents.get_subject_help('science', user_message)
-                agent_label = "[Science Agent]: "
-                if not agent_response.strip().lower().startswith(agent_label.lower()):
-                    return agent_label + agent_response
-                return agent_response
-            except Exception as e2:
-                logger.error(f"Error with science fallback: {e2}")
-                return "I'm sorry, but I cannot provide help at this time. Please try again later."
-
-    # For general questions, try science agent first, then math, then english
-    fallback_subjects = ['science', 'math', 'english']
-    for subject in fallback_subjects:
+            logger.error(f"Error streaming chat response: {e}")
+            status = 'error'
+            if not generated:
+                message = "I'm sorry, but I cannot provide help at this time. Please try again later."
+                parts = [message]
+                yield sse_event({'type': 'error', 'content': message})
+        finished = True
+        response_text = ''.join(parts)
+        await on_finish(response_text, status == 'success')
+        yield sse_event({'type': 'done', 'status': status, 'response': response_text, **(done or {})})
+    finally:
+        if not finished and parts:
+            await on_finish(''.join(parts), False)
+
+async def discard_answer(text, complete):
+    """on_finish for streams that store nothing."""
+
+async def stream_authenticated_chat(user, user_message, conversation_id=None, material_id=None, subject=None):
+    """Streaming counterpart of handle_authenticated_chat; returns an async iterator of SSE messages.
+
+    Messages are classified and saved before streaming starts; the bot message is saved
+    when the stream finishes.
+    """
+    if material_id:
         try:
-            if agents is None:
-                agents = StudyCompanionAgents()
-            agent_response = agents.get_subject_help(subject, user_message)
-            agent_label = f"[{subject.title()} Agent]: "
-            if not agent_response.strip().lower().startswith(agent_label.lower()):
-                return agent_label + agent_response
-            return agent_response
+            material = await CustomLearningMaterial.objects.aget(id=material_id, user=user)
+        except CustomLearningMaterial.DoesNotExist:
+            return stream_chat_events(aiter_texts("The specified learning material was not found."),
+                                      discard_answer, done={'status': 'error'})
+        if not material.is_processed:
+            message = f"Your document '{material.title}' is still being processed. Please wait a moment and try again."
+            return stream_chat_events(aiter_texts(message), discard_answer, done={'status': 'processing'})
+
+        rag_service = RAGService()
+        try:
+            tokens, confidence, relevant_chunks, packing = await rag_service.astream_rag_response(user, user_message,
+                                                                                                 material_id)
+        except Exception as e:
+            logger.error(f"Error generating RAG response: {e}")
+            tokens, confidence, relevant_chunks, packing = aiter_texts(), 0.0, [], None
+        label = f"[RAG Response - {material.title}]: "
+
+        async def save_rag_answer(text, complete):
+            await rag_service.asave_rag_query(user, material, user_message, text.removeprefix(label), relevant_chunks,
+                                              confidence, packing)
+
+        return stream_chat_events(tokens, save_rag_answer, label=label,
+                                  start={'material_title': material.title},
+                                  done={'confidence': confidence, 'material_title': material.title})
+
+    conversation, subject_for_agent, detected_subject = await astart_chat_turn(user, user_message, conversation_id,
+                                                                               subject)
+    if conversation.pk is None:
+        # The start event carries the conversation id; the messages are still written when the stream ends
+        await conversation.asave()
+    agents = get_study_agents()
+    cache = get_answer_cache()
+    # Filled in by stream_with_fallback once an agent starts answering
+    answered = {'metadata': {}}
+    done = {}
+
+    async def save_answer(text, complete):
+        await afinish_chat_turn(user, conversation, user_message, text, detected_subject, answered['metadata'])
+        if 'subject' not in answered:
+            return
+        answer = text.removeprefix(answered['label'])
+        if answered['use_cache'] and not answered['hit'] and complete and answer:
+            await cache.astore(answered['subject'], user_message, answer,
+                               subject_help_tokens(agents, answered['subject'], user_message, answer))
+
+    async def tokens():
+        async for token in stream_with_fallback(agents, agent_candidates(subject_for_agent), user_message, answered):
+            yield token
+        done['cached'] = bool(answered['hit'])
+
+    return stream_chat_events(tokens(), save_answer,
+                              start={'conversation_id': conversation.id, 'conversation_title': conversation.title},
+                              done=done)
+
+def stream_anonymous_chat(user_message):
+    """Streaming counterpart of handle_anonymous_chat; nothing is saved."""
+    tokens = get_study_agents().astream_subject_help('general', user_message)
+    return stream_chat_events(tokens, discard_answer, start={'conversation_id': None})
+
+async def stream_with_fallback(agents, candidates, user_message, answered):
+    """Yield the label and answer tokens of the first candidate agent that starts answering.
+
+    The streaming counterpart of the hedged fallback in get_enhanced_chatbot_response:
+    an agent that fails before its first token is skipped for the next candidate. Once
+    tokens have been sent the answer cannot switch agents, so later errors propagate.
+    ``answered`` receives the subject, label, cache hit and message metadata used.
+    """
+    cache = get_answer_cache()
+    error = None
+    for subject, label in candidates:
+        use_cache = cache.enabled and agents.can_answer(subject)
+        hit = await cache.alookup(subject, user_message) if use_cache else None
+        tokens = aiter_texts(hit.answer) if hit else agents.astream_subject_help(subject, user_message)
+        try:
+            first = await tokens.__anext__()
+        except StopAsyncIteration:
+            first = ''
+        except CircuitOpenError:
+            # Every fallback would hit the same unavailable API
+            raise
         except Exception as e:
-            logger.error(f"Error with {subject} fallback: {e}")
+            logger.error(f"Error with {subject} agent: {e}")
+            error = e
             continue
+        answered.update(subject=subject, label=label, hit=hit, use_cache=use_cache,
+                        metadata=hit.metadata() if hit else {'cached': False})
+        yield label
+        if first:
+            yield first
+        async for token in tokens:
+            yield token
+        return
+    raise error
+
+def agent_candidates(subject):
+    """(subject, label) pairs to try in order: the subject, then science; general questions try science, math, english."""
+    if subject and subject != 'general':
+        candidates = [(subject, f"[{subject.title().replace('_', ' ')} Agent]: ")]
+        if subject != 'science':
+            candidates.append(('science', "[Science Agent]: "))
+        return candidates
+    return [(subject, f"[{subject.title()} Agent]: ") for subject in ['science', 'math', 'english']]
 
-    return "I'm sorry, but I cannot provide help at this time. Please try again later."
+async def get_enhanced_chatbot_response(user, user_message, conversation, subject_for_agent=None, agents=None,
+                                        detected_subject=None):
+    """Return (response, ChatMessage metadata) from the routed subject agent."""
+    # If a subject is provided (from conversation) and not 'general', use it
+    if subject_for_agent and subject_for_agent != 'general':
+        detected_subject = subject_for_agent
+    elif detected_subject is None:
+        # Otherwise, use the detected subject from the message
+        detected_subject = await adetect_subject(user_message)
+    if agents is None:
+        agents = get_study_agents()
+
+    candidates = agent_candidates(detected_subject)
+
+    def attempt(subject):
+        async def call():
+            try:
+                return await cached_subject_help(agents, subject, user_message)
+            except Exception as e:
+                logger.error(f"Error with {subject} agent: {e}")
+                raise
+        return call
+
+    # Fallbacks are hedged rather than tried one after another: the next agent starts when one
+    # fails or is still silent after the budget, with at most AGENT_FALLBACK_FAN_OUT in flight
+    try:
+        index, (agent_response, metadata) = await first_success(
+            [attempt(subject) for subject, _ in candidates],
+            budget=getattr(settings, 'AGENT_FALLBACK_BUDGET', 8.0),
+            fan_out=getattr(settings, 'AGENT_FALLBACK_FAN_OUT', 2),
+            # Every fallback would hit the same unavailable API
+            abort_on=(CircuitOpenError,)
+        )
+    except Exception:
+        # Each failure was logged by its attempt
+        return "I'm sorry, but I cannot provide help at this time. Please try again later.", {}
+
+    agent_label = candidates[index][1]
+    if not agent_response.strip().lower().startswith(agent_label.lower()):
+        return agent_label + agent_response, metadata
+    return agent_response, metadata
+
+async def cached_subject_help(agents, subject, question):
+    """Subject help through the semantic answer cache; returns (answer, ChatMessage metadata)."""
+    cache = get_answer_cache()
+    if not (cache.enabled and agents.can_answer(subject)):
+        return await agents.aget_subject_help(subject, question), {}
+    hit = await cache.alookup(subject, question)
+    if hit:
+        return hit.answer, hit.metadata()
+    answer = await agents.aget_subject_help(subject, question)
+    if answer != NO_RESPONSE:
+        await cache.astore(subject, question, answer, subject_help_tokens(agents, subject, question, answer))
+    return answer, {'cached': False}
+
+def subject_help_tokens(agents, subject, question, answer):
+    """Estimated prompt and completion tokens of one subject-help call."""
+    return estimate_tokens(*(message['content'] for message in agents.direct_messages(subject, question)), answer)
 
 def generate_conversation_title(user_message):
     """Generate a title for a new conversation based on the first message."""
     words = user_message.split()[:5]
     return " ".join(words).capitalize() + "..."
 
-def llm_detect_subject(user_message):
-    """Advanced LLM-based subject detection with confidence scoring and multi-subject support."""
-    client = openai.OpenAI(api_key=getattr(settings, 'OPENAI_API_KEY', None))
+async def _allm_classify_subject(user_message):
+    """Ask the LLM for the primary subject; returns (subject, confidence) and raises on API errors."""
+    response = await acreate_chat_completion(
+        model="gpt-3.5-turbo",
+        messages=[{"role": "user", "content": subject_classification_prompt(user_message)}],
+        max_tokens=200,
+        temperature=0.1,
+        timeout=getattr(settings, 'LLM_CLASSIFY_TIMEOUT', 10.0)
+    )
+    return parse_subject_classification(response.choices[0].message.content)
+
+def subject_classification_prompt(user_message):
     # Comprehensive subject classification prompt
-    prompt = f"""You are an expert educational subject classifier with high accuracy. Analyze the following question and provide a detailed classification.
+    return f"""You are an expert educational subject classifier with high accuracy. Analyze the following question and provide a detailed classification.
                 Available subjects and their scope:
                 - math: Mathematics, calculations, equations, formulas, numbers, algebra, geometry, trigonometry, calculus, statistics, arithmetic, probability, logic, patterns, sequences
                 - science: Physics, chemistry, biology, natural phenomena, experiments, technology, engineering, transport, vehicles, machines, nature, environment, space, astronomy, weather, climate, human body, animals, plants, materials, energy, forces, motion, atoms, molecules, cells, ecosystems
@@ -635,45 +998,81 @@ def llm_detect_subject(user_message):
                 - "What is the history of mathematics?" → PRIMARY: history, SECONDARY: math, CONFIDENCE: 8
                 - "Explain photosynthesis" → PRIMARY: science, SECONDARY: none, CONFIDENCE: 10
                 Classification:"""
+
+def parse_subject_classification(response_text):
+    """Parse the classifier reply into (subject, confidence)."""
+    response_text = response_text.strip()
+    primary_subject = 'general'
+    confidence = 5
+    lines = response_text.split('\n')
+    for line in lines:
+        line = line.strip()
+        if line.startswith('PRIMARY:'):
+            primary_subject = line.replace('PRIMARY:', '').strip().lower()
+        elif line.startswith('CONFIDENCE:'):
+            try:
+                confidence = int(line.replace('CONFIDENCE:', '').strip())
+            except ValueError:
+                confidence = 5
     
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=200,
-            temperature=0.1
-        )
-        
-        response_text = response.choices[0].message.content.strip()
+    # Validate the primary subject
+    valid_subjects = ['math', 'science', 'english', 'history', 'computer_science', 
+                     'geography', 'economics', 'psychology', 'philosophy', 'arts', 'general']
+    if primary_subject not in valid_subjects:
         primary_subject = 'general'
-        confidence = 5
-        lines = response_text.split('\n')
-        for line in lines:
-            line = line.strip()
-            if line.startswith('PRIMARY:'):
-                primary_subject = line.replace('PRIMARY:', '').strip().lower()
-            elif line.startswith('CONFIDENCE:'):
-                try:
-                    confidence = int(line.replace('CONFIDENCE:', '').strip())
-                except ValueError:
-                    confidence = 5
-        
-        # Validate the primary subject
-        valid_subjects = ['math', 'science', 'english', 'history', 'computer_science', 
-                         'geography', 'economics', 'psychology', 'philosophy', 'arts', 'general']
-        if primary_subject not in valid_subjects:
-            primary_subject = 'general'
-        
-        logger.debug(f"LLM subject detection: {primary_subject} (confidence: {confidence})")
-        return primary_subject
-        
+    
+    logger.debug(f"LLM subject detection: {primary_subject} (confidence: {confidence})")
+    return primary_subject, confidence
+
+def subject_text_hash(user_message):
+    """Cache key for a message: SHA-256 of its case-folded, whitespace-normalized text."""
+    return hashlib.sha256(normalize_query(user_message).encode('utf-8')).hexdigest()
+
+async def adetect_subject(user_message):
+    """Classify a message, asking the LLM only when cheaper signals are not confident.
+
+    Order: math patterns, the local classifier (above SUBJECT_CLASSIFIER_THRESHOLD),
+    the persistent SubjectClassification cache of earlier LLM answers, then the LLM.
+    Call once per message and pass the result along.
+    """
+    local_subject = detect_subject_locally(user_message)
+    if local_subject:
+        return local_subject
+    
+    text_hash = subject_text_hash(user_message)
+    cached = await SubjectClassification.objects.filter(text_hash=text_hash).values_list('id', 'subject').afirst()
+    if cached:
+        await SubjectClassification.objects.filter(id=cached[0]).aupdate(
+            hit_count=F('hit_count') + 1,
+            last_used_at=timezone.now()
+        )
+        logger.debug(f"Cached subject detection: '{user_message}' -> '{cached[1]}'")
+        return cached[1]
+    
+    try:
+        detected, confidence = await _allm_classify_subject(user_message)
     except Exception as e:
         logger.error(f"LLM Subject Detection Error: {e}")
-        # Fallback to general on error
-        return "general"
+        # Fallback to general on error; not cached so the next attempt retries
+        return 'general'
+    
+    try:
+        await SubjectClassification.objects.aget_or_create(
+            text_hash=text_hash,
+            defaults={'subject': detected, 'confidence': confidence}
+        )
+    except Exception as e:
+        logger.warning(f"Error caching subject classification: {e}")
+    
+    logger.debug(f"Final subject detection: '{user_message}' -> '{detected}'")
+    return detected
 
 def detect_subject(user_message):
-    detected = llm_detect_subject(user_message)
+    """Sync adetect_subject, for callers outside the event loop."""
+    return async_to_sync(adetect_subject)(user_message)
+
+def detect_subject_locally(user_message):
+    """Math patterns, then the local classifier; None when neither is confident."""
     math_patterns = [
         r'\b\d+\s*[\+\-\*/]\s*\d+\b',  # e.g., 2 + 90, 5*3, 10-4
         r'\b[a-z]\s*[+\-*/^]\s*[a-z]\b',
@@ -686,34 +1085,37 @@ def detect_subject(user_message):
         r'multiply\s+\d+\s*[×*]\s*\d+'
     ]
     
-    # Override with math if clear mathematical patterns are found
+    # Clear mathematical patterns always win, so check them before anything else
     for pattern in math_patterns:
         if re.search(pattern, user_message.lower()):
-            detected = 'math'
-            logger.debug("Math pattern detected, overriding LLM result")
-            break
+            logger.debug("Math pattern detected, skipping LLM classification")
+            return 'math'
     
-    logger.debug(f"Final subject detection: '{user_message}' -> '{detected}'")
-    return detected
-
-def update_study_session(user, user_message):
-    """Update the current study session with new activity."""
-    try:
-        session = StudySession.objects.get(user=user, end_time__isnull=True)
-        session.questions_asked += 1
-        
-        # Detect subject from message
-        detected_subject = detect_subject(user_message)
-        if detected_subject != 'general':
-            session.subject = detected_subject
-        
-        session.save()
-    except StudySession.DoesNotExist:
-        # Create new session if none exists
-        StudySession.objects.create(
-            user=user,
-            subject=detect_subject(user_message),
-            questions_asked=1
-        )
+    if getattr(settings, 'SUBJECT_CLASSIFIER_ENABLED', True):
+        local_subject, probability = get_subject_classifier().predict(user_message)
+        if probability >= getattr(settings, 'SUBJECT_CLASSIFIER_THRESHOLD', 0.85):
+            logger.debug(f"Local subject detection: '{user_message}' -> '{local_subject}' ({probability:.2f})")
+            return local_subject
+    return None
 
+def update_study_session(user, user_message, detected_subject=None):
+    """Count a question in the user's open study session, opening one if needed; pass detected_subject to avoid reclassifying.
 
+    The counter is incremented with F() in a single UPDATE. The partial unique constraint
+    on open sessions makes a concurrent insert fail instead of creating a second session,
+    in which case the session the other request opened is updated.
+    """
+    if detected_subject is None:
+        detected_subject = detect_subject(user_message)
+    changes = {'questions_asked': F('questions_asked') + 1}
+    if detected_subject != 'general':
+        changes['subject'] = detected_subject
+    open_session = StudySession.objects.filter(user=user, end_time__isnull=True)
+    if open_session.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            StudySession.objects.create(user=user, subject=detected_subject, questions_asked=1)
+    except IntegrityError:
+        # Another turn opened the session first
+        open_session.update(**changes)